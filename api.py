@@ -17,11 +17,56 @@ def parse_args():
     parser.add_argument('--openspg-service', type=str, default='http://127.0.0.1:8887')
     parser.add_argument('--openspg-modules', type=str, nargs='*', default=[])
     parser.add_argument('--openspg-config', type=str, default='config')
+    parser.add_argument('--openspg-timeout', type=float, default=5,
+                        help='seconds to wait for the project list of the OpenSPG server before the snapshot is used')
+    parser.add_argument('--project-snapshot', type=str, default='.snapshots/projects.json',
+                        help='file keeping the last project list of the OpenSPG server, so the server starts while '
+                             'OpenSPG is slow or down, empty to disable')
+    parser.add_argument('--ready-projects', type=int, default=1,
+                        help='projects with warm solvers needed before /readyz reports ready, 0 for all of them')
+    parser.add_argument('--solver-loops', type=int, default=4,
+                        help='number of shared event loops running the solvers, 0 to run on the server loop')
+    parser.add_argument('--max-concurrent-solves', type=int, default=32,
+                        help='max solves running at the same time, the others wait in a queue')
+    parser.add_argument('--solver-pool-size', type=int, default=4,
+                        help='max idle solver pipelines kept per project, 0 to rebuild the solver on every query')
+    parser.add_argument('--solver-pool-warmup', type=int, default=1,
+                        help='solver pipelines built per project at startup')
+    parser.add_argument('--solver-pool-idle-timeout', type=float, default=600,
+                        help='seconds before an idle solver pipeline is evicted')
+    parser.add_argument('--batch-dir', type=str, default='.batches',
+                        help='folder of the batch jobs, their inputs and results')
+    parser.add_argument('--batch-workers', type=int, default=8,
+                        help='max batch requests solved at the same time, over all batch jobs')
+    parser.add_argument('--report-mode', type=str, default='full', choices=['full', 'delta'],
+                        help="reporter events while streaming: 'full' state of a report on each change, "
+                             "or 'delta' only the changes, numbered")
+    parser.add_argument('--report-flush-interval', type=float, default=0,
+                        help='seconds to merge the reporter changes into one event, 0 to send every change')
+    parser.add_argument('--refresh-interval', type=float, default=30,
+                        help='seconds between reloads of the projects, their configs and the API keys, 0 to disable')
+    parser.add_argument('--public-metrics', action='store_true',
+                        help='serve /metrics without an API key, e.g. to a scraper on a private network')
+    parser.add_argument('--trace-file', type=str, default=None,
+                        help='append a trace of the solver steps and upstream calls of every solve to this file '
+                             '(OTLP/JSON lines), no tracing if not set')
+    parser.add_argument('--max-active-requests', type=int, default=64,
+                        help='max chat completions admitted at the same time, 0 for no limit')
+    parser.add_argument('--max-project-requests', type=int, default=0,
+                        help='max chat completions admitted at the same time per project, 0 for no per-project limit')
+    parser.add_argument('--max-queued-requests', type=int, default=256,
+                        help='max chat completions waiting for admission, the others are rejected with 429')
+    parser.add_argument('--queue-timeout', type=float, default=30,
+                        help='seconds a chat completion waits for admission before it is rejected with 429')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='chat completions per second per API key, 0 for no rate limit')
+    parser.add_argument('--rate-limit-burst', type=float, default=10,
+                        help='chat completions an API key may send at once above its rate')
     return parser.parse_args()
 
 
 def init_app(args):
-    os.environ['KAG_PROJECT_ID'] = '1'
+    # no KAG_PROJECT_ID: the service loads the base project config itself, within --openspg-timeout
     os.environ['KAG_PROJECT_HOST_ADDR'] = args.openspg_service
 
     kag_version = importlib.metadata.version('openspg-kag')
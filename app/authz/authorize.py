@@ -1,34 +1,72 @@
 import json
 import logging
 import os
-from typing import List, Set
+from typing import FrozenSet, List, Optional, Tuple
 
 from fastapi import Header, HTTPException
 
 AUTHORIZATION_FILENAME = os.path.join(os.path.dirname(__file__), "api_keys.json")
 
 
+def read_api_keys() -> List[str]:
+    with open(AUTHORIZATION_FILENAME, "r") as f:
+        data = json.load(f)
+    return [str(x) for x in data.values()]
+
+
 def load_api_keys() -> List[str]:
     try:
-        with open(AUTHORIZATION_FILENAME, "r") as f:
-            data = json.load(f)
-        return [str(x) for x in data.values()]
+        return read_api_keys()
     except Exception as e:
         logging.info(f"Failed to load API keys: {e}")
         return []
 
 
-API_KEYS: Set[str] = set(load_api_keys())
+def stat_api_keys() -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(AUTHORIZATION_FILENAME)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+# replaced as a whole on reload, so a request sees either the old or the new keys
+API_KEYS: FrozenSet[str] = frozenset(load_api_keys())
+api_keys_stat = stat_api_keys()
+
+
+def reload_api_keys() -> bool:
+    """
+    reload the API keys if their file changed, a file that is missing or cannot be read keeps the current keys:
+    no keys turns authorization off, a file briefly missing while keys are rotated must not do that
+    :return: whether the keys were reloaded
+    """
+    global API_KEYS, api_keys_stat
+    stat = stat_api_keys()
+    if stat == api_keys_stat:
+        return False
+    if stat is None:
+        logging.warning(f"API keys file {AUTHORIZATION_FILENAME} is missing, keep the current keys")
+        return False
+    try:
+        keys = frozenset(read_api_keys())
+    except Exception as e:
+        logging.error(f"Failed to reload API keys, keep the current ones: {e}")
+        return False
+    API_KEYS, api_keys_stat = keys, stat
+    logging.info(f"Reloaded {len(keys)} API keys")
+    return True
 
 
 async def authenticate(api_key: str = Header(..., alias="Authorization")):
-    if len(API_KEYS) == 0:
+    api_keys = API_KEYS
+    if len(api_keys) == 0:
         return 'none'
 
     if api_key and api_key.startswith('Bearer\x20'):
-        api_key = ''.join(api_key.split('\x20')[1:])
+        api_key = api_key[7:].replace('\x20', '')
 
-    if api_key not in API_KEYS:
+    if api_key not in api_keys:
         raise HTTPException(status_code=401, detail="Unauthorized access")
 
     return api_key
@@ -1,16 +1,34 @@
-import json
+import dataclasses
+from enum import Enum
 from typing import Any, Mapping, Optional
 
 from fastapi.responses import Response
+from pydantic import BaseModel
 from starlette.background import BackgroundTask
 
-from app.utils import remove_empty_fields
+from app.utils import dumps_json, prune_empty_fields
 
 
-class JSONEncode(json.JSONEncoder):
+def encode_default(o: Any) -> Any:
+    """
+    the types the json encoder does not know, orjson encodes dataclasses and enums itself
+    """
+    if isinstance(o, BaseModel):
+        return o.model_dump(mode='json', exclude_none=True)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return {f.name: getattr(o, f.name) for f in dataclasses.fields(o)}
+    if isinstance(o, Enum):
+        return o.value
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
 
-    def default(self, o):
-        return super().default(o)
+
+def render_json(content: Any) -> bytes:
+    """
+    compact utf-8 json without the None fields, NaN and infinite floats are rejected with ValueError.
+    the None fields are dropped in one walk, which copies only the containers that have one, then it is
+    encoded once
+    """
+    return dumps_json(prune_empty_fields(content, allow_nan=False), default=encode_default, allow_nan=False)
 
 
 class JSONResponse(Response):
@@ -27,11 +45,4 @@ class JSONResponse(Response):
         super().__init__(content, status_code, headers, media_type, background)
 
     def render(self, content: Any) -> bytes:
-        return json.dumps(
-            remove_empty_fields(content),
-            ensure_ascii=False,
-            allow_nan=False,
-            indent=None,
-            separators=(",", ":"),
-            cls=JSONEncode
-        ).encode("utf-8")
+        return render_json(content)
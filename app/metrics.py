@@ -0,0 +1,225 @@
+"""
+Minimal in-process metrics: counters, gauges and histograms with labels.
+
+Metrics are created through the module-level helpers, which return the existing metric when the
+name was already registered, so modules imported twice (e.g. by `import_modules_from_path`) share them.
+A metric declared with labelnames is updated through `labels(...)`, e.g. `CACHE_HITS.labels(cache_root=x).inc()`.
+`REGISTRY.render()` exports all metrics in the prometheus text format.
+"""
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric(ABC):
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children: Dict[Tuple[str, ...], 'Metric'] = {}
+
+    def labels(self, **labels):
+        key = tuple(str(labels.get(x, '')) for x in self.labelnames)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.get(key)
+                if child is None:
+                    child = self.new_child()
+                    self.children[key] = child
+        return child
+
+    @abstractmethod
+    def new_child(self) -> 'Metric':
+        """
+        an unlabeled metric of the same kind, for one combination of label values
+        """
+        pass
+
+    def collect(self) -> List[Tuple[Dict[str, str], 'Metric']]:
+        """
+        :return: (labels, child) pairs, an unlabeled metric is its own only child
+        """
+        if not self.labelnames:
+            return [({}, self)]
+        with self.lock:
+            items = list(self.children.items())
+        return [(dict(zip(self.labelnames, key)), child) for key, child in items]
+
+    pass
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def new_child(self):
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def get(self) -> float:
+        return self.value
+
+    pass
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0.0
+
+    def new_child(self):
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self.lock:
+            self.value -= amount
+
+    def get(self) -> float:
+        return self.value
+
+    pass
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    pass
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+        self.collect_hooks: List[Callable[[], None]] = []
+
+    def register(self, metric_type, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_type(name, documentation, labelnames, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, metric_type):
+                raise ValueError(f'metric {name} already registered as {metric.kind}')
+            return metric
+
+    def on_collect(self, hook: Callable[[], None]):
+        """
+        hook is called before each collect, e.g. to set gauges sampled from live objects
+        """
+        with self.lock:
+            self.collect_hooks.append(hook)
+
+    def collect(self) -> List[Metric]:
+        with self.lock:
+            hooks = list(self.collect_hooks)
+        for hook in hooks:
+            hook()
+        with self.lock:
+            return list(self.metrics.values())
+
+    def render(self) -> str:
+        """
+        all metrics in the prometheus text exposition format
+        """
+        lines = []
+        for metric in sorted(self.collect(), key=lambda x: x.name):
+            lines.append(f'# HELP {metric.name} {escape_help(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for labels, child in metric.collect():
+                if isinstance(child, Histogram):
+                    with child.lock:
+                        counts, total, count = list(child.counts), child.sum, child.count
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(child.buckets) + [math.inf], counts):
+                        cumulative += bucket_count
+                        bucket_labels = dict(labels, le=format_value(bound))
+                        lines.append(f'{metric.name}_bucket{format_labels(bucket_labels)} {cumulative}')
+                    lines.append(f'{metric.name}_sum{format_labels(labels)} {format_value(total)}')
+                    lines.append(f'{metric.name}_count{format_labels(labels)} {count}')
+                else:
+                    lines.append(f'{metric.name}{format_labels(labels)} {format_value(child.get())}')
+        return '\n'.join(lines) + '\n'
+
+    pass
+
+
+def escape_help(text: str) -> str:
+    return text.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{escape_label_value(v)}"' for k, v in labels.items()) + '}'
+
+
+def format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter, name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram, name, documentation, labelnames, buckets=buckets)
@@ -0,0 +1,123 @@
+import logging
+import uuid
+
+from fastapi import FastAPI, HTTPException, Depends, Request
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+
+from app.authz.authorize import authenticate
+from app.openspg.api.model.batch_model import Batch, BatchList
+from app.openspg.api.model.openai_model import ChatCompletionRequest
+from app.openspg.api.openai_api import build_chat_completion
+from app.openspg.service.batch_jobs import BatchManager, BatchInputError
+from app.openspg.service.service_loader import get_service_loader
+
+
+def mount_routes(app: FastAPI, args):
+    api_prefix = f'{args.servlet}/openspg'
+    api_tag = 'Batch'
+    model_category = 'openspg'
+
+    loader = get_service_loader()
+
+    async def process(body: dict) -> dict:
+        try:
+            request = ChatCompletionRequest(**body)
+        except ValidationError as e:
+            raise ValueError(f'Invalid request: {e}')
+        if len(request.messages) < 1 or request.messages[-1].role != "user":
+            raise ValueError(f'Invalid messages: {request.messages}')
+        if not request.model.startswith(f'{model_category}/'):
+            raise ValueError(f'Invalid model id: {request.model}')
+        project_name = request.model[(len(model_category) + 1):]
+        # batches resumed at startup wait for the service instead of failing their requests
+        service = await loader.wait()
+        if project_name not in service.get_projects():
+            raise ValueError(f'Project {project_name} not found')
+
+        answer, usage, solve_time = await service.solve(request.messages[-1].content, project_name,
+                                                        raise_errors=True)
+        message_id = f'chat-{str(uuid.uuid4()).replace("-", "")}'
+        return build_chat_completion(request.model, message_id, answer, usage, solve_time).model_dump(exclude_none=True)
+
+    manager = BatchManager(args.batch_dir, process, workers=args.batch_workers)
+    app.add_event_handler('startup', manager.start)
+
+    def get_job(batch_id: str) -> dict:
+        job = manager.get(batch_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f'Batch {batch_id} not found')
+        return job
+
+    @app.post(
+        f'{api_prefix}/v1/batches',
+        response_model=Batch,
+        tags=[api_tag],
+        summary='Create Batch',
+        openapi_extra={'requestBody': {'content': {'application/jsonl': {'schema': {'type': 'string'}}}}},
+    )
+    async def create_batch(request: Request, api_key: str = Depends(authenticate)):
+        """
+        the request body is a jsonl file, one chat completion request per line:
+        `{"custom_id": "q1", "body": {"model": "openspg/TwoWiki", "messages": [...]}}`
+        """
+        logging.info(f'batch request by: {api_key}')
+        try:
+            return await manager.create(await request.body())
+        except BatchInputError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @app.get(
+        f'{api_prefix}/v1/batches',
+        response_model=BatchList,
+        tags=[api_tag],
+        summary='Batch List',
+    )
+    async def list_batches(api_key: str = Depends(authenticate)):
+        return BatchList(data=manager.list())
+
+    @app.get(
+        f'{api_prefix}/v1/batches/{{batch_id}}',
+        response_model=Batch,
+        tags=[api_tag],
+        summary='Batch Status',
+    )
+    async def get_batch(batch_id: str, api_key: str = Depends(authenticate)):
+        return get_job(batch_id)
+
+    @app.post(
+        f'{api_prefix}/v1/batches/{{batch_id}}/cancel',
+        response_model=Batch,
+        tags=[api_tag],
+        summary='Cancel Batch',
+    )
+    async def cancel_batch(batch_id: str, api_key: str = Depends(authenticate)):
+        get_job(batch_id)
+        return manager.cancel(batch_id)
+
+    @app.post(
+        f'{api_prefix}/v1/batches/{{batch_id}}/resume',
+        response_model=Batch,
+        tags=[api_tag],
+        summary='Resume Batch',
+    )
+    async def resume_batch(batch_id: str, api_key: str = Depends(authenticate)):
+        """
+        run the requests of a batch that have not completed yet, those that failed included
+        """
+        get_job(batch_id)
+        return manager.run(batch_id)
+
+    @app.get(
+        f'{api_prefix}/v1/batches/{{batch_id}}/output',
+        tags=[api_tag],
+        summary='Batch Output',
+    )
+    async def get_batch_output(batch_id: str, follow: bool = False, api_key: str = Depends(authenticate)):
+        """
+        the results as jsonl in completion order, with `follow` the response stays open until the batch stops
+        """
+        get_job(batch_id)
+        return StreamingResponse(manager.read_output(batch_id, follow=follow), media_type='application/jsonl')
+
+    pass
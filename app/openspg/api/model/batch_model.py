@@ -0,0 +1,25 @@
+from typing import Optional, List, Literal
+
+from pydantic import BaseModel
+
+
+class BatchRequestCounts(BaseModel):
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+
+
+class Batch(BaseModel):
+    id: str
+    object: str = "batch"
+    status: Literal["in_progress", "completed", "cancelled", "failed"]
+    created_at: int
+    completed_at: Optional[int] = None
+    request_counts: BatchRequestCounts
+    errors: Optional[str] = None
+    metadata: Optional[dict] = None
+
+
+class BatchList(BaseModel):
+    object: str = "list"
+    data: List[Batch] = None
@@ -1,5 +1,5 @@
 import time
-from typing import Optional, List, Literal, Union
+from typing import Optional, List, Literal, Union, Dict
 
 from pydantic import BaseModel, Field
 
@@ -34,6 +34,8 @@ class ChatCompletionRequest(BaseModel):
     stream: Optional[bool] = False
     tools: Optional[Union[dict, List[dict]]] = None
     repetition_penalty: Optional[float] = 1.1
+    # non-standard, 'full' or 'delta' reporter events while streaming, the server default if None
+    report_mode: Optional[Literal['full', 'delta']] = None
 
 
 class DeltaMessage(BaseModel):
@@ -47,9 +49,24 @@ class ChatCompletionResponseStreamChoice(BaseModel):
     index: int
 
 
+class ChatCompletionResponseChoice(BaseModel):
+    index: int
+    message: ChatMessage
+    finish_reason: Optional[Literal["stop", "length", "function_call"]]
+
+
+class UsageInfo(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+
 class ChatCompletionResponse(BaseModel):
     model: str
     id: str
     object: Literal["chat.completion", "chat.completion.chunk"]
-    choices: List[Union[ChatCompletionResponseStreamChoice]]
+    choices: List[Union[ChatCompletionResponseChoice, ChatCompletionResponseStreamChoice]]
     created: Optional[int] = Field(default_factory=lambda: int(time.time()))
+    usage: Optional[UsageInfo] = None
+    # non-standard, seconds spent per stage, e.g. {"solve": 3.2}
+    timing: Optional[Dict[str, float]] = None
@@ -1,17 +1,92 @@
-import asyncio
-import json
 import logging
-import threading
+import time
 import uuid
-from typing import Generator, Any
+from typing import AsyncIterator, Generator, Any, Optional, Union
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Response
 from sse_starlette.sse import EventSourceResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
 
 from app.authz.authorize import authenticate
+from app.metrics import counter, histogram
 from app.openspg.api.model.openai_model import ModelList, ChatCompletionResponse, ModelCard, ChatCompletionRequest, \
-    ChatCompletionResponseStreamChoice, DeltaMessage
-from app.openspg.service.kag_service import get_kag_service, EventQueue
+    ChatCompletionResponseChoice, ChatMessage, UsageInfo
+from app.openspg.service.admission import AdmissionRejected, get_admission_controller
+from app.openspg.service.refresher import get_refresher
+from app.openspg.service.service_loader import ServiceUnavailable, get_service_loader
+from app.openspg.service.tracing import TRACER
+from app.openspg.service.upstream import close_token_stream
+from app.utils import dumps_json
+
+REQUESTS = counter('openspg_requests_total', 'Chat completion requests', ['project', 'stream'])
+TIME_TO_FIRST_EVENT = histogram('openspg_time_to_first_event_seconds',
+                                'Seconds from a streamed request to its first server-sent event', ['project'])
+STREAM_EVENTS = counter('openspg_stream_events_total', 'Reporter events sent to clients', ['project'])
+STREAM_TOKENS = counter('openspg_stream_tokens_total', 'LLM token chunks sent to clients', ['project'])
+
+
+def default_encoder(x: Any) -> Any:
+    return x.__dict__ if hasattr(x, '__dict__') else str(x)
+
+
+def encode_content(content: Any) -> str:
+    return content if isinstance(content, str) else dumps_json(content, default=default_encoder).decode('utf-8')
+
+
+class ChatChunkEncoder:
+    """
+    Encodes the `chat.completion.chunk` server-sent events of one response.
+
+    the fields fixed for the whole response (model, id, object) are serialized once,
+    per event only the content is escaped and spliced in between. the bytes are the same as
+    `ChatCompletionResponse.model_dump_json(exclude_unset=True, exclude_none=True)` in an sse `data:` line
+    """
+
+    def __init__(self, model_id: str, message_id: str, sep: str = EventSourceResponse.DEFAULT_SEPARATOR):
+        head = dumps_json({'model': model_id, 'id': message_id, 'object': 'chat.completion.chunk'})
+        self.prefix = b'data: ' + head[:-1] + b',"choices":[{"delta":{"role":"assistant","content":'
+        self.end = (sep * 2).encode('utf-8')
+        self.suffixes = {None: b'},"index":0}]}' + self.end}
+        self.done = b'data: [DONE]' + self.end
+
+    def encode(self, content: Any, finish_reason: Optional[str] = None) -> bytes:
+        suffix = self.suffixes.get(finish_reason)
+        if suffix is None:
+            suffix = b'},"finish_reason":' + dumps_json(finish_reason) + b',"index":0}]}' + self.end
+            self.suffixes[finish_reason] = suffix
+        return self.prefix + dumps_json(encode_content(content)) + suffix
+
+    pass
+
+
+def build_chat_completion(model_id: str, message_id: str, answer: Any, usage: dict,
+                          solve_time: float) -> ChatCompletionResponse:
+    """
+    the `chat.completion` object of a non-streaming answer
+    """
+    return ChatCompletionResponse(
+        model=model_id,
+        id=message_id,
+        object='chat.completion',
+        choices=[ChatCompletionResponseChoice(
+            index=0,
+            message=ChatMessage(role='assistant', content=encode_content(answer)),
+            finish_reason='stop'
+        )],
+        usage=UsageInfo(**usage),
+        timing={'solve': round(solve_time, 3)},
+    )
+
+
+def get_service():
+    """
+    the KAG service, a 503 while it is loading
+    """
+    try:
+        return get_service_loader().get()
+    except ServiceUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': f'{e.retry_after:.0f}'})
 
 
 def mount_routes(app: FastAPI, args):
@@ -19,7 +94,28 @@ def mount_routes(app: FastAPI, args):
     api_tag = 'OpenAI'
     model_category = 'openspg'
 
-    service = get_kag_service(args.openspg_service, args.openspg_config, args.openspg_modules)
+    loader = get_service_loader()
+    admission = get_admission_controller(max_active=args.max_active_requests,
+                                         max_project_active=args.max_project_requests,
+                                         max_queued=args.max_queued_requests, queue_timeout=args.queue_timeout,
+                                         rate=args.rate_limit, burst=args.rate_limit_burst)
+    TRACER.configure(args.trace_file)
+    # projects added to the config dir or the OpenSPG server, and changed configs, without a restart
+    loader.on_load(lambda service: get_refresher(interval=args.refresh_interval).add('projects',
+                                                                                     service.refresh_projects))
+
+    def start_service():
+        # openspg-kag is imported and the projects are loaded while the server already listens, see /readyz
+        loader.start(ready_projects=args.ready_projects,
+                     service_url=args.openspg_service, config_dir=args.openspg_config,
+                     addition_modules=args.openspg_modules,
+                     solver_loops=args.solver_loops, max_concurrent_solves=args.max_concurrent_solves,
+                     solver_pool_size=args.solver_pool_size, solver_pool_warmup=args.solver_pool_warmup,
+                     solver_pool_idle_timeout=args.solver_pool_idle_timeout,
+                     report_mode=args.report_mode, report_flush_interval=args.report_flush_interval,
+                     project_snapshot=args.project_snapshot or None, server_timeout=args.openspg_timeout)
+
+    app.add_event_handler('startup', start_service)
 
     @app.get(
         f'{api_prefix}/v1/models',
@@ -28,7 +124,7 @@ def mount_routes(app: FastAPI, args):
         summary='Model List',
     )
     async def list_models():
-        projects = service.get_projects()
+        projects = get_service().get_projects()
         return ModelList(
             data=[ModelCard(id=f'{model_category}/{x}') for x in projects.keys()]
         )
@@ -41,8 +137,12 @@ def mount_routes(app: FastAPI, args):
     )
     async def create_chat_completion(
             request: ChatCompletionRequest,
-            api_key: str = Depends(authenticate)
-    ) -> EventSourceResponse:
+            response: Response,
+            api_key: str = Depends(authenticate),
+            debug_trace: bool = Header(False, alias='X-Debug-Trace',
+                                       description='return the id of the solve trace in `X-Trace-Id`'),
+    ) -> Union[ChatCompletionResponse, EventSourceResponse]:
+        request_time = time.perf_counter()
         logging.info(f'request by: {api_key}')
         if len(request.messages) < 1 or request.messages[-1].role != "user":
             raise HTTPException(status_code=400, detail=f'Invalid messages: {request.messages}')
@@ -53,54 +153,82 @@ def mount_routes(app: FastAPI, args):
             raise ValueError(f'Invalid model id: {model_id}')
 
         project_name = model_id[(len(model_category) + 1):]
+        service = get_service()
         projects = service.get_projects()
         if project_name not in projects:
             raise ValueError(f'Project {project_name} not found')
 
         query = request.messages[-1].content
-
-        def build_chat_completion_response(content: Any, message_id='', finish_reason=None):
-            default_encoder = lambda x: x.__dict__ if hasattr(x, '__dict__') else str(x)
-
-            choice = ChatCompletionResponseStreamChoice(
-                index=0,
-                delta=DeltaMessage(
-                    role="assistant",
-                    content=content if isinstance(content, str) else json.dumps(content, ensure_ascii=False, default=default_encoder)
-                ),
-                finish_reason=finish_reason
-            )
-            chunk = ChatCompletionResponse(
-                model=model_id,
-                id=message_id,
-                choices=[choice],
-                object='chat.completion.chunk'
-            )
-            return '{}'.format(chunk.model_dump_json(exclude_unset=True, exclude_none=True))
-
-        def stream_generate():
-            message_id = f'chat-{str(uuid.uuid4()).replace("-", "")}'
-            event_queue = EventQueue()
-
-            def printer(message):
-                event_queue.send(message)
-
-            def do_task():
-                asyncio.run(service.query(query, project_name, printer=printer))
-
-            executor = threading.Thread(target=do_task)
-            executor.start()
-
-            for event in event_queue:
-                if isinstance(event, Generator):
-                    for x in event:
-                        yield build_chat_completion_response(content=x, message_id=message_id)
-                elif event:
-                    yield build_chat_completion_response(content=event, message_id=message_id)
-
-            yield build_chat_completion_response(content='', message_id=message_id, finish_reason='stop')
-            yield '[DONE]'
-
-        return EventSourceResponse(stream_generate(), media_type="text/event-stream")
+        REQUESTS.labels(project=project_name, stream='true' if request.stream else 'false').inc()
+
+        message_id = f'chat-{str(uuid.uuid4()).replace("-", "")}'
+        trace_id = TRACER.new_trace_id() if TRACER.enabled else None
+        headers = {'X-Trace-Id': trace_id} if trace_id and debug_trace else {}
+
+        try:
+            ticket = await admission.acquire(project_name, api_key)
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': f'{e.retry_after:.0f}'})
+
+        if not request.stream:
+            try:
+                # only the final answer, intermediate reporter events are not built nor encoded
+                answer, usage, solve_time = await service.solve(query, project_name, trace_id=trace_id)
+            finally:
+                ticket.release()
+            response.headers.update(headers)
+            return build_chat_completion(model_id, message_id, answer, usage, solve_time)
+
+        encoder = ChatChunkEncoder(model_id, message_id)
+        events_sent = STREAM_EVENTS.labels(project=project_name)
+        tokens_sent = STREAM_TOKENS.labels(project=project_name)
+        first_event = True
+
+        def emit(content: Any, sent_counter) -> bytes:
+            nonlocal first_event
+            if first_event:
+                first_event = False
+                TIME_TO_FIRST_EVENT.labels(project=project_name).observe(time.perf_counter() - request_time)
+            sent_counter.inc()
+            return encoder.encode(content)
+
+        async def stream_generate():
+            events = service.stream_query(query, project_name, report_mode=request.report_mode, trace_id=trace_id)
+            try:
+                async for event in events:
+                    if isinstance(event, AsyncIterator):
+                        # token stream of an async upstream client (e.g. async_openai_llm), no thread is blocked
+                        try:
+                            async for x in event:
+                                yield emit(x, tokens_sent)
+                        finally:
+                            close_token_stream(event)
+                    elif isinstance(event, Generator):
+                        # streaming llm output, pull it in the threadpool so the blocking reads stay off the loop
+                        try:
+                            async for x in iterate_in_threadpool(event):
+                                yield emit(x, tokens_sent)
+                        finally:
+                            close_token_stream(event)
+                    elif event:
+                        yield emit(event, events_sent)
+
+                yield encoder.encode('', finish_reason='stop')
+                yield encoder.done
+            finally:
+                # closing the solver stream cancels the solve when the client left before its end
+                await events.aclose()
+                ticket.release()
+
+        stream = stream_generate()
+
+        async def close_stream():
+            # a client that disconnects while a chunk is sent leaves the stream suspended, close it explicitly
+            # instead of waiting for the garbage collector. also releases the slot if the stream never started
+            await stream.aclose()
+            ticket.release()
+
+        return EventSourceResponse(stream, media_type="text/event-stream", headers=headers,
+                                   background=BackgroundTask(close_stream))
 
     pass
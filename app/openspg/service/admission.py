@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from app.metrics import counter, gauge, histogram
+
+logger = logging.getLogger()
+
+ADMISSION_ACTIVE = gauge('openspg_admission_active', 'Requests holding an admission slot', ['project'])
+ADMISSION_QUEUE_DEPTH = gauge('openspg_admission_queue_depth', 'Requests waiting for an admission slot')
+ADMISSION_WAIT = histogram('openspg_admission_wait_seconds', 'Seconds waited for an admission slot', ['project'])
+ADMISSION_REJECTED = counter('openspg_admission_rejected_total', 'Requests rejected by the admission controller',
+                             ['project', 'reason'])
+
+
+class AdmissionRejected(Exception):
+    """
+    raised when a request is not admitted, `retry_after` is a hint in seconds for the client
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f'{reason}, retry after {retry_after:.0f}s')
+        self.reason = reason
+        self.retry_after = retry_after
+
+    pass
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, holding at most `burst` tokens
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """
+        :return: 0 if a token was taken, otherwise the seconds until the next token
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    pass
+
+
+class AdmissionTicket:
+    """
+    a slot held by an admitted request, `release()` may be called more than once
+    """
+
+    def __init__(self, controller: 'AdmissionController', project: str):
+        self.controller = controller
+        self.project = project
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self)
+
+    pass
+
+
+class AdmissionController:
+    """
+    Admits requests before they reach the solvers, so that overload queues or rejects them early
+    instead of slowing every request down.
+
+    - at most `max_active` requests run at the same time, and at most `max_project_active` per project
+    - each API key gets `rate` requests per second, bursts up to `burst`, 0 disables the rate limit
+    - the others wait in FIFO order, at most `max_queued` of them and for at most `queue_timeout` seconds;
+      a waiting request whose project is saturated does not block the requests of other projects
+    - requests over the rate limit or the queue size are rejected at once with a retry hint
+
+    must be used from a single event loop (the server loop)
+    """
+
+    def __init__(self,
+                 max_active: int = 64,
+                 max_project_active: int = 0,
+                 max_queued: int = 256,
+                 queue_timeout: float = 30,
+                 rate: float = 0,
+                 burst: float = 10):
+        """
+        :param max_active: 0 for no limit
+        :param max_project_active: 0 for the same limit as max_active
+        """
+        self.max_active = max_active or math.inf
+        self.max_project_active = max_project_active or self.max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+
+        self.active = 0
+        self.project_active: Dict[str, int] = {}
+        self.waiters = deque()
+        self.buckets: Dict[str, TokenBucket] = {}
+        # mean seconds a slot is held, to estimate Retry-After
+        self.mean_hold_time = 1.0
+
+    def can_run(self, project: str) -> bool:
+        return self.active < self.max_active and self.project_active.get(project, 0) < self.max_project_active
+
+    def retry_after(self) -> float:
+        slots = self.max_active if self.max_active != math.inf else max(1, self.active)
+        return max(1.0, math.ceil(self.mean_hold_time * (len(self.waiters) + 1) / slots))
+
+    def reject(self, project: str, reason: str, retry_after: float):
+        ADMISSION_REJECTED.labels(project=project, reason=reason).inc()
+        raise AdmissionRejected(reason, retry_after)
+
+    async def acquire(self, project: str, api_key: str) -> AdmissionTicket:
+        """
+        wait for a slot of the project
+        :raise AdmissionRejected: over the rate limit of the api key, queue full or waited too long
+        """
+        if self.rate > 0:
+            bucket = self.buckets.get(api_key)
+            if bucket is None:
+                bucket = self.buckets[api_key] = TokenBucket(self.rate, self.burst)
+            wait = bucket.take()
+            if wait > 0:
+                self.reject(project, 'rate_limited', math.ceil(wait))
+
+        # release() dispatches the waiters at once, so a waiter left in the queue cannot run: a request that can
+        # run does not jump ahead of a waiter of its own project, nor of anyone while all slots are taken
+        if self.can_run(project):
+            return self.admit(project, 0)
+
+        if len(self.waiters) >= self.max_queued:
+            self.reject(project, 'queue_full', self.retry_after())
+
+        waiter = (project, asyncio.get_running_loop().create_future(), time.monotonic())
+        self.waiters.append(waiter)
+        ADMISSION_QUEUE_DEPTH.set(len(self.waiters))
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter[1]), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.cancel_waiter(waiter)
+            self.reject(project, 'queue_timeout', self.retry_after())
+        except asyncio.CancelledError:
+            self.cancel_waiter(waiter)
+            raise
+
+    def cancel_waiter(self, waiter):
+        project, future, _ = waiter
+        if future.done():
+            # admitted while it was given up
+            future.result().release()
+            return
+        future.cancel()
+        self.waiters.remove(waiter)
+        ADMISSION_QUEUE_DEPTH.set(len(self.waiters))
+
+    def admit(self, project: str, wait: float) -> AdmissionTicket:
+        self.active += 1
+        self.project_active[project] = self.project_active.get(project, 0) + 1
+        ADMISSION_ACTIVE.labels(project=project).inc()
+        ADMISSION_WAIT.labels(project=project).observe(wait)
+        return AdmissionTicket(self, project)
+
+    def release(self, ticket: AdmissionTicket):
+        self.active -= 1
+        self.project_active[ticket.project] -= 1
+        ADMISSION_ACTIVE.labels(project=ticket.project).dec()
+        self.mean_hold_time = 0.9 * self.mean_hold_time + 0.1 * (time.monotonic() - ticket.admitted_at)
+        self.dispatch()
+
+    def dispatch(self):
+        """
+        admit the waiters in FIFO order, skipping those of saturated projects
+        """
+        if not self.waiters:
+            return
+        now = time.monotonic()
+        for waiter in list(self.waiters):
+            if self.active >= self.max_active:
+                break
+            project, future, queued_at = waiter
+            if self.can_run(project):
+                self.waiters.remove(waiter)
+                future.set_result(self.admit(project, now - queued_at))
+        ADMISSION_QUEUE_DEPTH.set(len(self.waiters))
+
+    @asynccontextmanager
+    async def admit_scope(self, project: str, api_key: str):
+        ticket = await self.acquire(project, api_key)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    pass
+
+
+admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller(**kwargs) -> AdmissionController:
+    global admission_controller
+    if admission_controller is None:
+        admission_controller = AdmissionController(**kwargs)
+    return admission_controller
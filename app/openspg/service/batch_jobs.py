@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+
+class BatchInputError(ValueError):
+    """
+    raised for an invalid jsonl input, with the line number
+    """
+    pass
+
+
+class BatchManager:
+    """
+    Runs batches of chat requests (one json per line) in the background, with a bounded worker pool.
+
+    each job is a folder under `root_dir`:
+    - `input.jsonl`: the requests, `{"custom_id": ..., "body": {...}}` or a bare request body per line
+    - `output.jsonl`: one result per finished request, in completion order, with its input `index` and `status`
+    - `job.json`: status and progress
+
+    completed requests are not run again, so a job interrupted by a restart or cancelled can be resumed.
+    failed requests (e.g. while the service was not loaded) are run again when the job is resumed, the output then
+    has a result per attempt and the last one of an index counts. jobs still in progress are resumed at startup
+    """
+
+    PROGRESS_INTERVAL = 1
+
+    def __init__(self, root_dir: str, process: Callable[[dict], Awaitable[dict]], workers: int = 8):
+        """
+        :param process: runs one request body, returns the response body or raises
+        :param workers: max requests running at the same time, over all jobs
+        """
+        self.root_dir = root_dir
+        self.process = process
+        self.workers = workers
+        self.jobs: Dict[str, dict] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # cancelled runs that have not stopped yet, a resumed run waits for them
+        self.stopping: Dict[str, asyncio.Task] = {}
+        self._semaphore = None
+        os.makedirs(root_dir, exist_ok=True)
+        self.load_jobs()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, so that it binds to the server loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        return self._semaphore
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.root_dir, job_id)
+
+    def load_jobs(self):
+        for job_id in sorted(os.listdir(self.root_dir)):
+            filename = os.path.join(self.job_dir(job_id), 'job.json')
+            if not os.path.isfile(filename):
+                continue
+            try:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    self.jobs[job_id] = json.load(f)
+            except ValueError as e:
+                logger.error(f'invalid batch job {filename}: {e}')
+        logger.info(f'loaded {len(self.jobs)} batch jobs from {self.root_dir}')
+
+    def save_job(self, job: dict):
+        filename = os.path.join(self.job_dir(job['id']), 'job.json')
+        with open(f'{filename}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(f'{filename}.tmp', filename)
+
+    def start(self):
+        """
+        resume the jobs that were in progress, must be called on the server loop
+        """
+        for job in self.jobs.values():
+            if job['status'] == 'in_progress':
+                self.run(job['id'])
+
+    @staticmethod
+    def parse_input(content: bytes) -> List[dict]:
+        items = []
+        for line_no, line in enumerate(content.decode('utf-8').splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise BatchInputError(f'line {line_no}: invalid json, {e}')
+            if not isinstance(item, dict):
+                raise BatchInputError(f'line {line_no}: expect a json object')
+            body = item.get('body', item)
+            if not isinstance(body, dict):
+                raise BatchInputError(f'line {line_no}: expect a json object as body')
+            items.append({'custom_id': item.get('custom_id', str(len(items))), 'body': body})
+        if not items:
+            raise BatchInputError('empty batch')
+        return items
+
+    async def create(self, content: bytes, metadata: Optional[dict] = None) -> dict:
+        """
+        parsed and written on a worker thread, a large batch does not hold up the server loop
+        :raise BatchInputError: invalid input
+        """
+        job = await asyncio.to_thread(self.write_job, content, metadata)
+        self.jobs[job['id']] = job
+        self.run(job['id'])
+        return job
+
+    def write_job(self, content: bytes, metadata: Optional[dict] = None) -> dict:
+        items = self.parse_input(content)
+        job_id = f'batch_{uuid.uuid4().hex}'
+        os.makedirs(self.job_dir(job_id))
+        with open(os.path.join(self.job_dir(job_id), 'input.jsonl'), 'w', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+        job = {
+            'id': job_id,
+            'object': 'batch',
+            'status': 'in_progress',
+            'created_at': int(time.time()),
+            'completed_at': None,
+            'request_counts': {'total': len(items), 'completed': 0, 'failed': 0},
+            'metadata': metadata,
+        }
+        self.save_job(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[dict]:
+        return sorted(self.jobs.values(), key=lambda x: x['created_at'], reverse=True)
+
+    def run(self, job_id: str) -> dict:
+        job = self.jobs[job_id]
+        if job_id not in self.tasks:
+            job['status'] = 'in_progress'
+            job['completed_at'] = None
+            self.save_job(job)
+            self.tasks[job_id] = asyncio.create_task(self.run_job(job, previous=self.stopping.get(job_id)))
+        return job
+
+    def cancel(self, job_id: str) -> dict:
+        job = self.jobs[job_id]
+        task = self.tasks.pop(job_id, None)
+        if task is not None:
+            task.cancel()
+            self.stopping[job_id] = task
+        if job['status'] == 'in_progress':
+            job['status'] = 'cancelled'
+            self.save_job(job)
+        return job
+
+    def read_job(self, job_id: str) -> Tuple[List[dict], Dict[int, str]]:
+        """
+        :return: the requests and the status of the finished ones
+        """
+        with open(os.path.join(self.job_dir(job_id), 'input.jsonl'), 'r', encoding='utf-8') as f:
+            items = [json.loads(x) for x in f if x.strip()]
+        return items, self.read_done(job_id)
+
+    def read_done(self, job_id: str) -> Dict[int, str]:
+        """
+        :return: index -> status of the last result of the finished requests. a partly written last line is cut off
+        """
+        filename = os.path.join(self.job_dir(job_id), 'output.jsonl')
+        if not os.path.exists(filename):
+            return {}
+        with open(filename, 'rb') as f:
+            content = f.read()
+        end = content.rfind(b'\n') + 1
+        if end < len(content):
+            with open(filename, 'r+b') as f:
+                f.truncate(end)
+        done = {}
+        for line in content[:end].splitlines():
+            record = json.loads(line)
+            done[record['index']] = record['status']
+        return done
+
+    async def run_job(self, job: dict, previous: Optional[asyncio.Task] = None):
+        """
+        :param previous: a cancelled run of the job, waited for so that both never write the output at once
+        """
+        job_id = job['id']
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            items, done = await asyncio.to_thread(self.read_job, job_id)
+            # the failed requests are run again
+            completed = {index for index, status in done.items() if status == 'completed'}
+            counts = job['request_counts']
+            counts['completed'] = len(completed)
+            counts['failed'] = 0
+            self.save_job(job)
+
+            last_saved = time.monotonic()
+            running = set()
+            with open(os.path.join(self.job_dir(job_id), 'output.jsonl'), 'a', encoding='utf-8') as output:
+                def on_done(task: asyncio.Task):
+                    nonlocal last_saved
+                    running.discard(task)
+                    self.semaphore.release()
+                    if task.cancelled() or output.closed:
+                        return
+                    record = task.result()
+                    output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    output.flush()
+                    counts[record['status']] += 1
+                    if time.monotonic() - last_saved > self.PROGRESS_INTERVAL:
+                        self.save_job(job)
+                        last_saved = time.monotonic()
+
+                try:
+                    for index, item in enumerate(items):
+                        if index in completed:
+                            continue
+                        await self.semaphore.acquire()
+                        task = asyncio.create_task(self.run_item(job_id, index, item))
+                        running.add(task)
+                        task.add_done_callback(on_done)
+                    if running:
+                        await asyncio.wait(list(running))
+                except asyncio.CancelledError:
+                    for task in list(running):
+                        task.cancel()
+                    raise
+
+            job['status'] = 'completed'
+            job['completed_at'] = int(time.time())
+        except asyncio.CancelledError:
+            logger.info(f'batch job {job_id} cancelled')
+        except Exception as e:
+            logger.exception(f'batch job {job_id} failed')
+            job['status'] = 'failed'
+            job['errors'] = str(e)
+        finally:
+            # a cancelled run must not forget the run that resumed the job
+            if self.tasks.get(job_id) is asyncio.current_task():
+                del self.tasks[job_id]
+            if self.stopping.get(job_id) is asyncio.current_task():
+                del self.stopping[job_id]
+            self.save_job(job)
+
+    async def run_item(self, job_id: str, index: int, item: dict) -> dict:
+        record = {'id': f'{job_id}-{index}', 'index': index, 'custom_id': item['custom_id']}
+        try:
+            record['response'] = await self.process(item['body'])
+            record['status'] = 'completed'
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            record['status'] = 'failed'
+            record['error'] = str(e)
+        return record
+
+    async def read_output(self, job_id: str, follow: bool = False, poll_interval: float = 0.5) \
+            -> AsyncGenerator[bytes, None]:
+        """
+        yield the output lines written so far, with follow keep yielding new lines until the job stops
+        """
+        filename = os.path.join(self.job_dir(job_id), 'output.jsonl')
+        offset = 0
+        while True:
+            running = self.jobs[job_id]['status'] == 'in_progress'
+            if os.path.exists(filename):
+                content = await asyncio.to_thread(self._read_from, filename, offset)
+                # only whole lines
+                end = content.rfind(b'\n') + 1
+                if end:
+                    offset += end
+                    yield content[:end]
+            if not follow or not running:
+                return
+            await asyncio.sleep(poll_interval)
+
+    @staticmethod
+    def _read_from(filename: str, offset: int) -> bytes:
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            return f.read()
+
+    pass
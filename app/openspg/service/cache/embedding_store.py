@@ -0,0 +1,212 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+import numpy as np
+from filelock import FileLock, Timeout
+
+from app.openspg.service.cache.storage import CACHE_LOCK_TIMEOUTS, CacheStorage
+
+logger = logging.getLogger()
+
+
+class EmbeddingCacheStorage(CacheStorage):
+    """
+    Fixed-width binary storage for embedding vectors.
+
+    - `embeddings.bin`: vectors appended as float32 (or float16) records, memory-mapped for reads
+    - `embeddings.idx`: append-only (md5 digest, record number) entries, record number -1 marks a deletion
+    - `embeddings.json`: dimensions and dtype, fixed by the first vector written
+
+    reads return numpy views into the mapped file without copying. only the response (the vector) is kept,
+    the request params are not stored. appends from several processes are serialized by a file lock,
+    readers pick up the records of other processes on their next miss (deletions on their next refresh).
+    a write that cannot get the lock within `lock_timeout` seconds is skipped, and a partial record left at
+    the end of a file by a crash is cut off before the next append.
+    """
+
+    DATA_FILENAME = 'embeddings.bin'
+    INDEX_FILENAME = 'embeddings.idx'
+    META_FILENAME = 'embeddings.json'
+    INDEX_ENTRY = struct.Struct('<16sq')
+
+    def __init__(self, cache_root: str, dtype: str = 'float32', lock_timeout: float = 10):
+        os.makedirs(cache_root, exist_ok=True)
+        self.cache_root = cache_root
+        self.data_filename = os.path.join(cache_root, self.DATA_FILENAME)
+        self.index_filename = os.path.join(cache_root, self.INDEX_FILENAME)
+        self.meta_filename = os.path.join(cache_root, self.META_FILENAME)
+        self.file_lock = FileLock(os.path.join(cache_root, 'embeddings.lock'), timeout=lock_timeout)
+        self.lock_timeouts = CACHE_LOCK_TIMEOUTS.labels(cache_root=cache_root)
+        self.lock = threading.Lock()
+
+        self.dtype = np.dtype(dtype)
+        self.dimensions: Optional[int] = None
+        self.index: Dict[bytes, int] = {}
+        self.index_offset = 0
+        self.mapped = None
+        self.mapped_records = 0
+
+        self.load_meta()
+        self.refresh_index()
+
+    @property
+    def record_size(self) -> int:
+        return self.dimensions * self.dtype.itemsize
+
+    def load_meta(self):
+        if not os.path.exists(self.meta_filename):
+            return
+        with open(self.meta_filename, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dimensions = int(meta['dimensions'])
+        self.dtype = np.dtype(meta['dtype'])
+
+    def save_meta(self, dimensions: int):
+        self.dimensions = dimensions
+        with open(self.meta_filename, 'w', encoding='utf-8') as f:
+            json.dump({'dimensions': self.dimensions, 'dtype': self.dtype.name}, f)
+
+    def refresh_index(self):
+        """
+        load the index entries appended since the last refresh
+        """
+        with self.lock:
+            if not os.path.exists(self.index_filename):
+                return
+            with open(self.index_filename, 'rb') as f:
+                f.seek(self.index_offset)
+                content = f.read()
+            content = content[:len(content) - len(content) % self.INDEX_ENTRY.size]
+            for digest, record_no in self.INDEX_ENTRY.iter_unpack(content):
+                if record_no < 0:
+                    self.index.pop(digest, None)
+                else:
+                    self.index[digest] = record_no
+            self.index_offset += len(content)
+            if self.dimensions is None and self.index:
+                self.load_meta()
+
+    def remap(self):
+        with self.lock:
+            size = os.path.getsize(self.data_filename) if os.path.exists(self.data_filename) else 0
+            if not self.dimensions or size // self.record_size <= self.mapped_records:
+                return
+            with open(self.data_filename, 'rb') as f:
+                # views handed out earlier keep the previous map alive
+                self.mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self.mapped_records = size // self.record_size
+
+    @contextmanager
+    def locked_append(self, filename: str, entry_size: int):
+        """
+        open a file for appending under the file lock, cut back to whole entries
+        :return: the file and its number of entries
+        """
+        with self.file_lock, open(filename, 'ab') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size % entry_size:
+                logger.warning(f'partial entry of {size % entry_size} bytes at the end of {filename}, cut off')
+                size -= size % entry_size
+                f.truncate(size)
+            yield f, size // entry_size
+
+    def find(self, key: str) -> Optional[int]:
+        digest = bytes.fromhex(key)
+        record_no = self.index.get(digest)
+        if record_no is None:
+            self.refresh_index()
+            record_no = self.index.get(digest)
+        return record_no
+
+    def vector(self, record_no: int) -> np.ndarray:
+        if record_no >= self.mapped_records:
+            self.remap()
+        return np.frombuffer(self.mapped, dtype=self.dtype, count=self.dimensions,
+                             offset=record_no * self.record_size)
+
+    def get(self, key: str) -> Optional[dict]:
+        record_no = self.find(key)
+        if record_no is None:
+            return None
+        return {'response': self.vector(record_no)}
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, dict]:
+        keys = list(keys)
+        if any(bytes.fromhex(x) not in self.index for x in keys):
+            self.refresh_index()
+        records = {}
+        for key in keys:
+            record_no = self.index.get(bytes.fromhex(key))
+            if record_no is not None:
+                records[key] = {'response': self.vector(record_no)}
+        return records
+
+    def put(self, key: str, record: dict):
+        self.put_many({key: record})
+
+    def put_many(self, records: Dict[str, dict]):
+        vectors = {}
+        for key, record in records.items():
+            vector = np.asarray(record.get('response'), dtype=self.dtype)
+            if vector.ndim != 1 or not vector.size:
+                logger.error(f'not an embedding vector, skip caching: {key}')
+                continue
+            vectors[key] = vector
+        if not vectors:
+            return
+
+        try:
+            with self.file_lock:
+                if self.dimensions is None:
+                    self.load_meta()
+                if self.dimensions is None:
+                    self.save_meta(len(next(iter(vectors.values()))))
+
+                data = bytearray()
+                digests = []
+                for key, vector in vectors.items():
+                    if len(vector) != self.dimensions:
+                        logger.error(f'vector dimensions {len(vector)} != {self.dimensions}, skip caching: {key}')
+                        continue
+                    data += vector.tobytes()
+                    digests.append(bytes.fromhex(key))
+
+                # the file lock is reentrant
+                with self.locked_append(self.data_filename, self.record_size) as (f, first_record_no):
+                    f.write(data)
+                with self.locked_append(self.index_filename, self.INDEX_ENTRY.size) as (f, _):
+                    f.write(b''.join(
+                        self.INDEX_ENTRY.pack(digest, first_record_no + idx) for idx, digest in enumerate(digests)
+                    ))
+        except Timeout:
+            self.lock_timeouts.inc()
+            logger.warning(f'embedding cache lock timeout, skip caching {len(vectors)} vectors: {self.cache_root}')
+            return
+        self.refresh_index()
+
+    def delete(self, key: str):
+        try:
+            with self.locked_append(self.index_filename, self.INDEX_ENTRY.size) as (f, _):
+                f.write(self.INDEX_ENTRY.pack(bytes.fromhex(key), -1))
+        except Timeout:
+            self.lock_timeouts.inc()
+            logger.warning(f'embedding cache lock timeout, skip deleting: {key}')
+            return
+        self.refresh_index()
+
+    def keys(self) -> Iterator[str]:
+        self.refresh_index()
+        for digest in list(self.index.keys()):
+            yield digest.hex()
+
+    def close(self):
+        self.mapped = None
+        self.mapped_records = 0
+
+    pass
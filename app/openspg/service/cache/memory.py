@@ -0,0 +1,122 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from numbers import Number
+from typing import Any, Optional
+
+import numpy as np
+
+from app.metrics import counter, gauge
+
+CACHE_HITS = counter('openspg_cache_hits_total', 'Cache hits', ['cache_root', 'tier'])
+CACHE_MISSES = counter('openspg_cache_misses_total', 'Cache misses', ['cache_root', 'tier'])
+CACHE_EVICTIONS = counter('openspg_cache_evictions_total', 'Entries evicted from the memory cache', ['cache_root'])
+CACHE_MEMORY_BYTES = gauge('openspg_cache_memory_bytes', 'Estimated size of the memory cache', ['cache_root'])
+
+
+class MemoryCache:
+    """
+    A bounded in-process LRU cache with optional TTL, placed in front of a cache storage.
+
+    - bounded by `max_entries` and, optionally, by the estimated `max_bytes` of the values
+    - entries older than `ttl` seconds are treated as misses
+    - with `compact_vectors`, embedding vectors are kept and returned as float32 arrays
+    - arrays are kept read-only, a caller cannot change the cached entry through the returned array
+    """
+
+    def __init__(self,
+                 cache_root: str,
+                 max_entries: int = 1024,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 compact_vectors: bool = False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compact_vectors = compact_vectors
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = CACHE_HITS.labels(cache_root=cache_root, tier='memory')
+        self.misses = CACHE_MISSES.labels(cache_root=cache_root, tier='memory')
+        self.evictions = CACHE_EVICTIONS.labels(cache_root=cache_root)
+        self.memory_bytes = CACHE_MEMORY_BYTES.labels(cache_root=cache_root)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses.inc()
+                return None
+            self.entries.move_to_end(key)
+        self.hits.inc()
+        return entry[0]
+
+    def put(self, key: str, value: Any):
+        if value is None or self.max_entries <= 0:
+            return
+        stored = self.encode(value)
+        size = self.estimate_size(stored)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (stored, size, expires_at)
+            self.size += size
+            while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions.inc()
+            self.memory_bytes.set(self.size)
+
+    def delete(self, key: str):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+                self.memory_bytes.set(self.size)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.memory_bytes.set(0)
+
+    def _remove(self, key: str):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def encode(self, value: Any) -> Any:
+        if self.compact_vectors and isinstance(value, list) and value and isinstance(value[0], Number):
+            value = np.asarray(value, dtype=np.float32)
+            value.flags.writeable = False
+        elif isinstance(value, np.ndarray) and value.flags.writeable:
+            # still writable by the caller that put it
+            value = value.copy()
+            value.flags.writeable = False
+        return value
+
+    @staticmethod
+    def estimate_size(value: Any) -> int:
+        if isinstance(value, np.ndarray):
+            return value.nbytes + 112
+        if isinstance(value, str):
+            return sys.getsizeof(value)
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(MemoryCache.estimate_size(x) for x in value)
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(
+                MemoryCache.estimate_size(k) + MemoryCache.estimate_size(v) for k, v in value.items()
+            )
+        return sys.getsizeof(value)
+
+    pass
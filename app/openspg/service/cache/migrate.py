@@ -0,0 +1,30 @@
+"""
+Migrate a cache root from one storage backend to another
+
+    python -m app.openspg.service.cache.migrate .cache/deepseek-chat --source file --target sqlite
+"""
+import argparse
+import time
+
+from app.openspg.service.cache.storage import create_cache_storage, migrate_cache_storage
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='migrate', description='Migrate the LLM / embedding cache storage')
+    parser.add_argument('cache_root', type=str)
+    parser.add_argument('--source', type=str, default='file')
+    parser.add_argument('--target', type=str, default='sqlite')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    source = create_cache_storage(args.source, args.cache_root)
+    target = create_cache_storage(args.target, args.cache_root)
+
+    start_time = time.perf_counter()
+    count = migrate_cache_storage(source, target, batch_size=args.batch_size)
+    target.close()
+    print(f'migrated {count} records from {args.source} to {args.target} in {time.perf_counter() - start_time:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
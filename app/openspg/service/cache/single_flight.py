@@ -0,0 +1,81 @@
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.metrics import counter
+
+CACHE_COALESCED = counter('openspg_cache_coalesced_total',
+                          'Cache misses served by an identical in-flight call', ['cache_root'])
+
+
+class Flight:
+    """
+    one in-flight call, waited on by the callers that asked for the same key meanwhile
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout: Optional[float] = 300) -> Any:
+        """
+        :raise TimeoutError: the leader did not finish the call within `timeout` seconds
+        """
+        if not self.done.wait(timeout):
+            raise TimeoutError('in-flight call did not finish in time')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    pass
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time, concurrent callers with the same key share its result (or error).
+    """
+
+    def __init__(self):
+        self.flights: Dict[str, Flight] = {}
+        self.lock = threading.Lock()
+
+    def begin(self, key: str) -> Tuple[Flight, bool]:
+        """
+        :return: the flight of key and whether the caller leads it, the leader must `finish` it
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = Flight()
+            self.flights[key] = flight
+            return flight, True
+
+    def finish(self, key: str, flight: Flight, result: Any = None, error: BaseException = None):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = 300) -> Tuple[Any, bool]:
+        """
+        :param timeout: seconds to wait for the call of another caller
+        :return: the result and whether it was shared from another caller's call
+        """
+        flight, leader = self.begin(key)
+        if not leader:
+            return flight.wait(timeout), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result, False
+
+    pass
+
+
+SINGLE_FLIGHT = SingleFlight()
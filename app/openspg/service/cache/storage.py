@@ -0,0 +1,289 @@
+"""
+Storage backends of the LLM / embedding cache.
+
+Records are addressed by the md5 hex digest of the normalized cache key and stored as
+`{'request': ..., 'response': ...}` dicts.
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from filelock import FileLock, Timeout
+
+from app.metrics import counter
+
+logger = logging.getLogger()
+
+CACHE_LOCK_CONTENTION = counter('openspg_cache_lock_contention_total',
+                                'Cache writes that had to wait for a lock', ['cache_root'])
+CACHE_LOCK_TIMEOUTS = counter('openspg_cache_lock_timeouts_total',
+                              'Cache writes that gave up waiting for a lock', ['cache_root'])
+
+
+def encode_json_value(value):
+    """
+    json fallback for numpy vectors, e.g. records read from the embedding storage
+    """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class CacheStorage(ABC):
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, record: dict):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def keys(self) -> Iterator[str]:
+        pass
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, dict]:
+        """
+        :return: the records found, missing keys are absent
+        """
+        records = {}
+        for key in keys:
+            record = self.get(key)
+            if record is not None:
+                records[key] = record
+        return records
+
+    def put_many(self, records: Dict[str, dict]):
+        for key, record in records.items():
+            self.put(key, record)
+
+    def close(self):
+        pass
+
+    pass
+
+
+class FileCacheStorage(CacheStorage):
+    """
+    one pretty-printed json file per record, sharded by the first 2 chars of the key
+
+    - files are written to a temp file and renamed into place, so readers never see a partial file and never lock
+    - writers of the same key stripe serialize on a file lock shared across processes.
+      a lock that cannot be acquired in time is counted as contention and the write goes ahead anyway,
+      the atomic rename keeps the entry consistent
+    """
+
+    def __init__(self, cache_root: str, lock_timeout: float = 5, lock_stripes: int = 64):
+        self.cache_root = cache_root
+        self.lock_timeout = lock_timeout
+        self.locks = [
+            FileLock(os.path.join(cache_root, '.locks', f'{idx:02x}.lock')) for idx in range(lock_stripes)
+        ]
+        self.lock_contention = CACHE_LOCK_CONTENTION.labels(cache_root=cache_root)
+        self.lock_timeouts = CACHE_LOCK_TIMEOUTS.labels(cache_root=cache_root)
+
+    def get_filename(self, key: str) -> str:
+        return os.path.join(self.cache_root, key[:2], f'{key}.json')
+
+    @contextmanager
+    def key_lock(self, key: str):
+        lock = self.locks[int(key[:8], 16) % len(self.locks)]
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            self.lock_contention.inc()
+            try:
+                lock.acquire(timeout=self.lock_timeout)
+            except Timeout:
+                self.lock_timeouts.inc()
+                logger.warning(f'cache lock timeout, write without lock: {key}')
+                yield
+                return
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def get(self, key: str) -> Optional[dict]:
+        fullname = self.get_filename(key)
+        try:
+            with open(fullname, 'r', encoding='utf-8') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.error(f'invalid cache file: {fullname}, {e}')
+            return None
+
+    def put(self, key: str, record: dict):
+        fullname = self.get_filename(key)
+        os.makedirs(os.path.dirname(fullname), exist_ok=True)
+        content = json.dumps(record, ensure_ascii=False, indent=4, default=encode_json_value)
+        with self.key_lock(key):
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(fullname),
+                                             prefix=f'.{key}.', suffix='.tmp', delete=False) as f:
+                f.write(content)
+            os.replace(f.name, fullname)
+
+    def delete(self, key: str):
+        fullname = self.get_filename(key)
+        with self.key_lock(key):
+            try:
+                os.remove(fullname)
+            except FileNotFoundError:
+                pass
+
+    def keys(self) -> Iterator[str]:
+        if not os.path.isdir(self.cache_root):
+            return
+        for shard in sorted(os.listdir(self.cache_root)):
+            shard_dir = os.path.join(self.cache_root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for filename in sorted(os.listdir(shard_dir)):
+                if filename.endswith('.json'):
+                    yield filename[:-len('.json')]
+
+    pass
+
+
+class SqliteCacheStorage(CacheStorage):
+    """
+    a single sqlite database in WAL mode, records are stored as compact json
+
+    readers see a consistent snapshot without locking, writers are serialized by sqlite.
+    a write that stays blocked for `busy_timeout` seconds is counted as a lock timeout and dropped
+    """
+
+    FILENAME = 'cache.sqlite3'
+    BATCH_SIZE = 500
+
+    def __init__(self, cache_root: str, filename: str = FILENAME, busy_timeout: float = 5):
+        os.makedirs(cache_root, exist_ok=True)
+        self.cache_root = cache_root
+        self.filename = os.path.join(cache_root, filename)
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.lock_timeouts = CACHE_LOCK_TIMEOUTS.labels(cache_root=cache_root)
+        with self.connection as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID')
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        one connection per thread, sqlite serializes the writers and lets the readers run concurrently
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=self.busy_timeout, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def encode(record: dict) -> str:
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=encode_json_value)
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self.connection.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, dict]:
+        keys = list(dict.fromkeys(keys))
+        records = {}
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            batch = keys[start:start + self.BATCH_SIZE]
+            rows = self.connection.execute(
+                f'SELECT key, value FROM cache WHERE key IN ({",".join("?" * len(batch))})', batch
+            ).fetchall()
+            for key, value in rows:
+                records[key] = json.loads(value)
+        return records
+
+    def put(self, key: str, record: dict):
+        self.put_many({key: record})
+
+    def put_many(self, records: Dict[str, dict]):
+        rows = [(key, self.encode(record)) for key, record in records.items()]
+        self.execute_write('INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)', rows)
+
+    def delete(self, key: str):
+        self.execute_write('DELETE FROM cache WHERE key = ?', [(key,)])
+
+    def execute_write(self, sql: str, rows: list):
+        try:
+            with self.connection as conn:
+                conn.executemany(sql, rows)
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            self.lock_timeouts.inc()
+            logger.warning(f'cache database locked, {len(rows)} writes dropped: {self.filename}')
+
+    def keys(self) -> Iterator[str]:
+        for row in self.connection.execute('SELECT key FROM cache ORDER BY key'):
+            yield row[0]
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    pass
+
+
+def create_embedding_storage(cache_root: str, dtype: str = 'float32') -> CacheStorage:
+    # imported lazily, embedding_store depends on this module and on numpy
+    from app.openspg.service.cache.embedding_store import EmbeddingCacheStorage
+    return EmbeddingCacheStorage(cache_root, dtype=dtype)
+
+
+CACHE_STORAGES = {
+    'file': FileCacheStorage,
+    'sqlite': SqliteCacheStorage,
+    'embedding': create_embedding_storage,
+    'embedding_f16': partial(create_embedding_storage, dtype='float16'),
+}
+
+
+def create_cache_storage(storage_type: str, cache_root: str) -> CacheStorage:
+    if storage_type not in CACHE_STORAGES:
+        raise ValueError(f'Invalid cache storage: {storage_type}, choose one of {list(CACHE_STORAGES.keys())}')
+    return CACHE_STORAGES[storage_type](cache_root)
+
+
+def migrate_cache_storage(source: CacheStorage, target: CacheStorage, batch_size: int = 1000) -> int:
+    """
+    copy all records from source to target in batches
+    :return: the number of records copied
+    """
+    count = 0
+    batch: List[str] = []
+    for key in source.keys():
+        batch.append(key)
+        if len(batch) >= batch_size:
+            count += _copy_records(source, target, batch)
+            batch = []
+    if batch:
+        count += _copy_records(source, target, batch)
+    return count
+
+
+def _copy_records(source: CacheStorage, target: CacheStorage, keys: List[str]) -> int:
+    records = source.get_many(keys)
+    target.put_many(records)
+    return len(records)
@@ -0,0 +1,250 @@
+import asyncio
+import threading
+import weakref
+from abc import ABC
+from collections import deque
+from typing import Generator, Any, Optional
+
+from app.metrics import REGISTRY, counter, gauge
+
+EVENT_QUEUES = gauge('openspg_event_queues', 'Open event queues (solver events and token streams)', ['queue'])
+EVENT_QUEUE_DEPTH = gauge('openspg_event_queue_depth', 'Events waiting in the event queues', ['queue'])
+EVENT_QUEUE_MAX_DEPTH = gauge('openspg_event_queue_max_depth', 'Events waiting in the fullest event queue',
+                              ['queue'])
+EVENT_QUEUE_COALESCED = counter('openspg_event_queue_coalesced_total',
+                                'Pending events replaced by a newer event of the same key in a full event queue',
+                                ['queue'])
+EVENT_QUEUE_OVERFLOWS = counter('openspg_event_queue_overflows_total',
+                                'Event queues failed by a producer that cannot wait while they were full', ['queue'])
+
+live_queues = weakref.WeakSet()
+live_queues_lock = threading.Lock()
+
+
+class EventQueueClosed(Exception):
+    """
+    raised by send() with raise_on_closed=True after the queue was closed
+    """
+    pass
+
+
+class EventQueueOverflow(Exception):
+    """
+    raised in the consumer when `send_nowait` found the queue full with nothing to replace
+    """
+    pass
+
+
+class EventQueue(Generator, ABC):
+    """
+    A bounded producer/consumer channel used to send events from a solver to a response stream.
+
+    - consumers block (`for event in queue`) or await (`async for event in queue`) while the queue is empty
+    - producers block (`send`) or await (`asend`) while the queue is full, a producer running on an event loop
+      shared with other work (e.g. the reporter of a solve) uses `send_nowait`, which never blocks: on a full queue
+      its event replaces the pending event of the same key, or the queue fails with `EventQueueOverflow`
+    - `close()` ends the stream, `close(error)` re-raises the error in the consumer
+    - a 'None' event is treated as `close()`
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.events = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.closed = False
+        self.error: Optional[BaseException] = None
+        self._async_getters = deque()
+        self._async_putters = deque()
+        # events ever queued, and the number of the last event queued by send_nowait for each key
+        self.pushed = 0
+        self.keys = {}
+        with live_queues_lock:
+            live_queues.add(self)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __next__(self):
+        with self.lock:
+            while not self.events and not self.closed:
+                self.not_empty.wait()
+            return self._pop_or_stop(StopIteration)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            with self.lock:
+                if self.events or self.closed:
+                    return self._pop_or_stop(StopAsyncIteration)
+                waiter = asyncio.get_running_loop().create_future()
+                self._async_getters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._discard_waiter(self._async_getters, waiter)
+
+    def send(self, event: Any, timeout: Optional[float] = None, raise_on_closed: bool = False) -> bool:
+        """
+        put an event into the queue, block while the queue is full
+        :return: False if the queue was closed (event dropped) or the timeout expired
+        """
+        if event is None:
+            self.close()
+            return True
+
+        with self.lock:
+            while self._is_full() and not self.closed:
+                if not self.not_full.wait(timeout):
+                    return False
+            return self._push(event, raise_on_closed)
+
+    def send_nowait(self, event: Any, key: Any = None) -> bool:
+        """
+        put an event into the queue without blocking: blocking would freeze the other solves of the loop, and with
+        `--solver-loops 0` the consumer itself. on a full queue the event replaces the pending event of the same
+        `key` (e.g. the previous state of the same report), without one the queue is closed with
+        `EventQueueOverflow`, the consumer is too slow to follow
+        :return: False if the queue was closed (event dropped)
+        """
+        if event is None:
+            self.close()
+            return True
+
+        with self.lock:
+            if not self._is_full() or self.closed:
+                return self._push(event, False, key)
+            # the position of the last event of the key, if it is still pending
+            position = self.keys.get(key, -1) - (self.pushed - len(self.events)) if key is not None else -1
+            if position >= 0:
+                self.events[position] = event
+                EVENT_QUEUE_COALESCED.labels(queue=type(self).__name__).inc()
+                return True
+            EVENT_QUEUE_OVERFLOWS.labels(queue=type(self).__name__).inc()
+        self.close(EventQueueOverflow(f'more than {self.maxsize} events waiting for the consumer'))
+        return False
+
+    async def asend(self, event: Any, raise_on_closed: bool = False) -> bool:
+        """
+        put an event into the queue, await while the queue is full
+        """
+        if event is None:
+            self.close()
+            return True
+
+        while True:
+            with self.lock:
+                if not self._is_full() or self.closed:
+                    return self._push(event, raise_on_closed)
+                waiter = asyncio.get_running_loop().create_future()
+                self._async_putters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._discard_waiter(self._async_putters, waiter)
+
+    def throw(self, typ, val=None, tb=None):
+        error = val if isinstance(val, BaseException) else typ() if isinstance(typ, type) else typ
+        self.close(error)
+
+    def close(self, error: Optional[BaseException] = None):
+        """
+        end of stream. pending events are still delivered before iteration stops
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.error = error
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+            self._wakeup(self._async_getters, wakeup_all=True)
+            self._wakeup(self._async_putters, wakeup_all=True)
+
+    def drain(self) -> list:
+        """
+        remove and return the pending events, e.g. to release them after the consumer is gone
+        """
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+            self.not_full.notify_all()
+            self._wakeup(self._async_putters, wakeup_all=True)
+            return events
+
+    def _is_full(self):
+        return 0 < self.maxsize <= len(self.events)
+
+    def _push(self, event: Any, raise_on_closed: bool, key: Any = None) -> bool:
+        if self.closed:
+            if raise_on_closed:
+                raise EventQueueClosed()
+            return False
+        if key is not None:
+            self.keys[key] = self.pushed
+        self.pushed += 1
+        self.events.append(event)
+        self.not_empty.notify()
+        self._wakeup(self._async_getters)
+        return True
+
+    def _pop_or_stop(self, stop_type):
+        if self.events:
+            event = self.events.popleft()
+            self.not_full.notify()
+            self._wakeup(self._async_putters)
+            return event
+        if self.error is not None:
+            raise self.error
+        raise stop_type
+
+    @staticmethod
+    def _wakeup(waiters: deque, wakeup_all: bool = False):
+        """
+        wake up the first pending (or all) async waiters, must be called with lock held
+        """
+        while waiters:
+            waiter = waiters.popleft()
+            if waiter.done():
+                continue
+            waiter.get_loop().call_soon_threadsafe(_resolve_waiter, waiter)
+            if not wakeup_all:
+                return
+
+    def _discard_waiter(self, waiters: deque, waiter):
+        """
+        forget a finished waiter. a cancelled waiter passes its wakeup on to the next one
+        """
+        with self.lock:
+            try:
+                waiters.remove(waiter)
+            except ValueError:
+                pass
+            ready = bool(self.events) if waiters is self._async_getters else not self._is_full()
+            if waiter.cancelled() and ready:
+                self._wakeup(waiters)
+
+    pass
+
+
+def _resolve_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def sample_queue_depths():
+    with live_queues_lock:
+        queues = [x for x in live_queues if not x.closed]
+    depths_by_type = {labels['queue']: [] for labels, _ in EVENT_QUEUES.collect()}
+    for queue in queues:
+        depths_by_type.setdefault(type(queue).__name__, []).append(len(queue))
+    for name, depths in depths_by_type.items():
+        EVENT_QUEUES.labels(queue=name).set(len(depths))
+        EVENT_QUEUE_DEPTH.labels(queue=name).set(sum(depths))
+        EVENT_QUEUE_MAX_DEPTH.labels(queue=name).set(max(depths, default=0))
+
+
+REGISTRY.on_collect(sample_queue_depths)
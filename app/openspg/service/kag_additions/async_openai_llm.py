@@ -0,0 +1,138 @@
+import asyncio
+import logging
+
+import openai
+from kag.interface import LLMClient
+from openai import AsyncOpenAI
+
+from app.openspg.service.event_queue import EventQueueClosed
+from app.openspg.service.upstream import UPSTREAM, TokenStream, retry_with_backoff
+
+logger = logging.getLogger()
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+@LLMClient.register("async_openai_llm")
+class AsyncOpenAIClient(LLMClient):
+    """
+    An OpenAI compatible client on the shared upstream connection pool.
+
+    with `stream: true` a call returns a TokenStream right away, the tokens are read on the upstream I/O loop
+    and no thread is blocked while the answer is generated. requests are retried with jittered backoff until
+    the first token arrives.
+    """
+
+    def __init__(
+            self,
+            base_url: str,
+            model: str,
+            api_key: str = "dummy",
+            stream: bool = True,
+            temperature: float = 0.7,
+            max_connections: int = 100,
+            max_keepalive_connections: int = 20,
+            keepalive_expiry: float = 30,
+            connect_timeout: float = 10,
+            read_timeout: float = 120,
+            max_retries: int = 3,
+            retry_backoff: float = 0.5,
+            retry_backoff_max: float = 8,
+            max_rate: float = 1000,
+            time_period: float = 1,
+            **kwargs
+    ):
+        name = kwargs.pop("name", None)
+        if not name:
+            name = f"{api_key}{base_url}{model}"
+        super().__init__(name, max_rate, time_period, **kwargs)
+        self.base_url = base_url
+        self.model = model
+        self.stream = stream
+        self.temperature = temperature
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+
+        http_client = UPSTREAM.get_client(base_url,
+                                          max_connections=max_connections,
+                                          max_keepalive_connections=max_keepalive_connections,
+                                          keepalive_expiry=keepalive_expiry,
+                                          connect_timeout=connect_timeout,
+                                          read_timeout=read_timeout)
+        # retries are done here, with jitter, instead of in the openai client
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+
+    def build_messages(self, prompt: str, **kwargs) -> list:
+        messages = kwargs.get("messages", None)
+        if messages:
+            return messages
+        return [
+            {"role": "system", "content": "you are a helpful assistant"},
+            {"role": "user", "content": prompt},
+        ]
+
+    async def create(self, messages: list, stream: bool):
+        return await retry_with_backoff(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=stream,
+                temperature=self.temperature
+            ),
+            RETRYABLE_ERRORS,
+            max_retries=self.max_retries,
+            backoff=self.retry_backoff,
+            backoff_max=self.retry_backoff_max,
+        )
+
+    async def complete(self, messages: list) -> str:
+        response = await self.create(messages, stream=False)
+        return response.choices[0].message.content
+
+    async def produce(self, messages: list, tokens: TokenStream):
+        try:
+            response = await self.create(messages, stream=True)
+            async with response:
+                async for chunk in response:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        await tokens.asend(content, raise_on_closed=True)
+            tokens.finish()
+        except EventQueueClosed:
+            # closed by the consumer, leaving the context above closed the upstream response
+            pass
+        except asyncio.CancelledError:
+            tokens.finish()
+            raise
+        except BaseException as e:
+            tokens.finish(e)
+
+    def start_stream(self, messages: list) -> TokenStream:
+        tokens = TokenStream()
+        tokens.future = UPSTREAM.submit(self.produce(messages, tokens))
+        return tokens
+
+    def __call__(self, prompt: str = "", image_url: str = None, **kwargs):
+        messages = self.build_messages(prompt, **kwargs)
+        if self.stream:
+            return self.start_stream(messages)
+        return UPSTREAM.submit(self.complete(messages)).result()
+
+    async def acall(self, prompt: str = "", image_url: str = None, **kwargs):
+        messages = self.build_messages(prompt, **kwargs)
+        if self.stream:
+            return self.start_stream(messages)
+        return await UPSTREAM.run(lambda: self.complete(messages))
+
+    def check(self):
+        pass
+
+    pass
@@ -1,96 +1,226 @@
 import json
 import logging
 import os
+import time
 from copy import deepcopy
 from hashlib import md5
-from typing import Union, Iterable, List
+from typing import Union, Iterable, Iterator, List, Dict, Optional, Callable
 
+import numpy as np
 from filelock import FileLock, Timeout
 from kag.interface import LLMClient, VectorizeModelABC, EmbeddingVector
 from typing_extensions import override
 
+from app.openspg.service.cache.memory import MemoryCache, CACHE_HITS, CACHE_MISSES
+from app.openspg.service.cache.single_flight import SINGLE_FLIGHT, CACHE_COALESCED
+from app.openspg.service.cache.storage import CacheStorage, create_cache_storage
+from app.openspg.service.micro_batcher import MicroBatcher
+from app.openspg.service.tracing import Span, start_call_span
+from app.openspg.service.upstream import UPSTREAM_LATENCY
+
 logger = logging.getLogger()
 
 
 class CacheManager:
-    lock_dict = {}
+    """
+    Two-tier cache: a bounded in-process LRU (memory tier) in front of a cache storage (disk tier)
+
+    identical misses in flight at the same time are coalesced (`single_flight`):
+    - none: every caller calls upstream
+    - process: callers in the same process wait for the first one (default)
+    - workers: also across processes sharing the cache root, through a lock file per key
+    """
+    SINGLE_FLIGHT_MODES = ['none', 'process', 'workers']
+
+    storage_dict: Dict[str, CacheStorage] = {}
+    memory_dict: Dict[str, MemoryCache] = {}
     params_dict = {}
+    single_flight_dict = {}
 
-    def register(self, cache_root: str, params: dict) -> str:
+    def register(self, cache_root: str, params: dict, storage: str = 'file', memory_entries: int = 1024,
+                 memory_bytes: int = None, memory_ttl: float = None, compact_vectors: bool = False,
+                 single_flight: str = 'process', single_flight_timeout: float = 300) -> str:
+        if single_flight not in self.SINGLE_FLIGHT_MODES:
+            raise ValueError(f'Invalid single_flight: {single_flight}, choose one of {self.SINGLE_FLIGHT_MODES}')
         if not cache_root:
             cache_root = os.path.join(os.getcwd(), '.cache')
             if params and 'model' in params:
                 cache_root = os.path.join(cache_root, params.get('model'))
 
-        self.lock_dict[cache_root] = FileLock(os.path.join(cache_root, 'lockfile.lock'))
+        if cache_root not in self.storage_dict:
+            self.storage_dict[cache_root] = create_cache_storage(storage, cache_root)
+        if cache_root not in self.memory_dict and memory_entries > 0:
+            self.memory_dict[cache_root] = MemoryCache(cache_root, max_entries=memory_entries, max_bytes=memory_bytes,
+                                                       ttl=memory_ttl, compact_vectors=compact_vectors)
         self.params_dict[cache_root] = self.normalize_value(params, remove_keys=['api_key'])
+        self.single_flight_dict[cache_root] = (single_flight, single_flight_timeout)
         return cache_root
 
     def unregister(self, cache_root: str):
-        self.lock_dict.pop(cache_root)
+        self.storage_dict.pop(cache_root)
+        self.memory_dict.pop(cache_root, None)
+        self.single_flight_dict.pop(cache_root, None)
+
+    def get_storage(self, cache_root: str) -> Optional[CacheStorage]:
+        storage = self.storage_dict.get(cache_root)
+        if storage is None:
+            logger.error(f'cache_root not registered: {cache_root}')
+        return storage
 
     def read(self, cache_root: str, cache_key: Union[str, dict, list]) -> any:
-        lock = self.lock_dict[cache_root]
-        if lock is None:
-            logger.error('cache_root not registered: {}', cache_root)
+        storage = self.get_storage(cache_root)
+        if storage is None:
             return None
 
-        fullname = os.path.join(cache_root, self.get_cache_filename(cache_key))
-        if not os.path.exists(fullname):
+        key = self.get_cache_key(cache_key)
+        memory = self.memory_dict.get(cache_root)
+        if memory is not None:
+            response = memory.get(key)
+            if response is not None:
+                return response
+
+        record = storage.get(key)
+        if record is None:
+            CACHE_MISSES.labels(cache_root=cache_root, tier='disk').inc()
             return None
-        os.makedirs(os.path.dirname(fullname), exist_ok=True)
 
-        try:
-            with lock.acquire(timeout=5):
-                with open(fullname, 'r', encoding='utf-8') as f:
-                    json_content = f.read()
-                content = json.loads(json_content)
-                return content['response']
+        CACHE_HITS.labels(cache_root=cache_root, tier='disk').inc()
+        if memory is not None:
+            memory.put(key, record['response'])
+        return record['response']
+
+    def get_or_compute(self, cache_root: str, prompt: Union[str, dict, list], compute: Callable[[], any]) -> any:
+        """
+        read prompt from the cache, on a miss call compute once for all concurrent callers and cache its result
+        """
+        response = self.read(cache_root, prompt)
+        if response is not None:
+            return response
+
+        mode, timeout = self.single_flight_dict.get(cache_root, ('none', None))
+        if mode == 'none':
+            response = compute()
+            self.write(cache_root, prompt, response)
+            return response
+
+        key = self.get_cache_key(prompt)
+        response, shared = SINGLE_FLIGHT.do(f'{cache_root}/{key}',
+                                            lambda: self.compute_once(cache_root, prompt, key, compute),
+                                            timeout=timeout)
+        if shared:
+            CACHE_COALESCED.labels(cache_root=cache_root).inc()
+        return response
 
+    def compute_once(self, cache_root: str, prompt: Union[str, dict, list], key: str, compute: Callable[[], any]):
+        mode, timeout = self.single_flight_dict[cache_root]
+        if mode != 'workers':
+            # a previous flight may have finished since the caller's read
+            response = self.read(cache_root, prompt)
+            if response is None:
+                response = compute()
+                self.write(cache_root, prompt, response)
+            return response
+
+        lock_filename = os.path.join(cache_root, '.inflight', f'{key}.lock')
+        os.makedirs(os.path.dirname(lock_filename), exist_ok=True)
+        try:
+            with FileLock(lock_filename, timeout=timeout):
+                # another worker may have written it while this one waited for the lock
+                response = self.read(cache_root, prompt)
+                if response is None:
+                    response = compute()
+                    self.write(cache_root, prompt, response)
+            # a worker that opened the file before the removal may lead a duplicate call, which is harmless
+            try:
+                os.remove(lock_filename)
+            except OSError:
+                pass
         except Timeout:
-            logger.error('cache file locked: {}', fullname)
-            return None
+            logger.warning(f'timeout waiting for the in-flight call of {key} in another worker, calling upstream')
+            response = compute()
+            self.write(cache_root, prompt, response)
+        return response
+
+    def read_many(self, cache_root: str, cache_keys: List[Union[str, dict, list]]) -> List[any]:
+        """
+        :return: the cached responses in the order of cache_keys, None for misses
+        """
+        storage = self.get_storage(cache_root)
+        if storage is None:
+            return [None] * len(cache_keys)
+
+        keys = [self.get_cache_key(x) for x in cache_keys]
+        responses = {}
+        memory = self.memory_dict.get(cache_root)
+        if memory is not None:
+            for key in keys:
+                response = memory.get(key)
+                if response is not None:
+                    responses[key] = response
+
+        uncached_keys = [x for x in keys if x not in responses]
+        if uncached_keys:
+            records = storage.get_many(uncached_keys)
+            CACHE_HITS.labels(cache_root=cache_root, tier='disk').inc(len(records))
+            CACHE_MISSES.labels(cache_root=cache_root, tier='disk').inc(len(set(uncached_keys)) - len(records))
+            for key, record in records.items():
+                responses[key] = record['response']
+                if memory is not None:
+                    memory.put(key, record['response'])
+
+        return [responses.get(x) for x in keys]
 
     def write(self, cache_root: str, prompt: Union[str, dict, list], response: str):
-        lock = self.lock_dict[cache_root]
-        if lock is None:
-            logger.error('cache_root not registered: {}', cache_root)
+        storage = self.get_storage(cache_root)
+        if storage is None:
+            return
+
+        key = self.get_cache_key(prompt)
+        memory = self.memory_dict.get(cache_root)
+        if memory is not None:
+            memory.put(key, response)
+        storage.put(key, self.build_record(cache_root, prompt, response))
+
+    def write_many(self, cache_root: str, items: List[tuple]):
+        """
+        :param items: (prompt, response) pairs
+        """
+        storage = self.get_storage(cache_root)
+        if storage is None:
             return
 
-        fullname = os.path.join(cache_root, self.get_cache_filename(prompt))
-        os.makedirs(os.path.dirname(fullname), exist_ok=True)
+        records = {}
+        memory = self.memory_dict.get(cache_root)
+        for prompt, response in items:
+            key = self.get_cache_key(prompt)
+            if memory is not None:
+                memory.put(key, response)
+            records[key] = self.build_record(cache_root, prompt, response)
+        storage.put_many(records)
+
+    def delete(self, cache_root: str, cache_key: Union[str, dict, list]):
+        storage = self.get_storage(cache_root)
+        if storage is None:
+            return
+
+        key = self.get_cache_key(cache_key)
+        memory = self.memory_dict.get(cache_root)
+        if memory is not None:
+            memory.delete(key)
+        storage.delete(key)
 
-        content = json.dumps(self.normalize_value({
+    def build_record(self, cache_root: str, prompt: Union[str, dict, list], response: any) -> dict:
+        # the response may be a numpy vector, which has no truth value for normalize_value
+        record = self.normalize_value({
             'request': {
                 'prompt': prompt, 'params': self.params_dict[cache_root]
-            },
-            'response': response
-        }, remove_keys=[]), ensure_ascii=False, indent=4)
-        try:
-            with lock.acquire(timeout=5):
-                with open(fullname, 'w', encoding='utf-8') as f:
-                    f.write(content)
-        except Timeout:
-            logger.error('cache file locked: {}', fullname)
-            return None
-        pass
-
-    def delete(self, cache_root: str, filename: str):
-        lock = self.lock_dict[cache_root]
-        if lock is None:
-            logger.error('cache_root not registered: {}', cache_root)
-            return
-        try:
-            with lock.acquire(timeout=5):
-                if os.path.exists(filename):
-                    os.remove(filename)
-        except Timeout:
-            logger.error('cache file locked: {}', filename)
-            return None
-        pass
+            }
+        }, remove_keys=[])
+        record['response'] = response
+        return record
 
     @staticmethod
-    def get_cache_filename(cache_key: Union[str, dict, list]) -> str:
+    def get_cache_key(cache_key: Union[str, dict, list]) -> str:
         if isinstance(cache_key, dict):
             prop_keys = [str(x) for x in cache_key.keys()]
             prop_keys.sort(key=lambda x: x)
@@ -102,7 +232,11 @@ class CacheManager:
 
         md5_digest = md5()
         md5_digest.update(normalized_key.encode('utf-8'))
-        md5_filename = md5_digest.hexdigest()
+        return md5_digest.hexdigest()
+
+    @staticmethod
+    def get_cache_filename(cache_key: Union[str, dict, list]) -> str:
+        md5_filename = CacheManager.get_cache_key(cache_key)
         return f'{md5_filename[:2]}/{md5_filename}.json'
 
     def normalize_value(self, value: any, remove_keys: List[str]):
@@ -122,20 +256,40 @@ CACHE_MGR = CacheManager()
 class CacheableLLMClient(LLMClient):
     """
     A client class for delegate LLM
+
+    a streaming delegate (`stream: true`, e.g. stream_openai_llm) is cached stream-through: tokens are
+    recorded while they are yielded and committed when the stream completes, a hit replays them
     """
 
-    def __init__(self, delegate_type: str, cache_root: str = None, **kwargs):
+    def __init__(self,
+                 delegate_type: str,
+                 cache_root: str = None,
+                 cache_storage: str = 'file',
+                 memory_cache_entries: int = 1024,
+                 memory_cache_bytes: int = None,
+                 memory_cache_ttl: float = None,
+                 single_flight: str = 'process',
+                 single_flight_timeout: float = 300,
+                 stream_replay_chunk_size: int = None,
+                 **kwargs):
         name = kwargs.pop("name", None)
         if not name:
             name = f"cacheable_llm"
 
         super().__init__(name=name, **kwargs)
 
-        self.cache_root = CACHE_MGR.register(cache_root, kwargs)
+        self.cache_root = CACHE_MGR.register(cache_root, kwargs, storage=cache_storage,
+                                             memory_entries=memory_cache_entries, memory_bytes=memory_cache_bytes,
+                                             memory_ttl=memory_cache_ttl, single_flight=single_flight,
+                                             single_flight_timeout=single_flight_timeout)
 
         config = deepcopy(kwargs)
         config['type'] = delegate_type
         self.client = LLMClient.from_config(config)
+        self.streaming = bool(getattr(self.client, 'stream', False))
+        self.stream_replay_chunk_size = stream_replay_chunk_size
+        self.delegate_type = delegate_type
+        self.latency = UPSTREAM_LATENCY.labels(kind='llm', model=delegate_type)
 
         self.check()
 
@@ -144,11 +298,71 @@ class CacheableLLMClient(LLMClient):
 
     @override
     def __call__(self, prompt: Union[str, dict, list], **kwargs) -> str:
-        response = CACHE_MGR.read(self.cache_root, prompt)
-        if response is None:
-            response = self.client(prompt, **kwargs)
-            CACHE_MGR.write(self.cache_root, prompt, response)
-        return response
+        if self.streaming:
+            # a token stream can be consumed only once, so it is not shared by single flight
+            response = CACHE_MGR.read(self.cache_root, prompt)
+            if response is not None:
+                return self.replay_stream(response)
+            # the span is taken here, the stream may be consumed outside the context of the solve
+            span = start_call_span('llm', model=self.delegate_type, stream=True)
+            try:
+                stream = self.client(prompt, **kwargs)
+            except BaseException as e:
+                if span:
+                    span.end(str(e) or type(e).__name__)
+                raise
+            return self.record_stream(prompt, stream, span)
+        return CACHE_MGR.get_or_compute(self.cache_root, prompt, lambda: self.call_upstream(prompt, **kwargs))
+
+    def call_upstream(self, prompt: Union[str, dict, list], **kwargs) -> str:
+        span = start_call_span('llm', model=self.delegate_type, stream=False)
+        error = None
+        start_time = time.perf_counter()
+        try:
+            return self.client(prompt, **kwargs)
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - start_time)
+            if span:
+                span.end(error)
+
+    def record_stream(self, prompt: Union[str, dict, list], stream: Iterable[str],
+                      span: Optional[Span] = None) -> Iterator[str]:
+        """
+        yield the tokens of stream, cache them only once it is exhausted, so a dropped stream is not cached
+        """
+        chunks = []
+        error = None
+        start_time = time.perf_counter()
+        try:
+            for chunk in stream:
+                if not chunks:
+                    self.latency.observe(time.perf_counter() - start_time)
+                    if span:
+                        span.attributes['llm.time_to_first_token'] = time.perf_counter() - start_time
+                chunks.append(chunk)
+                yield chunk
+        except BaseException as e:
+            error = 'closed' if isinstance(e, GeneratorExit) else str(e) or type(e).__name__
+            raise
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()
+            if span:
+                span.attributes['llm.chunks'] = len(chunks)
+                span.end(error)
+        CACHE_MGR.write(self.cache_root, prompt, {'stream': chunks})
+
+    def replay_stream(self, response: any) -> Iterator[str]:
+        chunks = response['stream'] if isinstance(response, dict) and 'stream' in response else [response]
+        if not self.stream_replay_chunk_size:
+            yield from chunks
+            return
+        text = ''.join(x for x in chunks if x)
+        for start in range(0, len(text), self.stream_replay_chunk_size):
+            yield text[start:start + self.stream_replay_chunk_size]
 
     @override
     def check(self):
@@ -166,7 +380,18 @@ class CacheableVectorizeModel(VectorizeModelABC):
     def __init__(self,
                  delegate_type: str,
                  cache_root: str = None,
+                 cache_storage: str = 'file',
+                 memory_cache_entries: int = 10000,
+                 memory_cache_bytes: int = None,
+                 memory_cache_ttl: float = None,
+                 vector_format: str = 'list',
+                 single_flight: str = 'process',
+                 single_flight_timeout: float = 300,
                  vector_dimensions: int = None,
+                 batch_size: int = 32,
+                 batch_window: float = 0,
+                 max_inflight_batches: int = 8,
+                 batch_timeout: float = 300,
                  max_rate: float = 1000,
                  time_period: float = 1,
                  **kwargs):
@@ -176,38 +401,130 @@ class CacheableVectorizeModel(VectorizeModelABC):
 
         super().__init__(name=name, vector_dimensions=vector_dimensions, max_rate=max_rate, time_period=time_period)
 
-        self.cache_root = CACHE_MGR.register(cache_root, kwargs)
+        self.cache_root = CACHE_MGR.register(cache_root, kwargs, storage=cache_storage,
+                                             memory_entries=memory_cache_entries, memory_bytes=memory_cache_bytes,
+                                             memory_ttl=memory_cache_ttl, compact_vectors=True,
+                                             single_flight=single_flight, single_flight_timeout=single_flight_timeout)
+        if vector_format not in ['list', 'numpy']:
+            raise ValueError(f'Invalid vector_format: {vector_format}, choose one of [list, numpy]')
+        self.vector_format = vector_format
 
         config = deepcopy(kwargs)
         config['type'] = delegate_type
         self.client = VectorizeModelABC.from_config(config)
+        # misses of all in-flight solves are sent to the delegate together. the delegate is called
+        # synchronously, so its calls are paced to max_rate per time_period instead of using the async limiter
+        self.delegate_type = delegate_type
+        self.latency = UPSTREAM_LATENCY.labels(kind='embedding', model=delegate_type)
+        self.batcher = MicroBatcher(f'vectorize_{delegate_type}', self.call_upstream,
+                                    max_batch_size=batch_size, window=batch_window,
+                                    max_inflight=max_inflight_batches,
+                                    call_interval=time_period / max_rate if max_rate > 0 else 0,
+                                    timeout=batch_timeout)
+
+    @classmethod
+    def generate_key(cls, delegate_type: str, cache_root: str = None, *args, **kwargs) -> str:
+        # one instance per delegate config, so that projects with different vectorizers do not share it
+        return f"{cls}_{delegate_type}_{cache_root}_{json.dumps(kwargs, sort_keys=True, default=str)}"
 
     def __delete__(self, instance):
         CACHE_MGR.unregister(self.cache_root)
 
+    def format_vector(self, vector: any) -> EmbeddingVector:
+        """
+        cached vectors are read-only numpy arrays (views into the embedding storage), returned as lists unless
+        `vector_format` is numpy. lists are the default, the OpenSPG clients of KAG cannot serialize arrays,
+        so the reads are only zero-copy when numpy is chosen
+        """
+        if self.vector_format == 'numpy':
+            return np.asarray(vector)
+        if isinstance(vector, np.ndarray):
+            return vector.tolist()
+        return vector
+
     def vectorize(self, texts: Union[str, Iterable[str]]) -> Union[EmbeddingVector, Iterable[EmbeddingVector]]:
-        source_texts: list[str] = [texts] if isinstance(texts, str) else texts
-        embedding_vectors = [CACHE_MGR.read(self.cache_root, x) for x in source_texts]
+        source_texts: list[str] = [texts] if isinstance(texts, str) else list(texts)
+        embedding_vectors = CACHE_MGR.read_many(self.cache_root, source_texts)
 
-        uncached_texts = [
+        uncached_texts = list(dict.fromkeys(
             text
             for text, embedding_vector in zip(source_texts, embedding_vectors)
             if embedding_vector is None
-        ]
+        ))
         if len(uncached_texts) > 0:
-            iterable_vectors: Iterable[EmbeddingVector] = self.client.vectorize(uncached_texts)
-            vectors = list(iterable_vectors)
-
-            for idx, (text, embedding_vector) in enumerate(zip(source_texts, embedding_vectors)):
-                if embedding_vector is None:
-                    embedding_vectors[idx] = vectors[0]
-                    vectors = vectors[1:]
-                    CACHE_MGR.write(self.cache_root, text, embedding_vectors[idx])
-            pass
-
+            # spanned here, the batched upstream call runs on the batcher threads for several solves
+            span = start_call_span('embedding', model=self.delegate_type, texts=len(uncached_texts))
+            error = None
+            try:
+                vectors = self.vectorize_uncached(uncached_texts)
+            except BaseException as e:
+                error = str(e) or type(e).__name__
+                raise
+            finally:
+                if span:
+                    span.end(error)
+            embedding_vectors = [
+                vectors[text] if embedding_vector is None else embedding_vector
+                for text, embedding_vector in zip(source_texts, embedding_vectors)
+            ]
+
+        embedding_vectors = [self.format_vector(x) for x in embedding_vectors]
         if isinstance(texts, str):
             return embedding_vectors[0]
         else:
             return embedding_vectors
 
+    def vectorize_uncached(self, texts: List[str]) -> Dict[str, EmbeddingVector]:
+        """
+        vectorize distinct texts, texts already in flight in another call are waited for instead
+        """
+        if CACHE_MGR.single_flight_dict[self.cache_root][0] == 'none':
+            return self.fetch_vectors(texts)
+
+        flight_keys = {x: f'{self.cache_root}/{CACHE_MGR.get_cache_key(x)}' for x in texts}
+        flights = {x: SINGLE_FLIGHT.begin(flight_keys[x]) for x in texts}
+        leading_texts = [x for x in texts if flights[x][1]]
+        vectors = {}
+        error = None
+        try:
+            if leading_texts:
+                # a previous flight may have finished since the caller's read
+                cached_vectors = CACHE_MGR.read_many(self.cache_root, leading_texts)
+                vectors = {x: v for x, v in zip(leading_texts, cached_vectors) if v is not None}
+                vectors.update(self.fetch_vectors([x for x in leading_texts if x not in vectors]))
+                missing = [x for x in leading_texts if vectors.get(x) is None]
+                if missing:
+                    raise RuntimeError(f'{self.delegate_type} returned no vector for {len(missing)} texts')
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # every flight led here is finished, whatever happened, or its followers would wait for nothing
+            for text in leading_texts:
+                SINGLE_FLIGHT.finish(flight_keys[text], flights[text][0], result=vectors.get(text),
+                                     error=error)
+
+        timeout = CACHE_MGR.single_flight_dict[self.cache_root][1]
+        for text in texts:
+            if not flights[text][1]:
+                vectors[text] = flights[text][0].wait(timeout)
+                CACHE_COALESCED.labels(cache_root=self.cache_root).inc()
+        return vectors
+
+    def call_upstream(self, texts: List[str]) -> List[EmbeddingVector]:
+        start_time = time.perf_counter()
+        try:
+            return self.client.vectorize(texts)
+        finally:
+            self.latency.observe(time.perf_counter() - start_time)
+
+    def fetch_vectors(self, texts: List[str]) -> Dict[str, EmbeddingVector]:
+        """
+        vectorize texts with the delegate through the micro batcher and write them back in one batch
+        """
+        vectors = dict(zip(texts, self.batcher.map(texts)))
+        if vectors:
+            CACHE_MGR.write_many(self.cache_root, list(vectors.items()))
+        return vectors
+
     pass
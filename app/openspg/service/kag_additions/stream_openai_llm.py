@@ -38,6 +38,10 @@ class StreamOpenAIClient(OpenAIClient):
             stream=self.stream,
             temperature=self.temperature
         )
-        for chunk in response:
-            yield chunk.choices[0].delta.content
+        try:
+            for chunk in response:
+                yield chunk.choices[0].delta.content
+        finally:
+            # a consumer that stops early closes the upstream connection at once
+            response.close()
         pass
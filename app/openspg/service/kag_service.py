@@ -1,84 +1,197 @@
+import asyncio
 import json
 import logging
 import os.path
 import threading
+import time
 import traceback
-from abc import ABC
-from typing import Generator, Any
+import uuid
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import AsyncGenerator, AsyncIterator, Any, Dict, Iterator, List, Optional, Tuple
 
-from kag.common.conf import KAGConstants, KAG_CONFIG, KAG_PROJECT_CONF, load_config
+from kag.common.conf import KAG_CONFIG, KAG_PROJECT_CONF, KAGConstants, load_config
 from kag.common.registry import import_modules_from_path
 from kag.interface import SolverPipelineABC
+from kag.interface.common.llm_client import LLMCallCcontext, TokenMeterFactory
 from kag.solver.reporter.open_spg_reporter import OpenSPGReporter
 from knext.project.client import ProjectClient
 
+from app.metrics import counter, gauge, histogram
+from app.openspg.service.event_queue import EventQueue
+from app.openspg.service.project_config import ProjectSolver, create_project_config, install_context_propagation, \
+    install_contextual_config, use_project_config
+from app.openspg.service.solver_executor import SolverExecutor
+from app.openspg.service.solver_pool import SolverPool
+from app.openspg.service.tracing import CURRENT_TRACE, TRACER, Trace
+from app.openspg.service.upstream import close_token_stream
 from app.utils import remove_empty_fields
 
 logger = logging.getLogger()
 
+SOLVES_IN_FLIGHT = gauge('openspg_solves_in_flight', 'Solves running on the solver executor', ['project'])
+SOLVE_SECONDS = histogram('openspg_solve_seconds', 'Seconds from the start to the end of a solve',
+                          ['project', 'status'], buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+SOLVES_CANCELLED = counter('openspg_solves_cancelled_total', 'Streamed solves cancelled before their end', ['project'])
+SOLVE_CANCELLED_AFTER = histogram('openspg_solve_cancelled_after_seconds', 'Seconds a cancelled solve had run',
+                                  ['project'])
+SOLVE_SECONDS_SAVED = counter('openspg_solve_seconds_saved_total',
+                              'Estimated solve seconds not spent because of cancelled solves', ['project'])
+PROJECT_RELOADS = counter('openspg_project_reloads_total',
+                          'Projects added, rebuilt, removed or failed to build by the project refresh',
+                          ['project', 'action'])
 
-class EventQueue(Generator, ABC):
-    """
-    A queue that can be used to send events to a generator.
-    Stop iteration while got a 'None' event
-    """
 
-    def __init__(self):
-        self.events = []
-        self.lock = threading.Lock()
-
-    def __next__(self):
-        if len(self.events) > 0:
-            with self.lock:
-                event = self.events.pop(0)
-            if event is None:
-                raise StopIteration
-            return event
+class EventReporter(OpenSPGReporter):
+    """
+    Sends the report changes of a solver to the printer.
 
-    def send(self, event: Any):
-        with self.lock:
-            self.events.append(event)
+    - 'full' mode sends the whole state of the changed report on every change:
+      `{"event": "changed", "data": {...}}`
+    - 'delta' mode sends the whole state once, then only what changed, numbered with `seq` so that
+      clients can rebuild the state in order:
+      `{"event": "reset", "seq": 0, "data": {...}}`,
+      `{"event": "delta", "seq": 1, "data": {"report_id": ..., "append": {"content": "..."}, "set": {...}}}`
 
-    def throw(self, typ, val=None, tb=None):
-        pass
+    with a `flush_interval`, the changes within the interval are merged into one event per report.
+    with a `trace`, every report is also timed as a step span of the trace
+    """
 
+    REPORT_MODES = ['full', 'delta']
 
-class EventReporter(OpenSPGReporter):
-
-    def __init__(self, printer, **kwargs):
+    def __init__(self, printer, report_mode: str = 'full', flush_interval: float = 0, trace: Optional[Trace] = None,
+                 **kwargs):
         super().__init__(0, **kwargs)
+        if report_mode not in self.REPORT_MODES:
+            raise ValueError(f'report mode must be one of {self.REPORT_MODES}, got {report_mode}')
         self.printer = printer
+        self.report_mode = report_mode
+        self.flush_interval = flush_interval
+        self.trace = trace
+        self.seq = 0
+        self.sent = {}
+        self.dirty = {}
+        self.last_flush = 0
+        self.flush_scheduled = False
+        self.closed = False
+        self.report_lock = threading.Lock()
+        try:
+            # the solver loop, for the delayed flush of the last changes
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
 
     def add_report_line(self, segment, tag_name, content, status, **kwargs):
         super().add_report_line(segment, tag_name, content, status, **kwargs)
-
-        report_data = self.report_stream_data[tag_name]
-
-        if self.printer:
-            self.printer(remove_empty_fields({
-                'event': 'changed',
-                'data': {
-                    k: v for k, v in report_data.items() if k not in ['kwargs']
-                }
-            }))
+        if self.trace is not None:
+            self.trace.step(segment, tag_name, status)
+        if not self.printer:
+            return
+
+        with self.report_lock:
+            self.dirty[tag_name] = None
+            if self.report_mode == 'delta' and segment in self.report_stream_data:
+                # a new sub report is appended to the content of its parent
+                self.dirty[segment] = None
+
+            delay = self.last_flush + self.flush_interval - time.monotonic()
+            if delay <= 0:
+                self.flush_changes()
+            elif not self.flush_scheduled and self.loop is not None:
+                self.flush_scheduled = True
+                self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.flush)
+
+    def flush(self, close: bool = False):
+        """
+        send the pending changes, with close no more changes are sent afterwards
+        """
+        with self.report_lock:
+            self.flush_scheduled = False
+            if not self.closed:
+                self.flush_changes()
+            self.closed = self.closed or close
+
+    def flush_changes(self):
+        self.last_flush = time.monotonic()
+        dirty, self.dirty = self.dirty, {}
+        if self.closed:
+            return
+        for report_id in dirty:
+            report_data = {
+                k: remove_empty_fields(v) for k, v in self.report_stream_data[report_id].items()
+                if k not in ['kwargs'] and v is not None
+            }
+            if self.report_mode == 'full':
+                self.printer({'event': 'changed', 'data': report_data})
+                continue
+
+            event = self.build_delta(report_id, report_data)
+            if event:
+                event['seq'] = self.seq
+                self.seq += 1
+                self.printer(event)
+
+    def build_delta(self, report_id: str, report_data: dict) -> Optional[dict]:
+        sent, self.sent[report_id] = self.sent.get(report_id), report_data
+        if sent is None:
+            return {'event': 'reset', 'data': report_data}
+
+        appended, changed = {}, {}
+        for k, v in report_data.items():
+            old = sent.get(k)
+            if v == old:
+                continue
+            # str.startswith compares in C, much cheaper than encoding and sending the whole text again
+            if isinstance(v, str) and isinstance(old, str) and v.startswith(old):
+                appended[k] = v[len(old):]
+            else:
+                changed[k] = v
+        if not appended and not changed:
+            return None
+
+        delta = {'report_id': report_id}
+        if appended:
+            delta['append'] = appended
+        if changed:
+            delta['set'] = changed
+        return {'event': 'delta', 'data': delta}
 
     pass
 
 
-def load_configs_from_file(root_dir: str):
-    """
-    load kag_config.yaml from kag_config_dir
-    """
+def find_config_files(root_dir: str) -> List[str]:
     config_filenames = []
     for dirpath, _, filenames in os.walk(root_dir):
         for filename in filenames:
             if filename.endswith(".yml") or filename.endswith(".yaml"):
                 config_filenames.append(os.path.join(dirpath, filename))
+    return sorted(config_filenames)
+
+
+def stat_config_files(root_dir: str) -> tuple:
+    """
+    changes when a config file is added, removed or modified
+    """
+    stats = []
+    for config_filename in find_config_files(root_dir):
+        try:
+            stat = os.stat(config_filename)
+            stats.append((config_filename, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            pass
+    return tuple(stats)
+
+
+def load_configs_from_file(root_dir: str, pool: Optional[Executor] = None):
+    """
+    load kag_config.yaml from kag_config_dir
+    :param pool: parse the files on this pool
+    """
+    config_filenames = find_config_files(root_dir)
     logger.info(f"find {len(config_filenames)} yaml files")
 
+    parse = lambda config_filename: load_config(config_file=config_filename)
     configs = []
-    for config_filename in config_filenames:
-        config = load_config(config_file=config_filename)
+    for config in (pool.map(parse, config_filenames) if pool else map(parse, config_filenames)):
         if config and config['project'] and config['project']['namespace']:
             configs.append(config)
 
@@ -90,6 +203,55 @@ def load_projects_from_server(host_addr: str):
     return project_client.get_all()
 
 
+def load_project_snapshot(filename: str) -> Optional[Dict[str, str]]:
+    """
+    the project list of the OpenSPG server saved by the last successful call, None if there is none
+    """
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)['projects']
+    except (OSError, ValueError, KeyError) as e:
+        logger.info(f'no project snapshot in {filename}: {e}')
+        return None
+
+
+def save_project_snapshot(filename: str, projects: Dict[str, str]):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    temp_filename = f'{filename}.tmp'
+    with open(temp_filename, 'w', encoding='utf-8') as f:
+        json.dump({'saved_at': time.time(), 'projects': projects}, f, ensure_ascii=False, indent=2)
+    os.replace(temp_filename, filename)
+
+
+def apply_base_config(config: Optional[dict], host_addr: str, project_id: str):
+    """
+    make the config of a project on the OpenSPG server the global KAG config, the base of all project configs.
+    it is asked by the service instead of by `import kag` (KAG_PROJECT_ID unset), which has no timeout.
+    without it (None or not found) the project id and host are still set, as KAG_PROJECT_ID did
+    """
+    if config:
+        KAG_CONFIG.config = config
+        KAG_CONFIG.global_config.initialize(**{
+            KAGConstants.KAG_PROJECT_ID_KEY: project_id,
+            KAGConstants.KAG_PROJECT_HOST_ADDR_KEY: host_addr,
+            **config.get(KAGConstants.PROJECT_CONFIG_KEY, {}),
+        })
+        KAG_CONFIG.init_log_config(config)
+        KAG_CONFIG.prod = True
+        KAG_CONFIG._is_initialized = True
+        return
+    if not getattr(KAG_PROJECT_CONF, 'project_id', None):
+        KAG_PROJECT_CONF.project_id = project_id
+    if not getattr(KAG_PROJECT_CONF, 'host_addr', None):
+        KAG_PROJECT_CONF.host_addr = host_addr
+
+
+def import_addition_modules(addition_modules: Optional[List[str]]):
+    import_modules_from_path(os.path.join(os.path.dirname(__file__), 'kag_additions'))
+    for module in addition_modules or []:
+        import_modules_from_path(module)
+
+
 def load_kag_config(host_addr, project_id):
     """
     copy those codes from kag.common.conf.load_config
@@ -117,64 +279,350 @@ def load_kag_config(host_addr, project_id):
 
 class KagService:
 
-    def __init__(self, service_url: str, config_dir: str, addition_modules: list[str] = None, ):
+    def __init__(self, service_url: str, config_dir: str, addition_modules: list[str] = None,
+                 solver_loops: int = 4, max_concurrent_solves: int = 32,
+                 solver_pool_size: int = 4, solver_pool_warmup: int = 1, solver_pool_idle_timeout: float = 600,
+                 report_mode: str = 'full', report_flush_interval: float = 0,
+                 project_snapshot: str = None, server_timeout: float = None, warmup: bool = True,
+                 base_project_id: str = '1'):
+        """
+        :param project_snapshot: a file keeping the project list of the OpenSPG server, used when the server
+                                 fails or does not answer within `server_timeout` seconds
+        :param warmup: warm up the solvers of all projects before returning, otherwise call `warmup_solvers()`
+        :param base_project_id: the project on the OpenSPG server whose config all project configs are layered over
+        """
+        # the solvers of all projects share the global KAG config objects, each solve sees its own project config
+        install_contextual_config()
         self.service_url = service_url
         self.config_dir = config_dir
-
-        import_modules_from_path(os.path.join(os.path.dirname(__file__), 'kag_additions'))
-        for module in addition_modules or []:
-            import_modules_from_path(module)
-
+        self.executor = SolverExecutor(loops=solver_loops, max_concurrency=max_concurrent_solves)
+        self.build_lock = threading.Lock()
+        self.solver_pool = SolverPool(self.build_solver, max_size=solver_pool_size,
+                                      idle_timeout=solver_pool_idle_timeout)
+        self.solver_pool_warmup = solver_pool_warmup
+        self.report_mode = report_mode
+        self.report_flush_interval = report_flush_interval
+        self.mean_solve_time = {}
+        self.refresh_lock = threading.Lock()
+        # (stat_config_files, configs) of the last parsed config dir
+        self.config_files = (None, [])
+        # the last config of a project that failed to build, not tried again until it changes
+        self.failed_configs = {}
+        self.project_snapshot = project_snapshot
+        self.snapshot_projects = load_project_snapshot(project_snapshot) if project_snapshot else None
+        self.server_timeout = server_timeout
+        # the server is asked on its own threads, a server that hangs does not hold up the config parsing
+        self.server_pool = ThreadPoolExecutor(2, thread_name_prefix='openspg-server')
+        self.loader_pool = ThreadPoolExecutor(min(8, (os.cpu_count() or 1) + 2), thread_name_prefix='project-loader')
+        # the projects whose solvers are warm, and whether the project list was loaded at least once
+        self.warm_projects = set()
+        self.projects_loaded = False
+
+        # the additions are registered while the configs are parsed and the server is asked
+        start_time = time.monotonic()
+        # already loaded when KAG_PROJECT_ID was set at import
+        base_config = None if KAG_CONFIG.prod else self.server_pool.submit(load_kag_config, service_url,
+                                                                             base_project_id)
+        modules = self.loader_pool.submit(import_addition_modules, addition_modules)
         self.config_map = {}
         self.load_project_list()
+        modules.result()
+        install_context_propagation()
+        if base_config is not None:
+            config = None
+            try:
+                # solvers are built on top of it, asked at the same time as the project list, within the same
+                # timeout. applied here, a late answer is dropped instead of changing the config under the solvers
+                config = base_config.result(timeout=None if self.server_timeout is None else
+                                            max(0.0, start_time + self.server_timeout - time.monotonic()))
+            except Exception as e:
+                logger.warning(f'base KAG config not loaded from the OpenSPG server, start without it: {repr(e)}')
+            apply_base_config(config, service_url, base_project_id)
         self.trace_project_list()
+        self.register_projects()
+        if warmup:
+            self.warmup_solvers()
         pass
 
     def load_project_list(self):
-        configs = load_configs_from_file(self.config_dir)
-        projects = load_projects_from_server(host_addr=self.service_url)
-
-        for config in configs:
+        try:
+            self.config_map = self.load_project_configs()
+            self.projects_loaded = True
+        except Exception as e:
+            # the refresh adds them once the server answers
+            logger.error(f'failed to load the projects, start without them: {e}')
+
+    def load_project_configs(self) -> Dict[str, dict]:
+        """
+        the configs of the projects found both in the config dir and on the OpenSPG server,
+        the config files are parsed again only when they changed
+        """
+        server_call = self.server_pool.submit(load_projects_from_server, self.service_url)
+        config_stats = stat_config_files(self.config_dir)
+        if config_stats != self.config_files[0]:
+            self.config_files = (config_stats, load_configs_from_file(self.config_dir, self.loader_pool))
+        projects = self.wait_projects_from_server(server_call)
+
+        config_map = {}
+        for config in self.config_files[1]:
             project_name = config['project']['namespace']
             project_id = str(config['project']['id'])
             if project_name in projects and projects[project_name] == project_id:
-                self.config_map[project_name] = config
-        pass
+                config_map[project_name] = config
+        return config_map
+
+    def wait_projects_from_server(self, server_call: Future) -> Dict[str, str]:
+        """
+        the project list of the server, or of the snapshot when the server fails or is too slow
+        """
+        try:
+            projects = server_call.result(timeout=self.server_timeout)
+        except Exception as e:
+            if self.snapshot_projects is None:
+                raise
+            logger.warning(f'OpenSPG server unavailable ({repr(e)}), use the project snapshot {self.project_snapshot}')
+            return self.snapshot_projects
+        if self.project_snapshot and projects != self.snapshot_projects:
+            try:
+                save_project_snapshot(self.project_snapshot, projects)
+                self.snapshot_projects = projects
+            except OSError as e:
+                logger.error(f'failed to save the project snapshot {self.project_snapshot}: {e}')
+        return projects
+
+    def refresh_projects(self) -> bool:
+        """
+        reload the project list and configs, rebuild the solvers of the added and changed projects only,
+        then swap the project list at once. queries in flight finish with the solvers of their old config,
+        a project whose new config fails to build keeps its current one
+        :return: whether the project list changed
+        """
+        with self.refresh_lock:
+            configs = self.load_project_configs()
+            self.projects_loaded = True
+            current = self.config_map
+            config_map = dict(current)
+            for project_name, config in configs.items():
+                if current.get(project_name) == config or self.failed_configs.get(project_name) == config:
+                    continue
+                action = 'rebuilt' if project_name in current else 'added'
+                try:
+                    self.solver_pool.rebuild(project_name, config, warmup=self.solver_pool_warmup)
+                except Exception as e:
+                    logger.error(f'failed to build project {project_name}, keep its current config: {e}')
+                    PROJECT_RELOADS.labels(project=project_name, action='failed').inc()
+                    self.failed_configs[project_name] = config
+                    continue
+                self.failed_configs.pop(project_name, None)
+                self.warm_projects.add(project_name)
+                config_map[project_name] = config
+                PROJECT_RELOADS.labels(project=project_name, action=action).inc()
+                logger.info(f'project {project_name} {action}')
+
+            removed = [x for x in current if x not in configs]
+            for project_name in removed:
+                del config_map[project_name]
+            if config_map == current:
+                return False
+
+            self.config_map = config_map
+            for project_name in removed:
+                self.solver_pool.unregister(project_name)
+                self.warm_projects.discard(project_name)
+                PROJECT_RELOADS.labels(project=project_name, action='removed').inc()
+                logger.info(f'project {project_name} removed')
+            return True
 
     def trace_project_list(self):
         logger.info(f'find {len(self.config_map)} projects')
         for project_name in self.config_map:
             logger.info(f'  - {project_name}')
 
+    def register_projects(self):
+        """
+        register the projects with cold pools, their first queries build solvers until they are warmed up
+        """
+        for project_name, config in self.config_map.items():
+            self.solver_pool.register(project_name, config)
+
+    def warmup_solvers(self):
+        """
+        warm up the projects one after another (solver builds are serialized anyway), so that the first
+        ones are ready as soon as possible
+        """
+        for project_name in list(self.config_map):
+            if project_name in self.warm_projects:
+                continue
+            start_time = time.perf_counter()
+            self.solver_pool.warmup(project_name, self.solver_pool_warmup)
+            self.warm_projects.add(project_name)
+            logger.info(f'warm up {project_name} solvers in {time.perf_counter() - start_time:.3f}s')
+
+    def rebuild_project(self, project_name: str, config: dict):
+        """
+        replace the config of a project and rebuild its pooled solvers
+        """
+        self.solver_pool.rebuild(project_name, config, warmup=self.solver_pool_warmup)
+        # copied, the project list is never changed in place while requests read it
+        self.config_map = {**self.config_map, project_name: config}
+
+    def build_solver(self, project_name: str, config: dict) -> ProjectSolver:
+        """
+        build a solver bound to its own project config, the global KAG config is never touched
+        """
+        kag_config = create_project_config(config)
+        # registrable singletons (e.g. vectorize models) are not safe to construct concurrently
+        with self.build_lock, use_project_config(kag_config):
+            pipeline = SolverPipelineABC.from_config(config["kag_solver_pipeline"])
+            # the components may import KAG modules of their own
+            install_context_propagation()
+        return ProjectSolver(project_name, pipeline, kag_config)
+
     def get_projects(self):
         return self.config_map
 
     def get_project_id_by_name(self, project_name: str):
         return self.config_map.get(project_name)
 
-    async def query(self, query: str, project_name: str, printer=None):
+    async def query(self, query: str, project_name: str, printer=None, raise_errors: bool = False,
+                    report_mode: str = None, trace_id: str = None):
+        """
+        :param trace_id: the id of the trace of the solve when tracing is enabled, a new one if None
+        """
+        in_flight = SOLVES_IN_FLIGHT.labels(project=project_name)
+        in_flight.inc()
+        start_time = time.perf_counter()
+        status = 'error'
+        error = None
+        trace = TRACER.start('solve', trace_id=trace_id, project=project_name)
+        # set on the solver loop, followed by the tasks and threads of the pipeline into the upstream calls
+        trace_token = CURRENT_TRACE.set(trace)
         try:
-            reporter = EventReporter(printer=printer)
-
-            global_config = self.config_map[project_name]
-
-            KAG_CONFIG.update_conf(global_config)
-            KAG_PROJECT_CONF.project_id = global_config['project']['id']
-
-            solver = SolverPipelineABC.from_config(global_config["kag_solver_pipeline"])
-            return await solver.ainvoke(query, reporter=reporter)
-
+            lease = await asyncio.to_thread(self.solver_pool.acquire, project_name)
+            try:
+                solver: ProjectSolver = lease.solver
+                with solver.scope():
+                    reporter = EventReporter(printer=printer, report_mode=report_mode or self.report_mode,
+                                             flush_interval=self.report_flush_interval, trace=trace)
+                    try:
+                        answer = await solver.pipeline.ainvoke(query, reporter=reporter)
+                        status = 'ok'
+                        return answer
+                    finally:
+                        reporter.flush(close=True)
+            finally:
+                self.solver_pool.release(lease)
+
+        except asyncio.CancelledError:
+            status = error = 'cancelled'
+            raise
         except Exception as e:
+            error = str(e) or type(e).__name__
             traceback.print_exc()
+            if raise_errors:
+                raise
             return str(e)
+        finally:
+            in_flight.dec()
+            SOLVE_SECONDS.labels(project=project_name, status=status).observe(time.perf_counter() - start_time)
+            CURRENT_TRACE.reset(trace_token)
+            if trace is not None:
+                trace.end(error)
+
+    async def stream_query(self, query: str, project_name: str, report_mode: str = None,
+                           trace_id: str = None) -> AsyncGenerator[Any, None]:
+        """
+        run the query on the solver executor and yield the reporter events as they arrive
+        :param report_mode: 'full' or 'delta' reporter events, see EventReporter, the service default if None
+        :param trace_id: see query
+        """
+        event_queue = EventQueue()
+
+        def send_event(event):
+            # a client too slow for the 'full' reports gets the latest state of each report
+            key = event['data'].get('report_id') if event.get('event') == 'changed' else None
+            event_queue.send_nowait(event, key=key)
+
+        async def do_query():
+            try:
+                return await self.query(query, project_name, printer=send_event, report_mode=report_mode,
+                                        trace_id=trace_id)
+            finally:
+                event_queue.close()
+
+        start_time = time.perf_counter()
+        task = asyncio.create_task(self.executor.run(do_query))
+        try:
+            async for event in event_queue:
+                yield event
+            await task
+            self.record_solve_time(project_name, time.perf_counter() - start_time)
+        finally:
+            if not task.done():
+                # the consumer is gone (e.g. the client disconnected), stop the solver and its upstream calls
+                task.cancel()
+                self.record_cancelled_solve(project_name, time.perf_counter() - start_time)
+            event_queue.close()
+            for event in event_queue.drain():
+                close_token_stream(event)
+
+    def record_solve_time(self, project_name: str, seconds: float):
+        mean = self.mean_solve_time.get(project_name)
+        self.mean_solve_time[project_name] = seconds if mean is None else 0.9 * mean + 0.1 * seconds
+
+    def record_cancelled_solve(self, project_name: str, seconds: float):
+        SOLVES_CANCELLED.labels(project=project_name).inc()
+        SOLVE_CANCELLED_AFTER.labels(project=project_name).observe(seconds)
+        # estimated from the mean time of the finished solves of the project
+        mean = self.mean_solve_time.get(project_name)
+        if mean is not None and mean > seconds:
+            SOLVE_SECONDS_SAVED.labels(project=project_name).inc(mean - seconds)
+
+    async def solve(self, query: str, project_name: str, raise_errors: bool = False,
+                    trace_id: str = None) -> Tuple[Any, dict, float]:
+        """
+        run the query on the solver executor without reporter events
+        :param raise_errors: raise solver errors instead of returning them as the answer
+        :param trace_id: see query
+        :return: the final answer, the upstream token usage and the solve time in seconds
+        """
+        task_id = f'solve-{uuid.uuid4().hex}'
+
+        async def do_query():
+            # set on the solver loop, the context of the caller does not follow the coroutine there
+            with LLMCallCcontext(task_id, True):
+                answer = await self.query(query, project_name, raise_errors=raise_errors, trace_id=trace_id)
+                return await collect_answer(answer)
+
+        start_time = time.perf_counter()
+        try:
+            answer = await self.executor.run(do_query)
+            usage = TokenMeterFactory().get_meter(task_id).to_dict()
+        finally:
+            TokenMeterFactory().remove_meter(task_id)
+        return answer, usage, time.perf_counter() - start_time
+
     pass
 
 
+async def collect_answer(answer: Any) -> Any:
+    """
+    join a streamed answer (the tokens of a streaming llm) into one string
+    """
+    if isinstance(answer, AsyncIterator):
+        return ''.join([x async for x in answer if x])
+    if isinstance(answer, Iterator):
+        return await asyncio.to_thread(lambda: ''.join(x for x in answer if x))
+    return answer
+
+
 kag_service = None
 
 
-def get_kag_service(service_url: str, config_dir: str, addition_modules: list[str] = None) -> KagService:
+def get_kag_service(service_url: str, config_dir: str, addition_modules: list[str] = None,
+                    **kwargs) -> KagService:
     global kag_service
     if kag_service is None:
-        kag_service = KagService(service_url=service_url, config_dir=config_dir, addition_modules=addition_modules)
+        kag_service = KagService(service_url=service_url, config_dir=config_dir, addition_modules=addition_modules,
+                                 **kwargs)
     return kag_service
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, List, Optional, Sequence
+
+from app.metrics import counter, histogram
+
+logger = logging.getLogger()
+
+UPSTREAM_BATCHES = counter('openspg_upstream_batches_total', 'Batched upstream calls', ['name'])
+UPSTREAM_BATCH_SIZE = histogram('openspg_upstream_batch_size', 'Items per batched upstream call', ['name'],
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+
+class MicroBatcher:
+    """
+    Gathers items submitted concurrently (e.g. texts to vectorize from all in-flight solves) into batches,
+    sends each batch in one upstream call and fans the results out.
+
+    - adaptive: a batch is sent as soon as an upstream slot is free, items only gather while all
+      `max_inflight` slots are busy, so a lone call is never delayed
+    - with a `window`, a batch also waits up to `window` seconds after its oldest item for more items, unless
+      no batch is in flight at all
+    - at most `max_inflight` batches are in flight, and batches start at most every `call_interval` seconds
+    - callers wait at most `timeout` seconds for their results, items still pending then are dropped
+    """
+
+    def __init__(self,
+                 name: str,
+                 fn: Callable[[List[Any]], Sequence[Any]],
+                 max_batch_size: int = 32,
+                 window: float = 0,
+                 max_inflight: int = 4,
+                 call_interval: float = 0,
+                 timeout: float = 300):
+        self.name = name
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window
+        self.call_interval = call_interval
+        self.timeout = timeout
+        self.next_call_at = 0
+
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.slots = threading.Semaphore(max_inflight)
+        self.inflight = 0
+        self.executor = ThreadPoolExecutor(max_inflight, thread_name_prefix=f'batch-{name}')
+        self.thread = None
+
+        self.batches = UPSTREAM_BATCHES.labels(name=name)
+        self.batch_size = UPSTREAM_BATCH_SIZE.labels(name=name)
+
+    def submit(self, items: List[Any]) -> List[Future]:
+        futures = [Future() for _ in items]
+        now = time.monotonic()
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name=f'batcher-{self.name}', daemon=True)
+                self.thread.start()
+            self.pending.extend((item, future, now) for item, future in zip(items, futures))
+            self.cond.notify()
+        return futures
+
+    def map(self, items: List[Any], timeout: Optional[float] = None) -> List[Any]:
+        """
+        :return: the results of items, blocks until all their batches are done
+        :param timeout: seconds to wait for all the results, the batcher `timeout` if None
+        :raise TimeoutError: the results did not arrive in time
+        """
+        futures = self.submit(items)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        try:
+            return [x.result(max(0.0, deadline - time.monotonic())) for x in futures]
+        except FutureTimeoutError:
+            # the items not sent yet are dropped by the batcher
+            for future in futures:
+                future.cancel()
+            raise TimeoutError(f'{self.name}: {len(items)} items not done within the batcher timeout') from None
+
+    def run(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.pending:
+                        self.cond.wait()
+                    while len(self.pending) < self.max_batch_size and self.inflight > 0:
+                        remaining = self.pending[0][2] + self.window - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.cond.wait(remaining)
+
+                # items keep gathering while waiting for an upstream slot
+                self.slots.acquire()
+                batch, counted = [], False
+                try:
+                    self.wait_for_rate_limit()
+                    with self.cond:
+                        while self.pending and len(batch) < self.max_batch_size:
+                            item = self.pending.popleft()
+                            # cancelled once its caller gave up, the others start running
+                            if item[1].set_running_or_notify_cancel():
+                                batch.append(item)
+                        self.inflight += 1
+                        counted = True
+                    self.executor.submit(self.call, batch)
+                except BaseException as e:
+                    # call() did not start, so it neither fails the batch nor frees its slot
+                    for _, future, _ in batch:
+                        future.set_exception(e)
+                    if counted:
+                        with self.cond:
+                            self.inflight -= 1
+                    self.slots.release()
+                    raise
+        except BaseException as e:
+            logger.exception(f'batcher {self.name} stopped: {e}')
+            with self.cond:
+                # the next submit starts it again
+                self.thread = None
+                pending, self.pending = list(self.pending), deque()
+            for _, future, _ in pending:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+
+    def wait_for_rate_limit(self):
+        now = time.monotonic()
+        if self.next_call_at > now:
+            time.sleep(self.next_call_at - now)
+        self.next_call_at = max(now, self.next_call_at) + self.call_interval
+
+    def call(self, batch: list):
+        try:
+            if not batch:
+                return
+            self.batches.inc()
+            self.batch_size.observe(len(batch))
+            results = list(self.fn([x[0] for x in batch]))
+            if len(results) != len(batch):
+                raise RuntimeError(f'{self.name} returned {len(results)} results for {len(batch)} items')
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        except BaseException as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            with self.cond:
+                self.inflight -= 1
+            self.slots.release()
+
+    pass
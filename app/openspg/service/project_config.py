@@ -0,0 +1,167 @@
+"""
+Context-local KAG configuration.
+
+KAG components read their settings from the process-global `KAG_CONFIG` / `KAG_PROJECT_CONF`.
+Those two objects are turned into proxies that resolve to the config bound to the current context
+(asyncio task or `asyncio.to_thread` call), so solvers of different projects can run concurrently.
+
+KAG also runs blocking work on its own `ThreadPoolExecutor`s, whose threads do not inherit the context of the
+caller, so the KAG modules are made to create executors that run each call in a copy of the submitter's context.
+the other thread pools of the process are left alone.
+
+both are installed by the KAG service at startup.
+"""
+import concurrent.futures
+import contextvars
+import copy
+import sys
+import types
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from kag.common.conf import KAGConfigMgr, KAGGlobalConf, KAG_CONFIG, KAG_PROJECT_CONF, KAGConstants
+
+_PROJECT_CONFIG: ContextVar[Optional[KAGConfigMgr]] = ContextVar('kag_project_config', default=None)
+
+
+def _current_target(obj, name: str):
+    if name.startswith('__'):
+        return None
+    project_config = _PROJECT_CONFIG.get()
+    if project_config is None:
+        return None
+    return project_config if isinstance(obj, KAGConfigMgr) else project_config.global_config
+
+
+class ContextualKAGConfigMgr(KAGConfigMgr):
+
+    def __getattribute__(self, name: str) -> Any:
+        target = _current_target(self, name)
+        if target is not None:
+            return getattr(target, name)
+        return super().__getattribute__(name)
+
+    def __setattr__(self, name: str, value: Any):
+        target = _current_target(self, name)
+        if target is not None:
+            return setattr(target, name, value)
+        return super().__setattr__(name, value)
+
+
+class ContextualKAGGlobalConf(KAGGlobalConf):
+
+    def __getattribute__(self, name: str) -> Any:
+        target = _current_target(self, name)
+        if target is not None:
+            return getattr(target, name)
+        return super().__getattribute__(name)
+
+    def __setattr__(self, name: str, value: Any):
+        target = _current_target(self, name)
+        if target is not None:
+            return setattr(target, name, value)
+        return super().__setattr__(name, value)
+
+
+def install_contextual_config():
+    """
+    turn the global KAG config objects into context-aware proxies, safe to call more than once
+    """
+    KAG_CONFIG.__class__ = ContextualKAGConfigMgr
+    KAG_PROJECT_CONF.__class__ = ContextualKAGGlobalConf
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    runs each call (also those of `map`) in a copy of the context of the submitter
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    pass
+
+
+# `concurrent` as seen by the KAG modules calling `concurrent.futures.ThreadPoolExecutor()`
+_CONTEXT_FUTURES = types.ModuleType(concurrent.futures.__name__)
+_CONTEXT_FUTURES.__dict__.update({k: v for k, v in vars(concurrent.futures).items() if not k.startswith('__')})
+_CONTEXT_FUTURES.ThreadPoolExecutor = ContextThreadPoolExecutor
+_CONTEXT_CONCURRENT = types.ModuleType(concurrent.__name__)
+_CONTEXT_CONCURRENT.futures = _CONTEXT_FUTURES
+
+_PROPAGATION_PACKAGES = ('kag', 'knext')
+# len(sys.modules) at the last install, the modules are scanned again only when new ones were imported
+_propagation_installed_at = 0
+
+
+def install_context_propagation():
+    """
+    make the imported KAG modules create `ContextThreadPoolExecutor`s, so the project config (and the request trace)
+    reach their thread pools. to be called again once more of them may be imported, safe to call more than once
+    """
+    global _propagation_installed_at
+    if len(sys.modules) == _propagation_installed_at:
+        return
+    _propagation_installed_at = len(sys.modules)
+    for name, module in list(sys.modules.items()):
+        if module is None or name.split('.', 1)[0] not in _PROPAGATION_PACKAGES:
+            continue
+        namespace = vars(module)
+        if namespace.get('ThreadPoolExecutor') is ThreadPoolExecutor:
+            namespace['ThreadPoolExecutor'] = ContextThreadPoolExecutor
+        if namespace.get('concurrent') is concurrent:
+            namespace['concurrent'] = _CONTEXT_CONCURRENT
+
+
+def create_project_config(config: dict) -> KAGConfigMgr:
+    """
+    create a standalone KAG config for a project, layered over the global config
+    """
+    token = _PROJECT_CONFIG.set(None)
+    try:
+        base_config = KAG_CONFIG.all_config
+    finally:
+        _PROJECT_CONFIG.reset(token)
+
+    project_config = KAGConfigMgr()
+    project_config.update_conf(base_config)
+    project_config.update_conf(copy.deepcopy(config))
+    project_config.global_config.initialize(**copy.deepcopy(config.get(KAGConstants.PROJECT_CONFIG_KEY, {})))
+    project_config.prod = False
+    project_config._is_initialized = True
+    return project_config
+
+
+def get_project_config() -> Optional[KAGConfigMgr]:
+    return _PROJECT_CONFIG.get()
+
+
+@contextmanager
+def use_project_config(project_config: KAGConfigMgr):
+    """
+    bind a project config to the current context
+    """
+    token = _PROJECT_CONFIG.set(project_config)
+    try:
+        yield project_config
+    finally:
+        _PROJECT_CONFIG.reset(token)
+
+
+class ProjectSolver:
+    """
+    a solver pipeline together with the project config it was built from
+    """
+
+    def __init__(self, project_name: str, pipeline: Any, kag_config: KAGConfigMgr):
+        self.project_name = project_name
+        self.pipeline = pipeline
+        self.kag_config = kag_config
+
+    def scope(self):
+        return use_project_config(self.kag_config)
+
+    pass
+
@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from app.metrics import counter, gauge
+
+logger = logging.getLogger()
+
+REFRESHES = counter('openspg_refreshes_total', 'Runs of the background refresh', ['name', 'result'])
+REFRESHED_AT = gauge('openspg_refreshed_timestamp_seconds', 'Unix time of the last successful refresh', ['name'])
+
+
+class Refresher:
+    """
+    Runs refresh functions (reload the projects, the API keys) every `interval` seconds on a daemon thread,
+    so that config changes are picked up without a restart. a function returns whether something changed,
+    an error is logged and the function runs again at the next interval
+    """
+
+    def __init__(self, interval: float = 30):
+        """
+        :param interval: 0 disables the background refresh, `refresh()` can still be called
+        """
+        self.interval = interval
+        self.functions: Dict[str, Callable[[], bool]] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add(self, name: str, fn: Callable[[], bool]):
+        """
+        register a refresh function, the thread starts with the first one
+        """
+        with self.lock:
+            self.functions[name] = fn
+            if self.thread is None and self.interval > 0:
+                self.thread = threading.Thread(target=self.run, name='refresher', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.refresh()
+
+    def refresh(self) -> Dict[str, bool]:
+        """
+        run all refresh functions once
+        :return: whether each one changed something
+        """
+        with self.lock:
+            functions = list(self.functions.items())
+        results = {}
+        for name, fn in functions:
+            start_time = time.perf_counter()
+            try:
+                results[name] = bool(fn())
+            except Exception as e:
+                logger.error(f'failed to refresh {name}: {e}')
+                REFRESHES.labels(name=name, result='error').inc()
+                continue
+            REFRESHES.labels(name=name, result='changed' if results[name] else 'unchanged').inc()
+            REFRESHED_AT.labels(name=name).set(time.time())
+            if results[name]:
+                logger.info(f'refreshed {name} in {time.perf_counter() - start_time:.3f}s')
+        return results
+
+    def stop(self):
+        self.stopped.set()
+
+    pass
+
+
+refresher: Optional[Refresher] = None
+
+
+def get_refresher(**kwargs) -> Refresher:
+    global refresher
+    if refresher is None:
+        refresher = Refresher(**kwargs)
+    return refresher
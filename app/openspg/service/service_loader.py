@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from app.metrics import gauge
+
+logger = logging.getLogger()
+
+STARTUP_SECONDS = gauge('openspg_startup_seconds', 'Seconds spent in each stage of the startup', ['stage'])
+
+
+class ServiceUnavailable(Exception):
+    """
+    the KAG service is still loading, or failed to load
+    """
+
+    def __init__(self, message: str, retry_after: float = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def import_kag_service():
+    """
+    openspg-kag takes seconds to import. KAG_PROJECT_ID is left unset, otherwise `import kag` also fetches the
+    config of that project from the OpenSPG server, without timeout; the service loads it within its server
+    timeout instead, see `apply_base_config`
+    """
+    from app.openspg.service import kag_service
+    return kag_service
+
+
+class ServiceLoader:
+    """
+    Builds the KAG service on a background thread, so the server listens while openspg-kag is imported
+    and the projects are loaded.
+
+    - live: the service is loading or loaded, not failed
+    - ready: the service is loaded and its first `ready_projects` projects have warm solvers,
+      the other projects keep warming up behind the traffic
+    """
+
+    def __init__(self):
+        self.service = None
+        self.error: Optional[BaseException] = None
+        self.ready_projects = 1
+        self.thread = None
+        self.lock = threading.Lock()
+        self.loaded = threading.Event()
+        self.listeners: List[Callable[[Any], None]] = []
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def start(self, ready_projects: int = 1, **service_kwargs):
+        """
+        :param ready_projects: warm projects needed to be ready, 0 for all of them
+        :param service_kwargs: arguments of `get_kag_service`
+        """
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.ready_projects = ready_projects
+            self.thread = threading.Thread(target=self.run, kwargs=service_kwargs, name='service-loader', daemon=True)
+            self.thread.start()
+
+    def run(self, **service_kwargs):
+        try:
+            with self.stage('import'):
+                get_kag_service = import_kag_service().get_kag_service
+            with self.stage('projects'):
+                service = get_kag_service(warmup=False, **service_kwargs)
+            with self.lock:
+                self.service = service
+                listeners = list(self.listeners)
+            self.loaded.set()
+            for listener in listeners:
+                listener(service)
+            with self.stage('warmup'):
+                service.warmup_solvers()
+        except BaseException as e:
+            logger.exception(f'failed to load the KAG service: {e}')
+            self.error = e
+            self.loaded.set()
+        finally:
+            STARTUP_SECONDS.labels(stage='total').set(time.perf_counter() - self.started_at)
+
+    @contextmanager
+    def stage(self, name: str):
+        start_time = time.perf_counter()
+        yield
+        self.stages[name] = time.perf_counter() - start_time
+        STARTUP_SECONDS.labels(stage=name).set(self.stages[name])
+        logger.info(f'startup stage {name} done in {self.stages[name]:.3f}s')
+
+    def on_load(self, listener: Callable[[Any], None]):
+        """
+        call `listener(service)` once the service is loaded, or right away if it already is
+        """
+        with self.lock:
+            service = self.service
+            if service is None:
+                self.listeners.append(listener)
+        if service is not None:
+            listener(service)
+
+    def get(self):
+        """
+        :raise ServiceUnavailable: the service is not loaded yet
+        """
+        service = self.service
+        if service is None:
+            if self.error is not None:
+                raise ServiceUnavailable(f'KAG service failed to load: {self.error}', retry_after=30)
+            raise ServiceUnavailable('KAG service is loading')
+        return service
+
+    async def wait(self):
+        """
+        wait until the service is loaded
+        :raise ServiceUnavailable: it failed to load
+        """
+        if not self.loaded.is_set():
+            await asyncio.to_thread(self.loaded.wait)
+        return self.get()
+
+    @property
+    def live(self) -> bool:
+        return self.error is None
+
+    @property
+    def ready(self) -> bool:
+        service = self.service
+        if service is None or not service.projects_loaded:
+            return False
+        projects = len(service.get_projects())
+        return len(service.warm_projects) >= min(self.ready_projects or projects, projects)
+
+    def status(self) -> dict:
+        service = self.service
+        status = {
+            'live': self.live,
+            'ready': self.ready,
+            'uptime': round(time.perf_counter() - self.started_at, 3),
+            'stages': {k: round(v, 3) for k, v in self.stages.items()},
+        }
+        if service is not None:
+            status['projects'] = len(service.get_projects())
+            status['warm_projects'] = len(service.warm_projects)
+        if self.error is not None:
+            status['error'] = str(self.error)
+        return status
+
+    pass
+
+
+service_loader: Optional[ServiceLoader] = None
+
+
+def get_service_loader() -> ServiceLoader:
+    global service_loader
+    if service_loader is None:
+        service_loader = ServiceLoader()
+    return service_loader
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Any, List
+
+logger = logging.getLogger()
+
+
+class SolverExecutor:
+    """
+    Runs solver coroutines on a fixed pool of worker event loops.
+
+    - `loops` worker loops are started once and shared by all requests, 0 means run on the caller's loop
+    - at most `max_concurrency` solves run at the same time, the others wait in FIFO order
+    """
+
+    def __init__(self, loops: int = 4, max_concurrency: int = 32):
+        self.max_concurrency = max_concurrency
+        self.loops: List[asyncio.AbstractEventLoop] = []
+        self.threads: List[threading.Thread] = []
+        self.loads: List[int] = []
+        self.lock = threading.Lock()
+        self._semaphore = None
+
+        for idx in range(loops):
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self._run_loop, args=(loop,), name=f'solver-loop-{idx}', daemon=True)
+            thread.start()
+            self.loops.append(loop)
+            self.threads.append(thread)
+            self.loads.append(0)
+        pass
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, so that it binds to the server loop instead of the import-time loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run(self, coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        wait for a free slot, then run the coroutine on the least loaded worker loop.
+        cancelling the caller cancels the coroutine on the worker loop
+        """
+        async with self.semaphore:
+            if not self.loops:
+                return await coro_factory()
+
+            idx = self._acquire_loop()
+            try:
+                future = asyncio.run_coroutine_threadsafe(coro_factory(), self.loops[idx])
+                try:
+                    return await asyncio.wrap_future(future)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+            finally:
+                self._release_loop(idx)
+
+    def _acquire_loop(self) -> int:
+        with self.lock:
+            idx = min(range(len(self.loads)), key=lambda x: self.loads[x])
+            self.loads[idx] += 1
+            return idx
+
+    def _release_loop(self, idx: int):
+        with self.lock:
+            self.loads[idx] -= 1
+
+    def shutdown(self):
+        for loop in self.loops:
+            loop.call_soon_threadsafe(loop.stop)
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.loops.clear()
+        self.threads.clear()
+        self.loads.clear()
+
+    pass
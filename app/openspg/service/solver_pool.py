@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger()
+
+
+class SolverLease:
+    """
+    a solver pipeline checked out from the pool
+    """
+
+    def __init__(self, project_name: str, solver: Any, generation: int):
+        self.project_name = project_name
+        self.solver = solver
+        self.generation = generation
+
+
+class ProjectSolvers:
+    """
+    pooled solvers of one project
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.generation = 0
+        # (solver, released_at), most recently released on the right
+        self.idle = deque()
+        self.leased = 0
+
+
+class SolverPool:
+    """
+    A per-project pool of pre-built, reusable solver pipelines.
+
+    - a solver is leased exclusively by one query and returned to the pool afterward
+    - at most `max_size` idle solvers are kept per project, `max_size=0` disables pooling
+    - idle solvers older than `idle_timeout` seconds are evicted, `min_idle` of them are kept warm
+    - `rebuild` replaces the config of a project, solvers built from the old config are dropped
+    """
+
+    def __init__(self,
+                 factory: Callable[[str, dict], Any],
+                 max_size: int = 4,
+                 min_idle: int = 1,
+                 idle_timeout: float = 600):
+        self.factory = factory
+        self.max_size = max_size
+        self.min_idle = min(min_idle, max_size)
+        self.idle_timeout = idle_timeout
+        self.projects: Dict[str, ProjectSolvers] = {}
+        self.lock = threading.Lock()
+
+    def register(self, project_name: str, config: dict, warmup: int = 0):
+        """
+        register a project and build `warmup` solvers ahead of the first query
+        """
+        with self.lock:
+            self.projects[project_name] = ProjectSolvers(config)
+        self.warmup(project_name, warmup)
+
+    def unregister(self, project_name: str):
+        with self.lock:
+            self.projects.pop(project_name, None)
+
+    def rebuild(self, project_name: str, config: dict, warmup: int = 0):
+        """
+        switch a project to a new config. leased solvers finish their queries and are dropped on release.
+        the warm solvers of the new config are built before the switch, so queries never wait for them
+        :raise Exception: the new config fails to build a solver, the project keeps its current config
+        """
+        now = time.monotonic()
+        # at least one, a config that cannot build a solver is rejected here instead of failing the queries
+        solvers = [self.factory(project_name, config) for _ in range(max(1, min(warmup, self.max_size)))]
+        with self.lock:
+            project = self.projects.get(project_name)
+            if project is None:
+                project = self.projects[project_name] = ProjectSolvers(config)
+            else:
+                project.config = config
+                project.generation += 1
+            project.idle = deque((x, now) for x in solvers[:self.max_size])
+
+    def warmup(self, project_name: str, size: int):
+        size = min(size, self.max_size)
+        for _ in range(size):
+            with self.lock:
+                project = self.projects.get(project_name)
+                if project is None or len(project.idle) >= size:
+                    return
+                config, generation = project.config, project.generation
+            try:
+                solver = self.factory(project_name, config)
+            except Exception as e:
+                logger.error(f'failed to warm up solver of {project_name}: {e}')
+                return
+            self.release(SolverLease(project_name, solver, generation), leased=False)
+
+    def acquire(self, project_name: str) -> SolverLease:
+        """
+        lease an idle solver, or build a new one if the pool is empty
+        """
+        with self.lock:
+            project = self.projects.get(project_name)
+            if project is None:
+                raise KeyError(f'Project {project_name} not registered')
+            self._evict_idle(project)
+            project.leased += 1
+            if project.idle:
+                solver, _ = project.idle.pop()
+                return SolverLease(project_name, solver, project.generation)
+            config, generation = project.config, project.generation
+
+        try:
+            solver = self.factory(project_name, config)
+        except Exception:
+            with self.lock:
+                project.leased -= 1
+            raise
+        return SolverLease(project_name, solver, generation)
+
+    def release(self, lease: SolverLease, leased: bool = True):
+        with self.lock:
+            project = self.projects.get(lease.project_name)
+            if project is None:
+                return
+            if leased:
+                project.leased -= 1
+            if lease.generation != project.generation or len(project.idle) >= self.max_size:
+                return
+            project.idle.append((lease.solver, time.monotonic()))
+
+    @contextmanager
+    def lease(self, project_name: str):
+        lease = self.acquire(project_name)
+        try:
+            yield lease.solver
+        finally:
+            self.release(lease)
+
+    def evict_idle(self):
+        with self.lock:
+            for project in self.projects.values():
+                self._evict_idle(project)
+
+    def _evict_idle(self, project: ProjectSolvers):
+        expired_before = time.monotonic() - self.idle_timeout
+        # least recently released solvers are on the left
+        while len(project.idle) > self.min_idle and project.idle[0][1] < expired_before:
+            project.idle.popleft()
+
+    def stats(self, project_name: Optional[str] = None) -> dict:
+        with self.lock:
+            return {
+                name: {'idle': len(project.idle), 'leased': project.leased, 'generation': project.generation}
+                for name, project in self.projects.items()
+                if project_name is None or name == project_name
+            }
+
+    pass
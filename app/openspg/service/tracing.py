@@ -0,0 +1,237 @@
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from app.utils import dumps_json
+
+logger = logging.getLogger()
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def encode_attributes(attributes: Dict[str, Any]) -> List[dict]:
+    result = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            result.append({'key': key, 'value': {'boolValue': value}})
+        elif isinstance(value, int):
+            result.append({'key': key, 'value': {'intValue': str(value)}})
+        elif isinstance(value, float):
+            result.append({'key': key, 'value': {'doubleValue': value}})
+        else:
+            result.append({'key': key, 'value': {'stringValue': str(value)}})
+    return result
+
+
+class Span:
+    """
+    a timed operation of a trace, exported as an OTLP span
+    """
+
+    def __init__(self, trace_id: str, name: str, parent_id: Optional[str] = None, kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None, links: Optional[List['Span']] = None,
+                 trace: Optional['Trace'] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.links = links or []
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_UNSET
+        self.status_message = None
+        # set for upstream calls, which may outlive the solve (e.g. a token stream)
+        self.trace = trace
+
+    @property
+    def ended(self) -> bool:
+        return self.end_ns is not None
+
+    def end(self, error: Optional[str] = None):
+        if self.ended:
+            return
+        self.end_ns = time.time_ns()
+        self.status = STATUS_ERROR if error else STATUS_OK
+        self.status_message = error
+        if self.trace is not None:
+            self.trace.call_ended(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': encode_attributes(self.attributes),
+            'status': {'code': self.status},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.links:
+            span['links'] = [{'traceId': x.trace_id, 'spanId': x.span_id} for x in self.links]
+        if self.status_message:
+            span['status']['message'] = self.status_message
+        return span
+
+    pass
+
+
+def step_kind(segment: str, tag_name: str) -> str:
+    """
+    the kind of a solver step, from its reporter segment and tag
+    """
+    name = tag_name.lower()
+    if 'planning' in name or 'rewrite query' in name:
+        return 'planning'
+    if 'retriev' in name:
+        return 'retrieval'
+    if segment == 'answer' or segment.startswith('generator'):
+        return 'generation'
+    # the steps of the sub-questions
+    return 'reasoning'
+
+
+class Trace:
+    """
+    The spans of one solve: a root span, a span per solver step (reporter report) and a span per upstream call.
+
+    a step span starts at the first report line of its report and ends when the report is FINISH or ERROR,
+    sub reports are children of their parent report. an upstream call span is a child of the root span,
+    linked to the steps running when it started (steps of concurrent sub-questions may overlap).
+
+    the trace is exported when the solve ends, a call still running then (e.g. the token stream of the answer)
+    is exported on its own when it ends
+    """
+
+    def __init__(self, tracer: 'Tracer', trace_id: str, name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.lock = threading.Lock()
+        self.root = Span(trace_id, name, kind=SPAN_KIND_SERVER, attributes=attributes)
+        self.spans: List[Span] = [self.root]
+        self.steps: Dict[str, Span] = {}
+        self.exported = False
+
+    def step(self, segment: str, tag_name: str, status: str):
+        with self.lock:
+            span = self.steps.get(tag_name)
+            if span is None:
+                parent = self.steps.get(segment, self.root)
+                span = Span(self.trace_id, tag_name, parent_id=parent.span_id, attributes={
+                    'solver.step.kind': step_kind(segment, tag_name),
+                    'solver.step.segment': segment,
+                })
+                self.steps[tag_name] = span
+                self.spans.append(span)
+            if status in ['FINISH', 'ERROR']:
+                span.end(error='step failed' if status == 'ERROR' else None)
+
+    def start_call(self, name: str, attributes: Dict[str, Any]) -> Span:
+        with self.lock:
+            running = [x for x in self.steps.values() if not x.ended]
+            span = Span(self.trace_id, name, parent_id=self.root.span_id, kind=SPAN_KIND_CLIENT,
+                        attributes=attributes, links=running, trace=self)
+            self.spans.append(span)
+            return span
+
+    def end(self, error: Optional[str] = None):
+        with self.lock:
+            for span in self.steps.values():
+                if not span.ended:
+                    span.attributes['solver.step.unfinished'] = True
+                    span.end()
+            self.root.end(error)
+            self.exported = True
+            spans = [x for x in self.spans if x.ended]
+        self.tracer.export(spans)
+
+    def call_ended(self, span: Span):
+        with self.lock:
+            if not self.exported:
+                return
+        self.tracer.export([span])
+
+    pass
+
+
+class Tracer:
+    """
+    Writes the traces of solves as OTLP/JSON lines (one `ExportTraceServiceRequest` per trace) to a local file,
+    which the OpenTelemetry collector can read with its `otlpjsonfile` receiver. disabled without a file
+    """
+
+    def __init__(self, service_name: str = 'openspg-solver-api'):
+        self.service_name = service_name
+        self.filename = None
+        self.lock = threading.Lock()
+
+    def configure(self, filename: Optional[str]):
+        self.filename = filename
+        if filename:
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+            logger.info(f'write solver traces to {filename}')
+
+    @property
+    def enabled(self) -> bool:
+        return self.filename is not None
+
+    @staticmethod
+    def new_trace_id() -> str:
+        return os.urandom(16).hex()
+
+    def start(self, name: str, trace_id: Optional[str] = None, **attributes) -> Optional[Trace]:
+        """
+        :return: None when tracing is disabled
+        """
+        if not self.enabled:
+            return None
+        return Trace(self, trace_id or self.new_trace_id(), name, attributes)
+
+    def export(self, spans: List[Span]):
+        request = {'resourceSpans': [{
+            'resource': {'attributes': encode_attributes({'service.name': self.service_name})},
+            'scopeSpans': [{
+                'scope': {'name': 'openspg.solver'},
+                'spans': [x.to_otlp() for x in spans],
+            }],
+        }]}
+        line = dumps_json(request) + b'\n'
+        try:
+            with self.lock, open(self.filename, 'ab') as f:
+                f.write(line)
+        except OSError as e:
+            logger.error(f'failed to write trace to {self.filename}: {e}')
+
+    pass
+
+
+TRACER = Tracer()
+
+# the trace of the solve running in the current context, followed into the tasks and threads the solver starts
+CURRENT_TRACE: ContextVar[Optional[Trace]] = ContextVar('openspg_trace', default=None)
+
+
+def start_call_span(name: str, **attributes) -> Optional[Span]:
+    """
+    a span for an upstream call made by the current solve, None outside a traced solve.
+    must be ended, an open span is not exported
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        return None
+    return trace.start_call(name, attributes)
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import random
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Any, Generator, Optional, Tuple, Type
+
+import httpx
+
+from app.metrics import counter, histogram
+from app.openspg.service.event_queue import EventQueue
+
+logger = logging.getLogger()
+
+UPSTREAM_LATENCY = histogram('openspg_upstream_latency_seconds',
+                             'Latency of the upstream LLM and embedding calls, to the first token for streams',
+                             ['kind', 'model'])
+UPSTREAM_STREAMS_ABORTED = counter('openspg_upstream_streams_aborted_total',
+                                   'Upstream token streams closed before their end, e.g. after a client left',
+                                   ['client'])
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class UpstreamPool:
+    """
+    Shared connection pools for upstream LLM / embedding services.
+
+    - one keep-alive `httpx.AsyncClient` per base_url, shared by all projects and requests
+    - the clients live on a dedicated I/O event loop, so solvers on any loop (or thread) can use them
+    - HTTP/2 needs the `h2` package (`httpx[http2]` in requirements.txt), without it HTTP/1.1 is used and a warning
+      is logged with the first client
+    - the pool settings of a base_url are fixed by its first user
+    """
+
+    def __init__(self):
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self.lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(target=self._run_loop, args=(loop,),
+                                                    name='upstream-io', daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def get_client(self,
+                   base_url: str,
+                   max_connections: int = 100,
+                   max_keepalive_connections: int = 20,
+                   keepalive_expiry: float = 30,
+                   connect_timeout: float = 10,
+                   read_timeout: float = 120) -> httpx.AsyncClient:
+        with self.lock:
+            client = self.clients.get(base_url)
+            if client is None:
+                if not HTTP2_AVAILABLE and not self.clients:
+                    logger.warning('h2 is not installed, upstream calls use HTTP/1.1, install httpx[http2] for HTTP/2')
+                client = httpx.AsyncClient(
+                    http2=HTTP2_AVAILABLE,
+                    limits=httpx.Limits(max_connections=max_connections,
+                                        max_keepalive_connections=max_keepalive_connections,
+                                        keepalive_expiry=keepalive_expiry),
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                )
+                self.clients[base_url] = client
+                logger.info(f'upstream pool for {base_url}: http2={HTTP2_AVAILABLE}, '
+                            f'max_connections={max_connections}')
+            return client
+
+    def submit(self, coro: Awaitable[Any]) -> Future:
+        """
+        run a coroutine on the I/O loop, from any thread
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def run(self, coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        await a coroutine on the I/O loop from another loop, cancelling the caller cancels it
+        """
+        if asyncio.get_running_loop() is self._loop:
+            return await coro_factory()
+        future = self.submit(coro_factory())
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def close(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients.clear()
+        if self._loop is not None:
+            for client in clients:
+                self.submit(client.aclose()).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop = None
+
+    pass
+
+
+UPSTREAM = UpstreamPool()
+
+
+class TokenStream(EventQueue):
+    """
+    Tokens of a streaming upstream response, produced on the I/O loop.
+
+    consumed like an EventQueue, with `for` from a thread or `async for` from any loop without blocking a thread.
+    `close()` by the consumer cancels the upstream request
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__(maxsize=maxsize)
+        self.future: Optional[Future] = None
+
+    def finish(self, error: Optional[BaseException] = None):
+        """
+        end of stream, called by the producer
+        """
+        super().close(error)
+
+    def close(self, error: Optional[BaseException] = None):
+        super().close(error)
+        if self.future is not None:
+            self.future.cancel()
+
+    pass
+
+
+def close_token_stream(stream: Any, client: str = 'llm') -> bool:
+    """
+    close a token stream (TokenStream or generator) the consumer gives up on, which cancels its upstream request
+    :return: True if the stream had not finished, i.e. upstream work was saved
+    """
+    if isinstance(stream, TokenStream):
+        aborted = stream.future is None or not stream.future.done()
+    elif isinstance(stream, Generator):
+        aborted = stream.gi_frame is not None
+    else:
+        aborted = False
+    try:
+        if hasattr(stream, 'close'):
+            stream.close()
+    except ValueError:
+        # still pulled by another thread, left to the garbage collector
+        pass
+    if aborted:
+        UPSTREAM_STREAMS_ABORTED.labels(client=client).inc()
+    return aborted
+
+
+async def retry_with_backoff(fn: Callable[[], Awaitable[Any]],
+                             retryable: Tuple[Type[BaseException], ...],
+                             max_retries: int = 3,
+                             backoff: float = 0.5,
+                             backoff_max: float = 8) -> Any:
+    """
+    retry fn on the retryable errors with exponential backoff and full jitter
+    """
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except retryable as e:
+            if attempt >= max_retries:
+                raise
+            delay = random.uniform(0, min(backoff_max, backoff * 2 ** attempt))
+            attempt += 1
+            logger.warning(f'upstream call failed ({type(e).__name__}: {e}), retry {attempt} in {delay:.2f}s')
+            await asyncio.sleep(delay)
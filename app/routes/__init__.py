@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 
+from app.openspg.api.batch_api import mount_routes as mount_batch_routes
 from app.openspg.api.openai_api import mount_routes as mount_openai_routes
 from app.routes.app_routes import mount_routes as mount_app_routes
 
@@ -10,5 +11,6 @@ def mount_all_routes(app: FastAPI, args):
     """
     mount_app_routes(app, args)
     mount_openai_routes(app, args)
+    mount_batch_routes(app, args)
 
     return app
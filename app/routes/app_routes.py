@@ -1,10 +1,15 @@
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.openapi.docs import get_swagger_ui_html
-from starlette.responses import JSONResponse, RedirectResponse, HTMLResponse
+from starlette.responses import JSONResponse, RedirectResponse, HTMLResponse, PlainTextResponse
 from starlette.staticfiles import StaticFiles
 
+from app.authz.authorize import authenticate, reload_api_keys
+from app.metrics import REGISTRY
+from app.openspg.service.refresher import get_refresher
+from app.openspg.service.service_loader import get_service_loader
+
 
 def mount_routes(app: FastAPI, args):
     """
@@ -16,6 +21,9 @@ def mount_routes(app: FastAPI, args):
 
     api_prefix = f'{args.servlet}'
 
+    # API keys rotated in their file are picked up without a restart
+    get_refresher(interval=args.refresh_interval).add('api_keys', reload_api_keys)
+
     @app.exception_handler(Exception)
     async def handle_exception(request, exc):
         """
@@ -31,6 +39,24 @@ def mount_routes(app: FastAPI, args):
     async def redirect_swagger_document():
         return RedirectResponse(url=f'{api_prefix}/docs')
 
+    # prometheus metrics, behind the API keys unless --public-metrics
+    @app.get(f'{api_prefix}/metrics', include_in_schema=False,
+             dependencies=[] if args.public_metrics else [Depends(authenticate)])
+    async def metrics() -> PlainTextResponse:
+        return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+    # liveness, the server answers while the KAG service loads
+    @app.get(f'{api_prefix}/healthz', include_in_schema=False)
+    async def healthz() -> JSONResponse:
+        status = get_service_loader().status()
+        return JSONResponse(status, status_code=200 if status['live'] else 503)
+
+    # readiness, the KAG service is loaded and its first projects are warm
+    @app.get(f'{api_prefix}/readyz', include_in_schema=False)
+    async def readyz() -> JSONResponse:
+        status = get_service_loader().status()
+        return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
     # swagger documentation
     @app.get(f'{api_prefix}/docs', include_in_schema=False)
     async def swagger_ui_html() -> HTMLResponse:
@@ -1,8 +1,18 @@
 """
 Toolkit
 """
+import dataclasses
+import json
+import math
 from enum import Enum
-from typing import Any
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def remove_empty_fields(source: Any):
@@ -21,6 +31,94 @@ def remove_empty_fields(source: Any):
     return source
 
 
+SCALAR_TYPES = frozenset([str, int, bool, type(None)])
+
+
+def check_float(value: float):
+    if value != value or value in (math.inf, -math.inf):
+        raise ValueError(f'Out of range float values are not JSON compliant: {value}')
+
+
+def prune_empty_fields(source: Any, allow_nan: bool = True):
+    """
+    like remove_empty_fields, but containers without a None field are returned as they are, not copied.
+    pydantic models and dataclasses become dicts, enums are kept for the json encoder
+    :param allow_nan: False to raise ValueError on NaN and infinite floats, which json does not have
+    """
+    source_type = type(source)
+    if source_type is dict:
+        result = source
+        for k, v in source.items():
+            value_type = type(v)
+            if value_type in SCALAR_TYPES:
+                if v is None:
+                    if result is source:
+                        result = {x: y for x, y in source.items() if y is not None}
+                continue
+            if value_type is float:
+                if not allow_nan:
+                    check_float(v)
+                continue
+            pruned = prune_empty_fields(v, allow_nan)
+            if pruned is not v:
+                if result is source:
+                    result = {x: y for x, y in source.items() if y is not None}
+                result[k] = pruned
+        return result
+
+    if source_type is list or source_type is tuple:
+        result = source
+        for i, v in enumerate(source):
+            value_type = type(v)
+            if value_type in SCALAR_TYPES:
+                continue
+            if value_type is float:
+                if not allow_nan:
+                    check_float(v)
+                continue
+            pruned = prune_empty_fields(v, allow_nan)
+            if pruned is not v:
+                if result is source:
+                    result = list(source)
+                result[i] = pruned
+        return result
+
+    # subclasses (OrderedDict, defaultdict, namedtuple...) are pruned as plain containers
+    if isinstance(source, dict):
+        return prune_empty_fields(dict(source), allow_nan)
+
+    if isinstance(source, (list, tuple)):
+        return prune_empty_fields(list(source), allow_nan)
+
+    if isinstance(source, BaseModel):
+        return prune_empty_fields(source.model_dump(exclude_none=True), allow_nan)
+
+    if dataclasses.is_dataclass(source) and not isinstance(source, type):
+        return prune_empty_fields({f.name: getattr(source, f.name) for f in dataclasses.fields(source)}, allow_nan)
+
+    if not allow_nan and isinstance(source, float):
+        check_float(source)
+    return source
+
+
+def dumps_json(source: Any, default: Optional[Callable[[Any], Any]] = None, allow_nan: bool = True) -> bytes:
+    """
+    compact utf-8 json, with orjson when it is installed
+    @:param default: converts the objects json can not encode
+    @:param allow_nan: False to reject NaN and infinite floats in the json module. orjson writes them as null,
+                       `prune_empty_fields(allow_nan=False)` rejects them before encoding
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(source, default=default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers over 64 bits or lone surrogates, which the json module still encodes
+            pass
+    # lone surrogates only occur inside json strings, where backslashreplace gives a valid \udXXX escape
+    return json.dumps(source, ensure_ascii=False, separators=(',', ':'), default=default, allow_nan=allow_nan) \
+        .encode('utf-8', 'backslashreplace')
+
+
 def write_fake_config(filename: str, service_url: str, debug_level='INFO'):
     """
     create a fake config file before KAG loaded
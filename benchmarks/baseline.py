@@ -0,0 +1,58 @@
+"""
+saving benchmark results and comparing them with a baseline run, to catch regressions
+"""
+import json
+from typing import Dict, List, Set
+
+Results = Dict[str, Dict[str, float]]
+
+
+def save_results(filename: str, results: Results):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f'results saved to {filename}')
+
+
+def find_regressions(results: Results, baseline_filename: str, higher_is_better: Set[str],
+                     tolerance: float) -> List[str]:
+    """
+    :param results: metrics of each case, e.g. {"concurrency=8": {"ttft_p99": 0.3}}
+    :param higher_is_better: the metrics that regress when they drop, the others regress when they rise
+    :param tolerance: relative change allowed, e.g. 0.2 for 20%
+    :return: a line per regressed metric
+    """
+    with open(baseline_filename, 'r', encoding='utf-8') as f:
+        baseline: Results = json.load(f)
+
+    regressions = []
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(case, {}).get(metric)
+            # NaN when there was no sample
+            if old is None or old != old or value != value:
+                continue
+            if old == 0:
+                if metric not in higher_is_better and value > 0:
+                    regressions.append(f'{case} {metric}: 0 -> {value:.4g}')
+                continue
+            change = (value - old) / old
+            if (metric in higher_is_better and change < -tolerance) or \
+                    (metric not in higher_is_better and change > tolerance):
+                regressions.append(f'{case} {metric}: {old:.4g} -> {value:.4g} ({change:+.0%})')
+    return regressions
+
+
+def report_regressions(results: Results, baseline_filename: str, higher_is_better: Set[str],
+                       tolerance: float) -> bool:
+    """
+    print the regressions against the baseline
+    :return: True if there is none
+    """
+    regressions = find_regressions(results, baseline_filename, higher_is_better, tolerance)
+    if not regressions:
+        print(f'no regression against {baseline_filename} (tolerance {tolerance:.0%})')
+        return True
+    print(f'{len(regressions)} regressions against {baseline_filename} (tolerance {tolerance:.0%}):')
+    for line in regressions:
+        print(f'  {line}')
+    return False
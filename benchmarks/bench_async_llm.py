@@ -0,0 +1,124 @@
+"""
+Streaming LLM client benchmark: tokens per second and threads under concurrency,
+stream_openai_llm (one blocked thread per stream) vs async_openai_llm (shared pool on the I/O loop)
+
+starts benchmarks.stub_openai_server in a subprocess
+
+    python -m benchmarks.bench_async_llm --concurrency 1 16 64 256 --tokens 100 --tokens-per-second 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+def start_stub_server(port: int, args) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.stub_openai_server', '--port', str(port), '--ttft', str(args.ttft),
+        '--tokens', str(args.tokens), '--tokens-per-second', str(args.tokens_per_second),
+    ])
+    for _ in range(100):
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/v1/models', timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('stub server did not start')
+
+
+class ThreadCounter:
+    """
+    samples the number of live threads while a run is going on
+    """
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.01)
+
+    def stop(self) -> int:
+        self.running = False
+        self.thread.join()
+        return self.peak
+
+    pass
+
+
+def run_sync(llm, concurrency: int) -> int:
+    def consume(idx):
+        return sum(1 for x in llm(f'question {idx}') if x)
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return sum(executor.map(consume, range(concurrency)))
+
+
+async def run_async(llm, concurrency: int) -> int:
+    async def consume(idx):
+        count = 0
+        async for x in await llm.acall(f'question {idx}'):
+            if x:
+                count += 1
+        return count
+
+    return sum(await asyncio.gather(*[consume(x) for x in range(concurrency)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_async_llm')
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[1, 16, 64, 256])
+    parser.add_argument('--port', type=int, default=18000)
+    parser.add_argument('--ttft', type=float, default=0.2)
+    parser.add_argument('--tokens', type=int, default=100)
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    args = parser.parse_args()
+
+    os.environ['KAG_PROJECT_ID'] = '1'
+    os.environ['KAG_PROJECT_HOST_ADDR'] = 'http://127.0.0.1:8887'
+
+    from app.openspg.service.kag_additions.async_openai_llm import AsyncOpenAIClient
+    from app.openspg.service.kag_additions.stream_openai_llm import StreamOpenAIClient
+
+    # one log line per upstream request would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+
+    server = start_stub_server(args.port, args)
+    try:
+        base_url = f'http://127.0.0.1:{args.port}/v1'
+        sync_llm = StreamOpenAIClient(api_key='stub', base_url=base_url, model='stub')
+        async_llm = AsyncOpenAIClient(base_url=base_url, model='stub', api_key='stub',
+                                      max_connections=max(args.concurrency))
+
+        print(f'tokens per answer: {args.tokens}, upstream rate: {args.tokens_per_second} tokens/s per stream')
+        for concurrency in args.concurrency:
+            for name, run in [
+                ('stream_openai_llm', lambda: run_sync(sync_llm, concurrency)),
+                ('async_openai_llm', lambda: asyncio.run(run_async(async_llm, concurrency))),
+            ]:
+                counter = ThreadCounter()
+                start_time = time.perf_counter()
+                tokens = run()
+                elapsed = time.perf_counter() - start_time
+                peak_threads = counter.stop()
+                print(f'  concurrency {concurrency:4}  {name:<18} {tokens / elapsed:10,.0f} tokens/s'
+                      f'  {elapsed:6.2f}s  peak threads: {peak_threads}')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
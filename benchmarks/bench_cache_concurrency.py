@@ -0,0 +1,121 @@
+"""
+Cache concurrency benchmark: gunicorn-style worker processes hitting the same cache root
+
+compares the previous single-FileLock layout with the lock-free-read storages
+
+    python -m benchmarks.bench_cache_concurrency --workers 8 --operations 2000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from filelock import FileLock, Timeout
+
+from app.metrics import REGISTRY
+from app.openspg.service.cache.storage import FileCacheStorage, create_cache_storage
+
+
+class SingleLockFileStorage(FileCacheStorage):
+    """
+    the previous layout, kept here as baseline: every read and write takes one lock per cache root,
+    a lock timeout is a silent miss
+    """
+
+    def __init__(self, cache_root: str):
+        super().__init__(cache_root)
+        self.root_lock = FileLock(os.path.join(cache_root, 'lockfile.lock'))
+        self.timeouts = 0
+
+    def get(self, key: str):
+        fullname = self.get_filename(key)
+        if not os.path.exists(fullname):
+            return None
+        try:
+            with self.root_lock.acquire(timeout=5):
+                with open(fullname, 'r', encoding='utf-8') as f:
+                    return json.loads(f.read())
+        except Timeout:
+            self.timeouts += 1
+            return None
+
+    def put(self, key: str, record: dict):
+        fullname = self.get_filename(key)
+        os.makedirs(os.path.dirname(fullname), exist_ok=True)
+        try:
+            with self.root_lock.acquire(timeout=5):
+                with open(fullname, 'w', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False, indent=4))
+        except Timeout:
+            self.timeouts += 1
+
+
+def create_storage(storage_type: str, cache_root: str):
+    if storage_type == 'single-lock':
+        return SingleLockFileStorage(cache_root)
+    return create_cache_storage(storage_type, cache_root)
+
+
+def lock_events(cache_root: str) -> int:
+    total = 0
+    for metric in REGISTRY.collect():
+        if metric.name in ['openspg_cache_lock_contention_total', 'openspg_cache_lock_timeouts_total']:
+            total += sum(child.get() for labels, child in metric.collect() if labels.get('cache_root') == cache_root)
+    return int(total)
+
+
+def worker(storage_type: str, cache_root: str, keys: list, operations: int, write_ratio: float, seed: int):
+    random.seed(seed)
+    storage = create_storage(storage_type, cache_root)
+    hits = 0
+    start_time = time.perf_counter()
+    for _ in range(operations):
+        key = random.choice(keys)
+        if random.random() < write_ratio:
+            storage.put(key, {'request': {'prompt': key}, 'response': 'answer ' * 50})
+        elif storage.get(key) is not None:
+            hits += 1
+    elapsed = time.perf_counter() - start_time
+    contention = storage.timeouts if isinstance(storage, SingleLockFileStorage) else lock_events(cache_root)
+    storage.close()
+    return elapsed, hits, contention
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_cache_concurrency')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--operations', type=int, default=2000)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    keys = [f'{random.getrandbits(128):032x}' for _ in range(args.keys)]
+    context = multiprocessing.get_context('fork')
+
+    print(f'workers: {args.workers}, operations per worker: {args.operations}, write ratio: {args.write_ratio}')
+    for storage_type in ['single-lock', 'file', 'sqlite']:
+        with tempfile.TemporaryDirectory() as cache_root:
+            seed_storage = create_storage(storage_type, cache_root)
+            seed_storage.put_many({x: {'request': {'prompt': x}, 'response': 'answer ' * 50} for x in keys[::2]})
+            seed_storage.close()
+
+            start_time = time.perf_counter()
+            with context.Pool(args.workers) as pool:
+                results = pool.starmap(worker, [
+                    (storage_type, cache_root, keys, args.operations, args.write_ratio, seed)
+                    for seed in range(args.workers)
+                ])
+            elapsed = time.perf_counter() - start_time
+
+            total_ops = args.workers * args.operations
+            hits = sum(x[1] for x in results)
+            contention = sum(x[2] for x in results)
+            print(f'  {storage_type:<12} {total_ops / elapsed:10,.0f} ops/s'
+                  f'  hits: {hits:8}  lock contention/timeouts: {contention}')
+
+
+if __name__ == '__main__':
+    main()
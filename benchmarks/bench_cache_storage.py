@@ -0,0 +1,93 @@
+"""
+Cache storage benchmark: lookups per second and disk size of each storage backend
+
+    python -m benchmarks.bench_cache_storage --entries 20000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app.openspg.service.cache.storage import CACHE_STORAGES, create_cache_storage
+from app.openspg.service.kag_additions.cacheable_llm import CacheManager
+
+
+def build_records(entries: int, dimensions: int):
+    records = {}
+    for idx in range(entries):
+        if idx % 2:
+            prompt = f'question {idx}: ' + 'lorem ipsum dolor sit amet ' * 20
+            response = 'answer ' * 100
+        else:
+            prompt = f'text chunk {idx}'
+            response = [random.uniform(-1, 1) for _ in range(dimensions)]
+        records[CacheManager.get_cache_key(prompt)] = {
+            'request': {'prompt': prompt, 'params': {'model': 'bench'}},
+            'response': response,
+        }
+    return records
+
+
+def disk_usage(path: str):
+    """
+    allocated bytes (including block padding) and number of files
+    """
+    allocated, files = 0, 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            allocated += os.stat(os.path.join(dirpath, filename)).st_blocks * 512
+            files += 1
+    return allocated, files
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_cache_storage')
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--dimensions', type=int, default=1024)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    records = build_records(args.entries, args.dimensions)
+    keys = list(records.keys())
+    lookup_keys = [random.choice(keys) for _ in range(args.lookups)]
+    missing_keys = [CacheManager.get_cache_key(f'missing {x}') for x in range(args.lookups)]
+
+    print(f'entries: {args.entries}, lookups: {args.lookups}')
+    # the embedding storages only keep vectors, see bench_embedding_store
+    for storage_type in [x for x in CACHE_STORAGES.keys() if not x.startswith('embedding')]:
+        with tempfile.TemporaryDirectory() as cache_root:
+            storage = create_cache_storage(storage_type, cache_root)
+
+            start_time = time.perf_counter()
+            items = list(records.items())
+            for idx in range(0, len(items), 1000):
+                storage.put_many(dict(items[idx:idx + 1000]))
+            write_elapsed = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            for key in lookup_keys:
+                storage.get(key)
+            hit_rate = args.lookups / (time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            for key in missing_keys:
+                storage.get(key)
+            miss_rate = args.lookups / (time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            for idx in range(0, len(lookup_keys), args.batch_size):
+                storage.get_many(lookup_keys[idx:idx + args.batch_size])
+            batch_rate = args.lookups / (time.perf_counter() - start_time)
+
+            storage.close()
+            allocated, files = disk_usage(cache_root)
+            print(f'  {storage_type:<8} write: {args.entries / write_elapsed:10,.0f}/s'
+                  f'  hit: {hit_rate:10,.0f}/s  miss: {miss_rate:10,.0f}/s'
+                  f'  batched hit: {batch_rate:10,.0f}/s'
+                  f'  disk: {allocated / 1024 / 1024:8.1f} MiB in {files} files')
+
+
+if __name__ == '__main__':
+    main()
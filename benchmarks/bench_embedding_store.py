@@ -0,0 +1,80 @@
+"""
+Embedding storage benchmark: disk size and hit latency of JSON records vs the binary embedding storage
+
+    python -m benchmarks.bench_embedding_store --entries 20000 --dimensions 1024
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from app.openspg.service.cache.storage import create_cache_storage
+from app.openspg.service.kag_additions.cacheable_llm import CacheManager
+from benchmarks.bench_cache_storage import disk_usage
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_embedding_store')
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--dimensions', type=int, default=1024)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    vectors = np.random.uniform(-1, 1, (args.entries, args.dimensions)).astype(np.float32)
+    records = {
+        CacheManager.get_cache_key(f'text chunk {idx}'): {
+            'request': {'prompt': f'text chunk {idx}', 'params': {'model': 'bench'}},
+            'response': vector.tolist(),
+        } for idx, vector in enumerate(vectors)
+    }
+    keys = list(records.keys())
+    lookup_keys = [random.choice(keys) for _ in range(args.lookups)]
+
+    print(f'entries: {args.entries}, dimensions: {args.dimensions}, lookups: {args.lookups}')
+    for storage_type in ['file', 'sqlite', 'embedding', 'embedding_f16']:
+        with tempfile.TemporaryDirectory() as cache_root:
+            storage = create_cache_storage(storage_type, cache_root)
+            items = list(records.items())
+            for idx in range(0, len(items), 1000):
+                storage.put_many(dict(items[idx:idx + 1000]))
+            storage.close()
+
+            # a fresh instance, so that the index is loaded from disk like after a restart
+            start_time = time.perf_counter()
+            storage = create_cache_storage(storage_type, cache_root)
+            open_elapsed = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            for key in lookup_keys:
+                storage.get(key)['response']
+            hit_elapsed = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            for key in lookup_keys:
+                np.asarray(storage.get(key)['response'], dtype=np.float32)
+            array_elapsed = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            for key in lookup_keys:
+                response = storage.get(key)['response']
+                response.tolist() if isinstance(response, np.ndarray) else response
+            list_elapsed = time.perf_counter() - start_time
+
+            error = max(
+                float(np.max(np.abs(np.asarray(storage.get(key)['response'], dtype=np.float32) - vectors[idx])))
+                for idx, key in enumerate(keys[:100])
+            )
+            storage.close()
+            allocated, files = disk_usage(cache_root)
+            print(f'  {storage_type:<14} disk: {allocated / 1024 / 1024:8.1f} MiB in {files:5} files'
+                  f'  open: {open_elapsed * 1000:7.1f} ms'
+                  f'  hit: {hit_elapsed / args.lookups * 1e6:7.1f} us'
+                  f'  as ndarray: {array_elapsed / args.lookups * 1e6:7.1f} us'
+                  f'  as list: {list_elapsed / args.lookups * 1e6:7.1f} us'
+                  f'  max error: {error:.1e}')
+
+
+if __name__ == '__main__':
+    main()
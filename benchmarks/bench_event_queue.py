@@ -0,0 +1,124 @@
+"""
+EventQueue benchmark: idle CPU per open stream and handoff throughput
+
+    python -m benchmarks.bench_event_queue --streams 16 --duration 3
+"""
+import argparse
+import asyncio
+import threading
+import time
+from typing import Generator, Any
+
+from app.openspg.service.event_queue import EventQueue
+
+
+class BusyPollEventQueue(Generator):
+    """
+    the previous implementation, kept here as baseline
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def __next__(self):
+        if len(self.events) > 0:
+            with self.lock:
+                event = self.events.pop(0)
+            if event is None:
+                raise StopIteration
+            return event
+
+    def send(self, event: Any):
+        with self.lock:
+            self.events.append(event)
+
+    def throw(self, typ, val=None, tb=None):
+        pass
+
+
+def measure_idle_threads(queue_factory, streams: int, duration: float):
+    queues = [queue_factory() for _ in range(streams)]
+
+    def consume(queue):
+        for _ in queue:
+            pass
+
+    threads = [threading.Thread(target=consume, args=(x,), daemon=True) for x in queues]
+    for thread in threads:
+        thread.start()
+
+    cpu_start = time.process_time()
+    time.sleep(duration)
+    cpu_used = time.process_time() - cpu_start
+
+    for queue in queues:
+        queue.send(None)
+    for thread in threads:
+        thread.join(timeout=1)
+    return cpu_used
+
+
+def measure_idle_asyncio(streams: int, duration: float):
+    async def run():
+        queues = [EventQueue() for _ in range(streams)]
+
+        async def consume(queue):
+            async for _ in queue:
+                pass
+
+        tasks = [asyncio.create_task(consume(x)) for x in queues]
+        cpu_start = time.process_time()
+        await asyncio.sleep(duration)
+        cpu_used = time.process_time() - cpu_start
+
+        for queue in queues:
+            queue.close()
+        await asyncio.gather(*tasks)
+        return cpu_used
+
+    return asyncio.run(run())
+
+
+def measure_throughput(events: int, maxsize: int):
+    queue = EventQueue(maxsize=maxsize)
+
+    def produce():
+        for idx in range(events):
+            queue.send(idx)
+        queue.close()
+
+    producer = threading.Thread(target=produce)
+    start = time.perf_counter()
+    producer.start()
+    for _ in queue:
+        pass
+    elapsed = time.perf_counter() - start
+    producer.join()
+    return events / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_event_queue')
+    parser.add_argument('--streams', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--maxsize', type=int, default=1024)
+    args = parser.parse_args()
+
+    print(f'idle streams: {args.streams}, duration: {args.duration}s')
+    for name, measure in [
+        ('busy-poll (baseline)', lambda: measure_idle_threads(BusyPollEventQueue, args.streams, args.duration)),
+        ('EventQueue / threads', lambda: measure_idle_threads(EventQueue, args.streams, args.duration)),
+        ('EventQueue / asyncio', lambda: measure_idle_asyncio(args.streams, args.duration)),
+    ]:
+        cpu_used = measure()
+        per_stream = cpu_used / args.duration / args.streams * 100
+        print(f'  {name:<24} cpu: {cpu_used:8.3f}s  per stream: {per_stream:8.3f}% of a core')
+
+    throughput = measure_throughput(args.events, args.maxsize)
+    print(f'handoff throughput (maxsize={args.maxsize}): {throughput:,.0f} events/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+JSONResponse rendering benchmark on large payloads: remove_empty_fields + json.dumps (before)
+vs the current JSONResponse.render
+
+    python -m benchmarks.bench_json_response --models 20000 --batch-results 5000
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_json_response')
+    parser.add_argument('--models', type=int, default=20000)
+    parser.add_argument('--batch-results', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from app.fastapi_extends.responses import JSONResponse
+    from app.openspg.api.model.openai_model import ModelCard, ModelList
+    from app.utils import orjson, remove_empty_fields
+
+    def legacy_render(content: Any) -> bytes:
+        return json.dumps(remove_empty_fields(content), ensure_ascii=False, allow_nan=False, indent=None,
+                          separators=(",", ":")).encode("utf-8")
+
+    model_list = ModelList(data=[ModelCard(id=f'openspg/Project{i}') for i in range(args.models)])
+    answer = {
+        'model': 'openspg/TwoWiki', 'id': 'chat-8f14e45fceea167a5a36dedd4bea2543', 'object': 'chat.completion',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': '周杰伦为电影创作了主题曲。' * 20},
+                     'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 1200, 'completion_tokens': 300, 'total_tokens': 1500}, 'timing': {'solve': 3.2},
+    }
+    batch_results = [{'id': f'batch_1-{i}', 'index': i, 'custom_id': f'q{i}', 'status': 'completed',
+                      'response': answer} for i in range(args.batch_results)]
+    payloads = [
+        # what fastapi hands to the response class: plain data, None fields already dropped by the response model
+        ('model list', model_list.model_dump(exclude_none=True)),
+        ('model list with nulls', model_list.model_dump()),
+        ('batch results', {'object': 'list', 'data': batch_results}),
+        ('batch results with nulls', {'object': 'list', 'data': [dict(x, error=None) for x in batch_results]}),
+    ]
+
+    def measure(fn: Callable[[Any], bytes], content: Any) -> float:
+        best = float('inf')
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            fn(content)
+            best = min(best, time.perf_counter() - start_time)
+        return best
+
+    render = JSONResponse(None).render
+    print(f'json encoder: {"orjson" if orjson is not None else "json"}')
+    for label, content in payloads:
+        assert json.loads(render(content)) == json.loads(legacy_render(content)), label
+        before = measure(legacy_render, content)
+        after = measure(render, content)
+        print(f'  {label:<26} {len(render(content)) / 1024 / 1024:6.1f} MiB'
+              f'  before: {before * 1000:7.1f} ms  after: {after * 1000:7.1f} ms  x{before / after:.1f}')
+
+    start_time = time.perf_counter()
+    render(model_list)
+    print(f'  {"model list (pydantic)":<26} after: {(time.perf_counter() - start_time) * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
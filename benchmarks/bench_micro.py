@@ -0,0 +1,148 @@
+"""
+Microbenchmarks of the request hot path: CacheManager lookups, the non-streaming chat completion
+response (build_chat_completion + JSONResponse rendering) and EventQueue handoffs
+
+    python -m benchmarks.bench_micro --duration 1
+
+results can be saved with --output and compared with a previous run with --baseline, the exit code is 1
+on a regression
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict
+
+from benchmarks.baseline import report_regressions, save_results
+
+
+def measure(fn: Callable[[int], None], duration: float, batch: int = 100) -> float:
+    """
+    call fn(i) in batches until duration seconds are spent
+    :return: calls per second
+    """
+    calls = 0
+    start_time = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            fn(calls)
+            calls += 1
+        elapsed = time.perf_counter() - start_time
+        if elapsed >= duration:
+            return calls / elapsed
+
+
+def bench_cache(args, work_dir: str) -> Dict[str, float]:
+    from app.openspg.service.kag_additions.cacheable_llm import CacheManager
+
+    manager = CacheManager()
+    memory_root = manager.register(os.path.join(work_dir, 'memory'), {'model': 'bench'}, storage=args.storage,
+                                   memory_entries=args.entries)
+    storage_root = manager.register(os.path.join(work_dir, 'storage'), {'model': 'bench'}, storage=args.storage,
+                                    memory_entries=0)
+    prompts = [[{'role': 'user', 'content': f'question {x} ' * 8}] for x in range(args.entries)]
+    for cache_root in [memory_root, storage_root]:
+        manager.write_many(cache_root, [(x, f'answer {idx}') for idx, x in enumerate(prompts)])
+        manager.read(cache_root, prompts[0])
+
+    return {
+        'cache read (memory hit)': measure(lambda i: manager.read(memory_root, prompts[i % len(prompts)]),
+                                           args.duration),
+        f'cache read ({args.storage} hit)': measure(lambda i: manager.read(storage_root, prompts[i % len(prompts)]),
+                                                    args.duration),
+        'cache read (miss)': measure(lambda i: manager.read(memory_root, f'missing {i}'), args.duration),
+        'cache get_or_compute (hit)': measure(
+            lambda i: manager.get_or_compute(memory_root, prompts[i % len(prompts)], lambda: 'computed'),
+            args.duration),
+        'cache get_or_compute (miss)': measure(
+            lambda i: manager.get_or_compute(memory_root, f'new {i}', lambda: 'computed'), args.duration, batch=10),
+    }
+
+
+def bench_chat_completion(args) -> Dict[str, float]:
+    from app.fastapi_extends.responses import render_json
+    from app.openspg.api.openai_api import build_chat_completion
+
+    answer = 'Jay Chou wrote the theme songs of his films. ' * 20
+    usage = {'prompt_tokens': 1200, 'completion_tokens': 300, 'total_tokens': 1500}
+
+    def build(i: int):
+        return build_chat_completion('openspg/BaiKe', f'chat-{i}', answer, usage, 3.2)
+
+    response = build(0)
+    return {
+        'build_chat_completion': measure(build, args.duration),
+        'render chat completion': measure(lambda i: render_json(response), args.duration),
+        'build + render': measure(lambda i: render_json(build(i)), args.duration),
+    }
+
+
+def bench_event_queue(args) -> Dict[str, float]:
+    from app.openspg.service.event_queue import EventQueue
+
+    queue = EventQueue()
+
+    def send_and_receive(i: int):
+        queue.send(i)
+        next(queue)
+
+    results = {'event queue send + next (same thread)': measure(send_and_receive, args.duration)}
+
+    async def thread_to_loop() -> float:
+        # a solver thread sending events to the server loop, as in a streamed completion
+        events = EventQueue()
+
+        def produce():
+            deadline = time.perf_counter() + args.duration
+            while time.perf_counter() < deadline:
+                for i in range(100):
+                    events.send(i)
+            events.close()
+
+        count = 0
+        start_time = time.perf_counter()
+        producer = threading.Thread(target=produce)
+        producer.start()
+        async for _ in events:
+            count += 1
+        producer.join()
+        return count / (time.perf_counter() - start_time)
+
+    results['event queue thread -> async for'] = asyncio.run(thread_to_loop())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_micro')
+    parser.add_argument('--duration', type=float, default=1, help='seconds per case')
+    parser.add_argument('--entries', type=int, default=2000, help='cache entries')
+    parser.add_argument('--storage', type=str, default='sqlite', help='storage of the cache')
+    parser.add_argument('--output', type=str, default=None, help='save the results as json')
+    parser.add_argument('--baseline', type=str, default=None, help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    os.environ.setdefault('KAG_PROJECT_ID', '1')
+    os.environ.setdefault('KAG_PROJECT_HOST_ADDR', 'http://127.0.0.1:8887')
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        rates = bench_cache(args, work_dir)
+    rates.update(bench_chat_completion(args))
+    rates.update(bench_event_queue(args))
+
+    results = {}
+    for case, rate in rates.items():
+        print(f'{case:<40} {rate:>12,.0f} ops/s {1e6 / rate:>9.2f} us/op')
+        results[case] = {'ops_per_second': rate}
+
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline and not report_regressions(results, args.baseline, {'ops_per_second'}, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Micro-batching benchmark: concurrent single-text vectorize calls (as issued by in-flight solves)
+against a delegate with a fixed round trip, one text per call, adaptive batches, and batches with a window.
+every mode gets the same --max-inflight upstream calls
+
+    python -m benchmarks.bench_micro_batching --concurrency 4 16 64 --duration 3 --latency 0.03
+"""
+import argparse
+import itertools
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_micro_batching')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16, 64])
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument('--latency', type=float, default=0.03, help='seconds per upstream round trip')
+    parser.add_argument('--max-rate', type=float, default=1000, help='upstream calls per second')
+    parser.add_argument('--max-inflight', type=int, default=8, help='upstream calls in flight, in every mode')
+    args = parser.parse_args()
+
+    os.environ['KAG_PROJECT_ID'] = '1'
+    os.environ['KAG_PROJECT_HOST_ADDR'] = 'http://127.0.0.1:8887'
+
+    from kag.interface import VectorizeModelABC
+    from app.openspg.service.kag_additions.cacheable_llm import CacheableVectorizeModel
+
+    upstream_calls = []
+
+    @VectorizeModelABC.register('bench_latency_vectorizer', exist_ok=True)
+    class LatencyVectorizer(VectorizeModelABC):
+        def __init__(self, **kwargs):
+            super().__init__('bench_latency_vectorizer')
+
+        def vectorize(self, texts):
+            upstream_calls.append(len(texts))
+            time.sleep(args.latency + 0.0001 * len(texts))
+            return [[float(len(x)), 1.0, 0.0, 0.0] for x in texts]
+
+    print(f'upstream round trip: {args.latency * 1000:.0f} ms, {args.max_inflight} upstream calls in flight')
+    for concurrency, (label, batch_size, batch_window) in itertools.product(
+            args.concurrency, [('per call', 1, 0), ('adaptive', 32, 0), ('window', 32, 0.005)]):
+        upstream_calls.clear()
+        with tempfile.TemporaryDirectory() as cache_root:
+            model = CacheableVectorizeModel(delegate_type='bench_latency_vectorizer', cache_root=cache_root,
+                                            cache_storage='embedding', memory_cache_entries=0,
+                                            batch_size=batch_size, batch_window=batch_window,
+                                            max_inflight_batches=args.max_inflight,
+                                            max_rate=args.max_rate)
+            latencies = []
+            lock = threading.Lock()
+            deadline = time.perf_counter() + args.duration
+
+            def worker():
+                while time.perf_counter() < deadline:
+                    start_time = time.perf_counter()
+                    model.vectorize(uuid.uuid4().hex)
+                    with lock:
+                        latencies.append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                for _ in range(concurrency):
+                    executor.submit(worker)
+            elapsed = time.perf_counter() - start_time
+
+            latencies.sort()
+            print(f'  callers: {concurrency:>3} {label:<9} {len(latencies) / elapsed:8,.0f} texts/s'
+                  f'  {len(upstream_calls) / elapsed:8,.0f} upstream calls/s'
+                  f'  mean batch: {statistics.mean(upstream_calls):5.1f}'
+                  f'  p50: {latencies[len(latencies) // 2] * 1000:6.1f} ms'
+                  f'  p99: {latencies[int(len(latencies) * 0.99)] * 1000:6.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Solver pool benchmark: time to first event with and without pooled solver pipelines
+
+requires a running OpenSPG server and the project configs in --openspg-config
+
+    python -m benchmarks.bench_solver_pool --project BaiKe --query "周杰伦曾经为哪些自己出演的电影创作主题曲？"
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+
+async def measure_first_event(service, project: str, query: str, rounds: int):
+    latencies = []
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        first_event = None
+        async for _ in service.stream_query(query, project):
+            if first_event is None:
+                first_event = time.perf_counter() - start_time
+        latencies.append(first_event if first_event is not None else time.perf_counter() - start_time)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_solver_pool')
+    parser.add_argument('--openspg-service', type=str, default='http://127.0.0.1:8887')
+    parser.add_argument('--openspg-config', type=str, default='config')
+    parser.add_argument('--openspg-modules', type=str, nargs='*', default=[])
+    parser.add_argument('--project', type=str, required=True)
+    parser.add_argument('--query', type=str, required=True)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    os.environ['KAG_PROJECT_ID'] = '1'
+    os.environ['KAG_PROJECT_HOST_ADDR'] = args.openspg_service
+    from app.openspg.service.kag_service import KagService
+
+    for pool_size in [0, args.pool_size]:
+        service = KagService(args.openspg_service, args.openspg_config, args.openspg_modules,
+                             solver_pool_size=pool_size, solver_pool_warmup=1 if pool_size else 0)
+        latencies = asyncio.run(measure_first_event(service, args.project, args.query, args.rounds))
+        service.executor.shutdown()
+        print(f'pool size {pool_size}: time to first event '
+              f'mean {statistics.mean(latencies) * 1000:.1f}ms, '
+              f'min {min(latencies) * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+SSE chunk encoding benchmark: chunks per second of the pydantic path (build the chunk models, model_dump_json,
+frame as a server-sent event) vs the precompiled ChatChunkEncoder, for tokens and reporter events
+
+    python -m benchmarks.bench_sse_chunks --chunks 20000
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_sse_chunks')
+    parser.add_argument('--chunks', type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ['KAG_PROJECT_ID'] = '1'
+    os.environ['KAG_PROJECT_HOST_ADDR'] = 'http://127.0.0.1:8887'
+
+    from sse_starlette.sse import EventSourceResponse, ensure_bytes
+    from app.openspg.api.model.openai_model import ChatCompletionResponse, ChatCompletionResponseStreamChoice, \
+        DeltaMessage
+    from app.openspg.api.openai_api import ChatChunkEncoder
+    from app.utils import orjson
+
+    model_id, message_id = 'openspg/TwoWiki', 'chat-8f14e45fceea167a5a36dedd4bea2543'
+    sep = EventSourceResponse.DEFAULT_SEPARATOR
+
+    def pydantic_chunk(content: Any) -> bytes:
+        # the chunk builder before ChatChunkEncoder
+        default_encoder = lambda x: x.__dict__ if hasattr(x, '__dict__') else str(x)
+        content = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False,
+                                                                      default=default_encoder)
+        chunk = ChatCompletionResponse(
+            model=model_id,
+            id=message_id,
+            choices=[ChatCompletionResponseStreamChoice(
+                index=0, delta=DeltaMessage(role='assistant', content=content), finish_reason=None)],
+            object='chat.completion.chunk'
+        )
+        return ensure_bytes(chunk.model_dump_json(exclude_unset=True, exclude_none=True), sep)
+
+    encoder = ChatChunkEncoder(model_id, message_id)
+    tokens = [f'tok{i} "quoted"\n' if i % 10 == 0 else f'词{i}' for i in range(args.chunks)]
+    events = [{'event': 'changed', 'data': {
+        'segment': 'thinker', 'report_id': 'Iterative planning_1', 'tag_name': 'Iterative planning_1',
+        'content': 'step ' * (i % 200), 'status': 'RUNNING', 'report_time': 1760000000.0 + i, 'time': 1760000000.0 + i,
+    }} for i in range(args.chunks // 4)]
+
+    for token in tokens[:100]:
+        assert encoder.encode(token) == pydantic_chunk(token), token
+
+    def measure(fn: Callable[[Any], bytes], items: list) -> float:
+        start_time = time.perf_counter()
+        for x in items:
+            fn(x)
+        return len(items) / (time.perf_counter() - start_time)
+
+    print(f'json encoder: {"orjson" if orjson is not None else "json"}')
+    for label, items in [('tokens', tokens), ('reporter events', events)]:
+        slow = measure(pydantic_chunk, items)
+        fast = measure(encoder.encode, items)
+        print(f'  {label:<16} pydantic: {slow:10,.0f} chunks/s   encoder: {fast:10,.0f} chunks/s   x{fast / slow:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Startup time of the API server: starts api.py again and again with the stand-in solver of
+benchmarks/stub_kag_modules and reports, from the process start, the time until /healthz answers (live),
+until /readyz answers 200 (the first projects are warm), and until the first streamed answer is complete,
+with the startup stages reported by /readyz. cases:
+
+- server: the OpenSPG stand-in answers right away
+- slow_server: it answers after --openspg-delay seconds, more than the --openspg-timeout of api.py,
+  the project list comes from the snapshot saved by the previous case
+- server_down: no OpenSPG server at all, the project list comes from the snapshot
+
+    python -m benchmarks.bench_startup --projects 20 --runs 3
+
+results can be saved with --output and compared with a previous run with --baseline, the exit code is 1
+on a regression
+"""
+import argparse
+import asyncio
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.baseline import report_regressions, save_results
+from benchmarks.load_test import PROJECT_CONFIG, ROOT_DIR, free_port, send_request, start, wait_ready
+
+CASES = ['server', 'slow_server', 'server_down']
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        # the slow OpenSPG stand-in waits for its pending project lists on a graceful shutdown
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def poll(process: subprocess.Popen, url: str, start_time: float, timeout: float) -> Optional[httpx.Response]:
+    """
+    :return: the first 200 response of the url, None if the process does not answer within the timeout
+    """
+    while time.perf_counter() - start_time < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f'api.py exited with {process.returncode}')
+        try:
+            response = httpx.get(url, timeout=1)
+            if response.status_code == 200:
+                return response
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def run_once(args, openspg_url: str, llm_url: str, config_dir: str, snapshot: str, model: str,
+             work_dir: str, log_file) -> Dict[str, float]:
+    api_port = free_port()
+    base_url = f'http://127.0.0.1:{api_port}/api'
+    start_time = time.perf_counter()
+    api = start([sys.executable, 'api.py', '--port', str(api_port), '--openspg-service', openspg_url,
+                 '--openspg-config', config_dir, '--openspg-timeout', str(args.openspg_timeout),
+                 '--openspg-modules', os.path.join(ROOT_DIR, 'benchmarks', 'stub_kag_modules'),
+                 '--project-snapshot', snapshot, '--batch-dir', os.path.join(work_dir, 'batches'),
+                 *shlex.split(args.api_args)], log_file)
+    try:
+        if poll(api, f'{base_url}/healthz', start_time, args.startup_timeout) is None:
+            raise RuntimeError(f'api.py not live after {args.startup_timeout}s')
+        live = time.perf_counter() - start_time
+        status = poll(api, f'{base_url}/readyz', start_time, args.startup_timeout)
+        if status is None:
+            raise RuntimeError(f'api.py not ready after {args.startup_timeout}s')
+        ready = time.perf_counter() - start_time
+
+        async def first_answer():
+            async with httpx.AsyncClient(timeout=None) as client:
+                return await send_request(client, f'{base_url}/openspg/v1/chat/completions', args.api_key, model,
+                                          args.query)
+
+        result = asyncio.run(first_answer())
+        if result.error:
+            raise RuntimeError(f'first request failed: {result.error}')
+        answered = time.perf_counter() - start_time
+    finally:
+        stop(api)
+
+    stages = status.json().get('stages', {})
+    return {
+        'live_s': live,
+        'ready_s': ready,
+        'first_answer_s': answered,
+        **{f'{name}_s': seconds for name, seconds in stages.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_startup')
+    parser.add_argument('--cases', type=str, nargs='+', default=CASES, choices=CASES)
+    parser.add_argument('--runs', type=int, default=3, help='starts per case, the median is reported')
+    parser.add_argument('--projects', type=int, default=20, help='project configs in the config dir')
+    parser.add_argument('--openspg-delay', type=float, default=30,
+                        help='seconds the slow OpenSPG stand-in takes to answer the project list')
+    parser.add_argument('--openspg-timeout', type=float, default=2, help='--openspg-timeout of api.py')
+    parser.add_argument('--query', type=str, default='Which movies did Jay Chou write theme songs for?')
+    parser.add_argument('--api-key', type=str, default='none')
+    parser.add_argument('--api-args', type=str, default='',
+                        help='more arguments of api.py, e.g. "--ready-projects=0"')
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--output', type=str, default=None, help='save the results as json')
+    parser.add_argument('--baseline', type=str, default=None, help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    openspg_port, llm_port = free_port(), free_port()
+    openspg_url, llm_url = f'http://127.0.0.1:{openspg_port}', f'http://127.0.0.1:{llm_port}'
+    namespaces = [f'BenchProject{idx + 1}' for idx in range(args.projects)]
+
+    work_dir = tempfile.TemporaryDirectory(prefix='openspg-bench-startup-')
+    config_dir = os.path.join(work_dir.name, 'config')
+    os.makedirs(config_dir)
+    for idx, namespace in enumerate(namespaces):
+        with open(os.path.join(config_dir, f'{namespace}.yaml'), 'w', encoding='utf-8') as f:
+            f.write(PROJECT_CONFIG.format(project_id=idx + 1, namespace=namespace, openspg_url=openspg_url,
+                                          llm_url=llm_url, llm_type='stream_openai_llm', dimensions=256,
+                                          sub_questions=1))
+    snapshot = os.path.join(work_dir.name, 'snapshots', 'projects.json')
+    if args.cases[0] != 'server':
+        # the snapshot the other cases start from is saved by a normal start
+        args.cases.insert(0, 'server')
+
+    log_filename = os.path.join(work_dir.name, 'servers.log')
+    log_file = open(log_filename, 'w')
+    llm = start([sys.executable, '-m', 'benchmarks.stub_openai_server', '--port', str(llm_port),
+                 '--ttft', '0', '--tokens', '10', '--tokens-per-second', '1000', '--dimensions', '256'], log_file)
+    results = {}
+    try:
+        wait_ready(llm, f'{llm_url}/v1/models', args.startup_timeout)
+        print(f'{"case":>12} {"live":>7} {"ready":>7} {"answer":>7}  stages')
+        for case in args.cases:
+            openspg: Optional[subprocess.Popen] = None
+            if case != 'server_down':
+                delay = args.openspg_delay if case == 'slow_server' else 0
+                openspg = start([sys.executable, '-m', 'benchmarks.stub_openspg_server', '--port', str(openspg_port),
+                                 '--projects', *namespaces, '--delay', str(delay)], log_file)
+                # any route answers once the stand-in listens, the project list may be slow on purpose
+                wait_ready(openspg, f'{openspg_url}/', args.startup_timeout)
+            try:
+                runs: List[Dict[str, float]] = [
+                    run_once(args, openspg_url, llm_url, config_dir, snapshot, f'openspg/{namespaces[0]}',
+                             work_dir.name, log_file)
+                    for _ in range(args.runs)
+                ]
+            finally:
+                if openspg is not None:
+                    stop(openspg)
+            row = {k: statistics.median(x[k] for x in runs) for k in runs[0]}
+            results[case] = row
+            stages = ' '.join(f'{k[:-2]}={v:.2f}' for k, v in row.items()
+                              if k not in ('live_s', 'ready_s', 'first_answer_s'))
+            print(f'{case:>12} {row["live_s"]:>7.2f} {row["ready_s"]:>7.2f} {row["first_answer_s"]:>7.2f}  {stages}')
+        print(f'seconds from the process start, median of {args.runs} runs, {args.projects} projects')
+    except Exception:
+        log_file.flush()
+        with open(log_filename, 'r') as f:
+            print(''.join(f.readlines()[-40:]), file=sys.stderr)
+        raise
+    finally:
+        stop(llm)
+        log_file.close()
+
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline and not report_regressions(results, args.baseline, set(), args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
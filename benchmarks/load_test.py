@@ -0,0 +1,336 @@
+"""
+Load test of the API server against local stand-ins: starts benchmarks.stub_openspg_server (projects),
+benchmarks.stub_openai_server (streaming LLM and embeddings) and api.py with the stand-in solver of
+benchmarks/stub_kag_modules, then drives streamed chat completions at each concurrency level and reports
+time to first event / answer token, total latency, throughput, server CPU per stream and server RSS
+
+    python -m benchmarks.load_test --concurrency 1 8 32 --requests-per-stream 4 --ttft 0.2 --tokens 100
+
+results can be saved with --output and compared with a previous run with --baseline, the exit code is 1
+on a regression
+"""
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+import httpx
+
+from benchmarks.baseline import report_regressions, save_results
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROJECT_CONFIG = """
+project:
+  id: {project_id}
+  namespace: {namespace}
+  host_addr: {openspg_url}
+  language: en
+
+vectorize_model: &vectorize_model
+  type: openai
+  api_key: stub
+  base_url: {llm_url}/v1
+  model: stub-embedding
+  vector_dimensions: {dimensions}
+
+chat_llm: &chat_llm
+  type: {llm_type}
+  api_key: stub
+  base_url: {llm_url}/v1
+  model: stub
+
+kag_solver_pipeline:
+  type: bench_pipeline
+  llm_client: *chat_llm
+  vectorize_model: *vectorize_model
+  sub_questions: {sub_questions}
+"""
+
+HIGHER_IS_BETTER = {'requests_per_second', 'tokens_per_second', 'ok'}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(process: subprocess.Popen, url: str, timeout: float, ready=lambda response: True):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{" ".join(process.args)} exited with {process.returncode}')
+        try:
+            if ready(httpx.get(url, timeout=1)):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} not ready after {timeout}s')
+
+
+def process_stats(pid: int) -> Tuple[float, int]:
+    """
+    :return: cpu seconds (user + system) and rss bytes of a process
+    """
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        times = process.cpu_times()
+        return times.user + times.system, process.memory_info().rss
+    except ImportError:
+        pass
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    with open(f'/proc/{pid}/statm', 'r') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return cpu_seconds, rss
+
+
+def is_answer_token(content: str) -> bool:
+    """
+    whether a reporter event (full or delta mode) carries text of the answer
+    """
+    try:
+        event = json.loads(content)
+    except ValueError:
+        return bool(content)
+    if not isinstance(event, dict) or not isinstance(event.get('data'), dict):
+        return False
+    data = event['data']
+    if event.get('event') == 'delta':
+        return data.get('report_id') == 'Final Answer' and 'content' in data.get('append', {})
+    return data.get('segment') == 'answer' and bool(data.get('content'))
+
+
+class RequestResult:
+
+    def __init__(self):
+        self.first_event: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.events = 0
+        self.error: Optional[str] = None
+
+    pass
+
+
+async def send_request(client: httpx.AsyncClient, url: str, api_key: str, model: str, query: str) -> RequestResult:
+    result = RequestResult()
+    body = {'model': model, 'stream': True, 'messages': [{'role': 'user', 'content': query}]}
+    start_time = time.perf_counter()
+    try:
+        async with client.stream('POST', url, json=body, headers={'Authorization': f'Bearer {api_key}'}) as response:
+            if response.status_code != 200:
+                result.error = f'HTTP {response.status_code}'
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                now = time.perf_counter() - start_time
+                result.events += 1
+                if result.first_event is None:
+                    result.first_event = now
+                if result.first_token is None:
+                    choices = json.loads(data).get('choices') or [{}]
+                    content = (choices[0].get('delta') or {}).get('content')
+                    if content and is_answer_token(content):
+                        result.first_token = now
+        result.latency = time.perf_counter() - start_time
+    except httpx.HTTPError as e:
+        result.error = type(e).__name__
+    return result
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+async def run_level(args, url: str, models: List[str], concurrency: int, pid: int) -> dict:
+    counter = iter(range(1 << 30))
+    results: List[RequestResult] = []
+    peak_rss = 0
+    running = True
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while running:
+            peak_rss = max(peak_rss, process_stats(pid)[1])
+            await asyncio.sleep(0.1)
+
+    async def worker(client: httpx.AsyncClient):
+        for _ in range(args.requests_per_stream):
+            idx = next(counter)
+            # distinct queries, so that the embedding cache of a cacheable vectorizer does not hide the upstream
+            query = f'{args.query} #{concurrency}-{idx}'
+            results.append(await send_request(client, url, args.api_key, models[idx % len(models)], query))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        sampler = asyncio.create_task(sample_rss())
+        cpu_before = process_stats(pid)[0]
+        start_time = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start_time
+        cpu_used = process_stats(pid)[0] - cpu_before
+        running = False
+        await sampler
+
+    ok = [x for x in results if x.error is None]
+    first_events = [x.first_event for x in ok if x.first_event is not None]
+    first_tokens = [x.first_token for x in ok if x.first_token is not None]
+    latencies = [x.latency for x in ok]
+    return {
+        'ok': len(ok),
+        'errors': len(results) - len(ok),
+        'ttfe_p50': percentile(first_events, 50),
+        'ttfe_p99': percentile(first_events, 99),
+        'ttft_p50': percentile(first_tokens, 50),
+        'ttft_p99': percentile(first_tokens, 99),
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'requests_per_second': len(ok) / elapsed,
+        'tokens_per_second': len(ok) * args.tokens / elapsed,
+        'events_per_request': statistics.mean([x.events for x in ok]) if ok else 0,
+        'cpu_ms_per_stream': cpu_used / max(1, len(ok)) * 1000,
+        'rss_mib': peak_rss / 1024 / 1024,
+    }
+
+
+def print_level(concurrency: int, row: dict):
+    print(f'{concurrency:>5} {row["ok"]:>5} {row["errors"]:>4}'
+          f' {row["ttfe_p50"] * 1000:>7.0f} {row["ttfe_p99"] * 1000:>7.0f}'
+          f' {row["ttft_p50"] * 1000:>7.0f} {row["ttft_p99"] * 1000:>7.0f}'
+          f' {row["latency_p50"] * 1000:>7.0f} {row["latency_p99"] * 1000:>7.0f}'
+          f' {row["requests_per_second"]:>7.2f} {row["tokens_per_second"]:>8.0f}'
+          f' {row["cpu_ms_per_stream"]:>7.1f} {row["rss_mib"]:>7.1f}')
+
+
+def start(command: List[str], log_file) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=ROOT_DIR, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='load_test')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests-per-stream', type=int, default=4,
+                        help='requests sent one after another by each concurrent client')
+    parser.add_argument('--warmup-requests', type=int, default=2)
+    parser.add_argument('--projects', type=int, default=1)
+    parser.add_argument('--query', type=str, default='Which movies did Jay Chou write theme songs for?')
+    parser.add_argument('--api-key', type=str, default='none')
+    parser.add_argument('--llm-type', type=str, default='stream_openai_llm',
+                        choices=['stream_openai_llm', 'async_openai_llm'])
+    parser.add_argument('--sub-questions', type=int, default=2, help='embedding calls per request')
+    parser.add_argument('--ttft', type=float, default=0.2, help='seconds before the first token of the stub LLM')
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--tokens', type=int, default=100, help='tokens per answer')
+    parser.add_argument('--embedding-latency', type=float, default=0.02)
+    parser.add_argument('--dimensions', type=int, default=256)
+    parser.add_argument('--api-args', type=str, default='',
+                        help='more arguments of api.py, e.g. "--report-mode=delta --solver-loops=2"')
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--output', type=str, default=None, help='save the results as json')
+    parser.add_argument('--baseline', type=str, default=None, help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    openspg_port, llm_port, api_port = free_port(), free_port(), free_port()
+    openspg_url, llm_url = f'http://127.0.0.1:{openspg_port}', f'http://127.0.0.1:{llm_port}'
+    api_url = f'http://127.0.0.1:{api_port}/api/openspg/v1'
+    namespaces = [f'BenchProject{idx + 1}' for idx in range(args.projects)]
+
+    work_dir = tempfile.TemporaryDirectory(prefix='openspg-load-test-')
+    config_dir = os.path.join(work_dir.name, 'config')
+    os.makedirs(config_dir)
+    for idx, namespace in enumerate(namespaces):
+        with open(os.path.join(config_dir, f'{namespace}.yaml'), 'w', encoding='utf-8') as f:
+            f.write(PROJECT_CONFIG.format(project_id=idx + 1, namespace=namespace, openspg_url=openspg_url,
+                                          llm_url=llm_url, llm_type=args.llm_type, dimensions=args.dimensions,
+                                          sub_questions=args.sub_questions))
+
+    log_filename = os.path.join(work_dir.name, 'servers.log')
+    log_file = open(log_filename, 'w')
+    processes = []
+    try:
+        processes.append(start([sys.executable, '-m', 'benchmarks.stub_openspg_server', '--port', str(openspg_port),
+                                '--projects', *namespaces], log_file))
+        processes.append(start([sys.executable, '-m', 'benchmarks.stub_openai_server', '--port', str(llm_port),
+                                '--ttft', str(args.ttft), '--tokens-per-second', str(args.tokens_per_second),
+                                '--tokens', str(args.tokens), '--embedding-latency', str(args.embedding_latency),
+                                '--dimensions', str(args.dimensions)], log_file))
+        wait_ready(processes[0], f'{openspg_url}/public/v1/project', args.startup_timeout)
+        wait_ready(processes[1], f'{llm_url}/v1/models', args.startup_timeout)
+
+        start_time = time.perf_counter()
+        api = start([sys.executable, 'api.py', '--port', str(api_port), '--openspg-service', openspg_url,
+                     '--openspg-config', config_dir,
+                     '--openspg-modules', os.path.join(ROOT_DIR, 'benchmarks', 'stub_kag_modules'),
+                     '--batch-dir', os.path.join(work_dir.name, 'batches'),
+                     *shlex.split(args.api_args)], log_file)
+        processes.append(api)
+        wait_ready(api, f'{api_url}/models', args.startup_timeout,
+                   ready=lambda response: len(response.json().get('data', [])) == len(namespaces))
+        print(f'api server ready in {time.perf_counter() - start_time:.1f}s,'
+              f' rss {process_stats(api.pid)[1] / 1024 / 1024:.1f} MiB ({args.llm_type}, {args.projects} projects, stub ttft {args.ttft}s, {args.tokens} tokens'
+              f' at {args.tokens_per_second}/s)')
+
+        models = [f'openspg/{x}' for x in namespaces]
+        url = f'{api_url}/chat/completions'
+
+        async def run_all():
+            async with httpx.AsyncClient(timeout=None) as client:
+                for idx in range(args.warmup_requests):
+                    warmup = await send_request(client, url, args.api_key, models[idx % len(models)], f'warm up {idx}')
+                    if warmup.error:
+                        raise RuntimeError(f'warm up request failed: {warmup.error}')
+            print(f'{"conc":>5} {"ok":>5} {"err":>4} {"ttfe50":>7} {"ttfe99":>7} {"ttft50":>7} {"ttft99":>7}'
+                  f' {"lat50":>7} {"lat99":>7} {"req/s":>7} {"tok/s":>8} {"cpu ms":>7} {"rss MiB":>7}')
+            results = {}
+            for concurrency in args.concurrency:
+                row = await run_level(args, url, models, concurrency, api.pid)
+                print_level(concurrency, row)
+                results[f'concurrency={concurrency}'] = row
+            return results
+
+        results = asyncio.run(run_all())
+        print('times in ms, cpu ms is the server CPU time per stream, rss MiB the peak server RSS')
+    except Exception:
+        log_file.flush()
+        with open(log_filename, 'r') as f:
+            print(''.join(f.readlines()[-40:]), file=sys.stderr)
+        raise
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log_file.close()
+
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline and not report_regressions(results, args.baseline, HIGHER_IS_BETTER, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
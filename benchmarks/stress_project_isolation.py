@@ -0,0 +1,115 @@
+"""
+Concurrency stress test: many concurrent solves across projects must each see their own project's config
+
+runs without an OpenSPG server, the solver pipeline is replaced by a probe that checks the KAG config
+at build time, on the solver loop, inside `asyncio.to_thread` and inside the thread pools the KAG retrievers
+create (`ThreadPoolExecutor()` of kag_retriever.utils, `concurrent.futures.ThreadPoolExecutor()` of kag_flow),
+also nested and in a pool created before any solve
+
+    python -m benchmarks.stress_project_isolation --requests 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='stress_project_isolation')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--solver-loops', type=int, default=4)
+    parser.add_argument('--max-concurrent-solves', type=int, default=64)
+    args = parser.parse_args()
+
+    os.environ['KAG_PROJECT_ID'] = '1'
+    os.environ['KAG_PROJECT_HOST_ADDR'] = 'http://127.0.0.1:8887'
+
+    from kag.common.conf import KAG_CONFIG, KAG_PROJECT_CONF, KAGConfigAccessor
+    from kag.interface import SolverPipelineABC
+    from kag.solver.executor.retriever.local_knowledge_base.kag_retriever import kag_flow, utils as kag_utils
+
+    from app.openspg.service.kag_service import KagService
+
+    def snapshot():
+        return (
+            str(KAG_PROJECT_CONF.project_id),
+            KAG_PROJECT_CONF.namespace,
+            KAG_CONFIG.all_config['probe']['namespace'],
+            KAGConfigAccessor.get_config().global_config.namespace,
+        )
+
+    # looked up when called, as the KAG modules do
+    kag_pools = [lambda workers: kag_utils.ThreadPoolExecutor(workers),
+                 lambda workers: kag_flow.concurrent.futures.ThreadPoolExecutor(workers)]
+    # created before any solve, its threads never saw a project context
+    shared_pools = []
+
+    def nested_snapshot():
+        with kag_pools[0](2) as executor:
+            return executor.submit(snapshot).result()
+
+    @SolverPipelineABC.register('isolation_probe', exist_ok=True)
+    class IsolationProbePipeline(SolverPipelineABC):
+
+        def __init__(self, **kwargs):
+            super().__init__()
+            self.built_with = snapshot()
+
+        async def ainvoke(self, query, **kwargs):
+            seen = [self.built_with, snapshot()]
+            for _ in range(3):
+                await asyncio.sleep(random.random() / 100)
+                seen.append(snapshot())
+                seen.append(await asyncio.to_thread(snapshot))
+            # what the KAG retrievers do: a blocking pool created (or shared) inside the solve
+            for pool in kag_pools:
+                with pool(2) as executor:
+                    seen.extend(executor.map(lambda fn: fn(), [snapshot, nested_snapshot]))
+            seen.append(shared_pools[0].submit(snapshot).result())
+            return seen
+
+    projects = {
+        name: {
+            'project': {'id': project_id, 'namespace': name, 'host_addr': 'http://127.0.0.1:8887'},
+            'probe': {'namespace': name},
+            'kag_solver_pipeline': {'type': 'isolation_probe'},
+        }
+        for name, project_id in [('TwoWiki', 2), ('BaiKe', 3), ('Medicine', 4)]
+    }
+
+    class LocalKagService(KagService):
+
+        def load_project_list(self):
+            self.config_map.update(projects)
+
+    service = LocalKagService('http://127.0.0.1:8887', tempfile.mkdtemp(), [],
+                              solver_loops=args.solver_loops, max_concurrent_solves=args.max_concurrent_solves)
+    shared_pools.append(kag_pools[1](8))
+
+    async def run_all():
+        names = [random.choice(list(projects.keys())) for _ in range(args.requests)]
+        results = await asyncio.gather(*[
+            service.executor.run(lambda name=name: service.query('probe', name)) for name in names
+        ])
+        return list(zip(names, results))
+
+    start_time = time.perf_counter()
+    results = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start_time
+
+    failures = 0
+    for name, seen in results:
+        expected = (str(projects[name]['project']['id']), name, name, name)
+        if not isinstance(seen, list) or any(x != expected for x in seen):
+            failures += 1
+            print(f'MISMATCH {name}: {seen}')
+
+    print(f'{len(results)} solves across {len(projects)} projects in {elapsed:.2f}s, {failures} mismatches')
+    service.executor.shutdown()
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
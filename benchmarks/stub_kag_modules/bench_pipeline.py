@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+
+from kag.interface import LLMClient, SolverPipelineABC, VectorizeModelABC
+
+logger = logging.getLogger()
+
+
+@SolverPipelineABC.register("bench_pipeline")
+class BenchPipeline(SolverPipelineABC):
+    """
+    A stand-in solver for load tests, without the graph and search services of OpenSPG:
+    a planning step, a retrieval (one embedding call) per sub-question and a streamed answer,
+    reported like the KAG pipelines report them
+    """
+
+    def __init__(self, llm_client: LLMClient, vectorize_model: VectorizeModelABC, sub_questions: int = 2):
+        super().__init__()
+        self.llm_client = llm_client
+        self.vectorize_model = vectorize_model
+        self.sub_questions = sub_questions
+
+    async def ainvoke(self, query, reporter=None, **kwargs):
+        def report(segment, tag_name, content, status, **report_kwargs):
+            if reporter:
+                reporter.add_report_line(segment, tag_name, content, status, **report_kwargs)
+
+        planning = 'Static planning 0'
+        report('thinker', planning, '', 'RUNNING')
+        sub_queries = [f'{query} ({idx + 1})' for idx in range(self.sub_questions)]
+        report('thinker', planning, '\n'.join(sub_queries), 'FINISH')
+
+        memory = []
+        for idx, sub_query in enumerate(sub_queries):
+            step = f'step_{idx}'
+            retriever = f'begin_sub_kag_retriever_{sub_query}_chunk'
+            report('thinker', step, sub_query, 'RUNNING')
+            report(step, retriever, sub_query, 'RUNNING')
+            vector = await asyncio.to_thread(self.vectorize_model.vectorize, sub_query)
+            report(step, retriever, f'{len(vector)} dimensions', 'FINISH')
+            memory.append(f'{sub_query}: {sum(vector[:4]):.4f}')
+            report('thinker', step, memory[-1], 'FINISH')
+
+        prompt = f'Answer the question based on the given reference.\n{chr(10).join(memory)}\nQuestion: {query}'
+        report('answer', 'Final Answer', '', 'RUNNING')
+        answer = await asyncio.to_thread(self.llm_client, prompt)
+        if isinstance(answer, AsyncIterator):
+            # an async streaming client (async_openai_llm), read on this loop
+            chunks = []
+            async for chunk in answer:
+                if chunk:
+                    chunks.append(chunk)
+                    report('answer', 'Final Answer', chunk, 'RUNNING', overwrite=False)
+            answer = ''.join(chunks)
+        elif not isinstance(answer, str):
+            # a blocking streaming client (stream_openai_llm), read in a thread
+            answer = await asyncio.to_thread(self.consume, answer, report)
+        report('answer', 'Final Answer', answer, 'FINISH')
+        return answer
+
+    @staticmethod
+    def consume(tokens, report) -> str:
+        chunks = []
+        for chunk in tokens:
+            if chunk:
+                chunks.append(chunk)
+                report('answer', 'Final Answer', chunk, 'RUNNING', overwrite=False)
+        return ''.join(chunks)
+
+    def invoke(self, query, **kwargs):
+        return asyncio.run(self.ainvoke(query, **kwargs))
+
+    pass
@@ -0,0 +1,106 @@
+"""
+A local OpenAI compatible stand-in for benchmarks: streaming chat completions and embeddings
+with configurable latency and token rate
+
+    python -m benchmarks.stub_openai_server --port 18000 --ttft 0.2 --tokens-per-second 50 --tokens 100
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+def create_app(ttft: float = 0.2,
+               tokens_per_second: float = 50,
+               tokens: int = 100,
+               embedding_latency: float = 0.02,
+               dimensions: int = 1024) -> Starlette:
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get('model', 'stub')
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time.time())
+        words = [f'tok{x} ' for x in range(tokens)]
+
+        def chunk(delta: dict, finish_reason=None) -> str:
+            return 'data: ' + json.dumps({
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }) + '\n\n'
+
+        if not body.get('stream'):
+            await asyncio.sleep(ttft + tokens / tokens_per_second)
+            return JSONResponse({
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words)},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': tokens, 'total_tokens': tokens + 10},
+            })
+
+        async def generate():
+            await asyncio.sleep(ttft)
+            yield chunk({'role': 'assistant', 'content': ''})
+            start_time = time.perf_counter()
+            for idx, word in enumerate(words):
+                # paced against the start, so that the rate holds under load
+                delay = start_time + idx / tokens_per_second - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield chunk({'content': word})
+            yield chunk({}, finish_reason='stop')
+            yield 'data: [DONE]\n\n'
+
+        return StreamingResponse(generate(), media_type='text/event-stream')
+
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get('input')
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        await asyncio.sleep(embedding_latency)
+        data = []
+        for idx, text in enumerate(inputs):
+            seed = int.from_bytes(hashlib.md5(str(text).encode('utf-8')).digest()[:4], 'little')
+            vector = np.random.default_rng(seed).uniform(-1, 1, dimensions)
+            data.append({'object': 'embedding', 'index': idx, 'embedding': (vector / np.linalg.norm(vector)).tolist()})
+        return JSONResponse({
+            'object': 'list', 'data': data, 'model': body.get('model', 'stub'),
+            'usage': {'prompt_tokens': len(inputs), 'total_tokens': len(inputs)},
+        })
+
+    async def models(request: Request):
+        return JSONResponse({'object': 'list', 'data': [{'id': 'stub', 'object': 'model', 'owned_by': 'stub'}]})
+
+    return Starlette(routes=[
+        Route('/v1/chat/completions', chat_completions, methods=['POST']),
+        Route('/v1/embeddings', embeddings, methods=['POST']),
+        Route('/v1/models', models, methods=['GET']),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='stub_openai_server')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18000)
+    parser.add_argument('--ttft', type=float, default=0.2, help='seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=50, help='token rate of each stream')
+    parser.add_argument('--tokens', type=int, default=100, help='tokens per answer')
+    parser.add_argument('--embedding-latency', type=float, default=0.02)
+    parser.add_argument('--dimensions', type=int, default=1024)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(ttft=args.ttft, tokens_per_second=args.tokens_per_second, tokens=args.tokens,
+                     embedding_latency=args.embedding_latency, dimensions=args.dimensions)
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
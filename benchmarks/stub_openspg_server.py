@@ -0,0 +1,58 @@
+"""
+A local OpenSPG stand-in for benchmarks: answers the project list of `ProjectClient`
+(`GET /public/v1/project`), which is all the API server asks OpenSPG for at startup
+
+    python -m benchmarks.stub_openspg_server --port 18887 --projects BenchProject
+"""
+import argparse
+import asyncio
+import json
+from typing import List
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+def create_app(projects: List[str], delay: float = 0) -> Starlette:
+    """
+    :param projects: namespaces of the projects, with ids 1, 2, ... in that order
+    :param delay: seconds before the project list is answered, a slow OpenSPG server
+    """
+    records = [{
+        'id': str(idx + 1),
+        'name': namespace,
+        'description': 'benchmark project',
+        'namespace': namespace,
+        'tenantId': '1',
+        'config': json.dumps({}),
+    } for idx, namespace in enumerate(projects)]
+
+    async def list_projects(request: Request):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        project_id = request.query_params.get('projectId')
+        if project_id:
+            return JSONResponse([x for x in records if x['id'] == project_id])
+        return JSONResponse(records)
+
+    return Starlette(routes=[
+        Route('/public/v1/project', list_projects, methods=['GET']),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='stub_openspg_server')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18887)
+    parser.add_argument('--projects', type=str, nargs='+', default=['BenchProject'])
+    parser.add_argument('--delay', type=float, default=0, help='seconds before the project list is answered')
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(args.projects, delay=args.delay), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+import numpy as np
+from filelock import FileLock
+
+from app.openspg.service.cache.embedding_store import EmbeddingCacheStorage
+
+
+def make_key(text: str) -> str:
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def test_append_after_torn_tail(tmp_path):
+    storage = EmbeddingCacheStorage(str(tmp_path))
+    storage.put(make_key('a'), {'response': [1.0, 2.0, 3.0]})
+    # a crash in the middle of the next record
+    with open(storage.data_filename, 'ab') as f:
+        f.write(b'\x00' * 5)
+    with open(storage.index_filename, 'ab') as f:
+        f.write(b'\x00' * 7)
+
+    storage = EmbeddingCacheStorage(str(tmp_path))
+    storage.put_many({make_key('b'): {'response': [4.0, 5.0, 6.0]}, make_key('c'): {'response': [7.0, 8.0, 9.0]}})
+
+    assert os.path.getsize(storage.data_filename) == 3 * storage.record_size
+    assert os.path.getsize(storage.index_filename) == 3 * storage.INDEX_ENTRY.size
+    reader = EmbeddingCacheStorage(str(tmp_path))
+    for text, vector in [('a', [1, 2, 3]), ('b', [4, 5, 6]), ('c', [7, 8, 9])]:
+        np.testing.assert_array_equal(reader.get(make_key(text))['response'], vector)
+
+
+def test_write_skipped_when_lock_is_held(tmp_path):
+    storage = EmbeddingCacheStorage(str(tmp_path), lock_timeout=0.1)
+    with FileLock(os.path.join(str(tmp_path), 'embeddings.lock')):
+        storage.put(make_key('a'), {'response': [1.0, 2.0]})
+    assert storage.get(make_key('a')) is None
+
+    storage.put(make_key('a'), {'response': [1.0, 2.0]})
+    np.testing.assert_array_equal(storage.get(make_key('a'))['response'], [1, 2])
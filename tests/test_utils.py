@@ -0,0 +1,29 @@
+import math
+from collections import OrderedDict, defaultdict, namedtuple
+
+import pytest
+
+from app.utils import prune_empty_fields, remove_empty_fields
+
+
+def test_prune_keeps_containers_without_none():
+    source = {'a': 1, 'b': [1, 'x', {'c': 2.5}]}
+    assert prune_empty_fields(source) is source
+
+
+def test_prune_container_subclasses():
+    Point = namedtuple('Point', ['x', 'y'])
+    source = {
+        'ordered': OrderedDict([('a', 1), ('b', None)]),
+        'default': defaultdict(list, {'a': None, 'b': [OrderedDict(c=None)]}),
+        'point': Point({'x': None}, 2),
+    }
+    expected = {'ordered': {'a': 1}, 'default': {'b': [{}]}, 'point': [{}, 2]}
+    assert prune_empty_fields(source) == expected
+    assert remove_empty_fields(source)['ordered'] == expected['ordered']
+
+
+def test_prune_rejects_nan():
+    assert math.isnan(prune_empty_fields({'a': [math.nan]})['a'][0])
+    with pytest.raises(ValueError):
+        prune_empty_fields({'a': [math.nan]}, allow_nan=False)